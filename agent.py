@@ -1,120 +1,20 @@
 from dotenv import load_dotenv
 load_dotenv()
 from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
 from models import Message, User, Room
 from flask import current_app
 import os
-import json
+import threading
+import time
 from agent_tools import web_search_tool
 from langgraph.prebuilt import create_react_agent
 _llm = None
-_mem_llm = None
-memory_info = {}
-from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
+from langchain_core.messages import HumanMessage, SystemMessage, AIMessage, AIMessageChunk
 from s3_utils import convert_object_key_to_url
+from room_context import room_context
+from room_memory import get_room_memories, format_memories
+from message_index import retrieve_context, format_retrieved
 
-def get_mem_llm():
-    """Get or create the memory extraction LLM instance."""
-    global _mem_llm
-    if _mem_llm is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY environment variable is not set")
-        _mem_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.0, api_key=api_key)
-    return _mem_llm
-
-def memory_decider(room_id, message):
-    """
-    Decide whether message or parts of message should be used for memory and stores info.
-    Returns the extracted memory dict or None if nothing worth remembering.
-    """
-    try:
-        mem_llm = get_mem_llm()
-        memory_prompt = ChatPromptTemplate.from_template("""
-        You are a memory extraction system.
-
-        Extract ONLY stable, long-term information worth remembering.
-        Do NOT infer or guess.
-        If nothing qualifies, return exactly: null
-
-        Rules:
-        - Memory must be explicitly stated
-        - Memory must remain valid beyond this conversation
-        - Ignore jokes, opinions, hypotheticals, and short-term plans
-        - Output JSON only, no markdown formatting
-
-        Allowed memory types:
-        - decision
-        - preference
-        - goal
-        - fact
-        - constraint
-
-        Return format (or null):
-        {{
-        "type": "...",
-        "key": "...",
-        "value": "..."
-        }}
-
-        Message:
-        {message}
-        """)
-
-        chain = memory_prompt | mem_llm
-        response = chain.invoke({"message": message})
-        
-        # Check if response is null
-        content = response.content.strip()
-        if content.lower() == "null" or not content:
-            return None
-        
-        # Parse JSON response
-        try:
-            # Remove markdown code blocks if present
-            if content.startswith("```"):
-                content = content.split("```")[1]
-                if content.startswith("json"):
-                    content = content[4:]
-                content = content.strip()
-            
-            memory = json.loads(content)
-            
-            # Validate structure
-            if not isinstance(memory, dict):
-                return None
-            
-            # Check required fields
-            if "type" not in memory or "key" not in memory or "value" not in memory:
-                return None
-            
-            # Validate memory type
-            allowed_types = ("decision", "preference", "goal", "fact", "constraint")
-            if memory.get("type") not in allowed_types:
-                return None
-            
-            # Store memory for this room
-            if room_id not in memory_info:
-                memory_info[room_id] = []
-            
-            memory_info[room_id].append(memory)
-            
-            return memory
-            
-        except json.JSONDecodeError:
-            # If JSON parsing fails, return None
-            return None
-            
-    except Exception as e:
-        # Log error but don't crash
-        print(f"Error in memory_decider: {e}")
-        return None
-
-def get_room_memories(room_id):
-    """Get stored memories for a room."""
-    return memory_info.get(room_id, [])
-        
 def get_llm():
     """Get or create the LLM instance. Lazy initialization to avoid errors on import."""
     global _llm
@@ -126,87 +26,134 @@ def get_llm():
     return _llm
 
 
-def get_room_conversation_history(room_id, limit=20):
-    """Get recent messages from a room for context."""
-    messages = Message.query.filter_by(room_id=room_id)\
-        .order_by(Message.timestamp.desc())\
-        .limit(limit)\
-        .all()
-    
-    # Reverse to get chronological order
-    messages.reverse()
-    
+def get_room_conversation_history(room_id, limit=20, before=None):
+    """Get recent messages from a room (sent before `before`) for context, served from the in-memory room context."""
     history = []
-    for msg in messages:
-        # Get username
-        user = User.query.get(msg.user_id)
-        username = user.username if user else f"User {msg.user_id}"
-        if msg.content.startswith("[Agent]"):
-            continue
+    for msg in room_context.recent(room_id, limit, before=before):
+        username = msg["username"] or f"User {msg['user_id']}"
 
         multimodal_format = {}
-        if msg.image_url:
-            image_url = convert_object_key_to_url(msg.image_url)
+        if msg["object_key"]:
+            image_url = convert_object_key_to_url(msg["object_key"])
             multimodal_format["type"] = "image"
             multimodal_format["image_url"] = {"url": image_url}
         else:
             multimodal_format["type"] = "text"
-            multimodal_format["content"] = "User: " + username + ": " + msg.content
-      
+            multimodal_format["content"] = "User: " + username + ": " + msg["content"]
+
         history.append(multimodal_format)
 
     return history
 
-def run_agent(user_input, room_id=None):
+
+SYSTEM_PROMPT = (
+    "You are a helpful assistant in a chat room. "
+    "Be concise and helpful. Use conversation history for context. "
+    "Respond in a casual, funny tone. "
+    "You have access to web search tools - use them when needed."
+)
+DEFAULT_TOOLS = (web_search_tool,)
+
+# compiled ReAct graphs keyed by (model, tool names, system prompt).
+# building one compiles the graph and the tool schemas, which is far too
+# slow to do per @agent call; per-call state only goes in through invoke()
+_agent_registry = {}
+_agent_registry_lock = threading.Lock()
+
+
+def _model_key(llm):
+    return (type(llm).__name__, getattr(llm, "model_name", None), getattr(llm, "temperature", None))
+
+
+def get_agent_executor(llm=None, tools=DEFAULT_TOOLS, system_prompt=SYSTEM_PROMPT):
+    """Compiled agent graph for this model / tool set / prompt, built once per process."""
+    llm = llm or get_llm()
+    key = (_model_key(llm), tuple(t.name for t in tools), system_prompt)
+    agent_executor = _agent_registry.get(key)
+    if agent_executor is None:
+        with _agent_registry_lock:
+            agent_executor = _agent_registry.get(key)
+            if agent_executor is None:
+                agent_executor = create_react_agent(llm, list(tools), prompt=system_prompt)
+                _agent_registry[key] = agent_executor
+    return agent_executor
+
+
+def warm_up_agent():
+    """Build the default agent graph ahead of the first @agent call."""
     try:
-        llm = get_llm()
-        tools = [web_search_tool]
-        agent_executor = create_react_agent(llm, tools)
-
-        messages = []
-
-        # 1️ System message
-        messages.append(
-            SystemMessage(
-                content=(
-                    "You are a helpful assistant in a chat room. "
-                    "Be concise and helpful. Use conversation history for context. "
-                    "Respond in a casual, funny tone. "
-                    "You have access to web search tools - use them when needed."
-                )
-            )
-        )
-
-        # 2 Add conversation history properly (structured)
-        if room_id:
-            history = get_room_conversation_history(room_id, limit=10)
-
-            for msg in history:
-                if msg["type"] == "text":
-                    messages.append(
-                        HumanMessage(
-                            content=msg["content"]
-                        )
+        get_agent_executor()
+    except Exception as e:
+        print(f"Agent warm-up skipped: {e}")
+
+
+def build_agent_messages(user_input, room_id=None, before=None):
+    """
+    Room memories, relevant older messages, recent history and the user's
+    input as LangChain messages. The system prompt is part of the compiled
+    agent; memories and retrieved messages depend on the room and the
+    question, so they go in here as extra system messages instead.
+
+    before is when the question was sent: the history stops there, so the
+    question (already in the room context) isn't sent twice.
+    """
+    messages = []
+
+    # 0 What the room asked the agent to remember (see room_memory.py)
+    if room_id:
+        memories = get_room_memories(room_id)
+        if memories:
+            messages.append(SystemMessage(content=format_memories(memories)))
+
+    # 1 Older messages relevant to the question, under a fixed token budget (see message_index.py)
+    if room_id:
+        recent = room_context.recent(room_id, 10, before=before)
+        try:
+            retrieved = retrieve_context(room_id, user_input, before=recent[0]["timestamp"] if recent else None)
+        except Exception as e:
+            print(f"Context retrieval skipped: {e}")
+            retrieved = []
+        if retrieved:
+            messages.append(SystemMessage(content=format_retrieved(retrieved)))
+
+    # 2 Add conversation history properly (structured)
+    if room_id:
+        history = get_room_conversation_history(room_id, limit=10, before=before)
+
+        for msg in history:
+            if msg["type"] == "text":
+                messages.append(
+                    HumanMessage(
+                        content=msg["content"]
                     )
+                )
 
-                elif msg["type"] == "image":
-                    messages.append(
-                        HumanMessage(
-                            content=[
-                                {
-                                    "type": "image_url",
-                                    "image_url": msg["image_url"]
-                                }
-                            ]
-                        )
+            elif msg["type"] == "image":
+                messages.append(
+                    HumanMessage(
+                        content=[
+                            {
+                                "type": "image_url",
+                                "image_url": msg["image_url"]
+                            }
+                        ]
                     )
+                )
+
+    # 3 Add current user input (text only for now)
+    messages.append(
+        HumanMessage(content=user_input)
+    )
+    return messages
+
+
+def run_agent(user_input, room_id=None, before=None):
+    try:
+        agent_executor = get_agent_executor()
 
-        # 3 Add current user input (text only for now)
-        messages.append(
-            HumanMessage(content=user_input)
-        )
+        messages = build_agent_messages(user_input, room_id, before)
 
-        # 4️ Invoke agent
+        # 3 Invoke agent
         response = agent_executor.invoke({
             "messages": messages
         })
@@ -215,3 +162,58 @@ def run_agent(user_input, room_id=None):
 
     except Exception as e:
         return f"Error: {str(e)}"
+
+
+# time to first token of streamed replies, in ms
+streaming_stats = {
+    "replies": 0,
+    "last_ttft_ms": None,
+    "total_ttft_ms": 0.0,
+    "max_ttft_ms": 0.0,
+}
+
+
+def _record_ttft(ttft_ms):
+    streaming_stats["replies"] += 1
+    streaming_stats["last_ttft_ms"] = ttft_ms
+    streaming_stats["total_ttft_ms"] += ttft_ms
+    if ttft_ms > streaming_stats["max_ttft_ms"]:
+        streaming_stats["max_ttft_ms"] = ttft_ms
+
+
+def run_agent_stream(user_input, room_id=None, on_token=None, before=None):
+    """
+    Like run_agent, but streams the reply through LangGraph's stream API.
+
+    on_token(token, message_id) is called for every text token the model
+    produces. A ReAct run can produce more than one AI message (text before
+    a tool call, then the answer), so message_id tells the caller when a new
+    one starts. Returns (reply, ttft_ms); reply is the text of the last AI
+    message, same as run_agent. Unlike run_agent, errors are raised, so the
+    caller can tell the room the reply failed partway through.
+    """
+    started = time.perf_counter()
+    ttft_ms = None
+    agent_executor = get_agent_executor()
+    messages = build_agent_messages(user_input, room_id, before)
+
+    current_id = None
+    parts = []
+    for chunk, metadata in agent_executor.stream({"messages": messages}, stream_mode="messages"):
+        # only model output, not tool results
+        if metadata.get("langgraph_node") != "agent" or not isinstance(chunk, AIMessageChunk):
+            continue
+        token = chunk.content if isinstance(chunk.content, str) else ""
+        if not token:
+            continue
+        if chunk.id != current_id:
+            current_id = chunk.id
+            parts = []
+        if ttft_ms is None:
+            ttft_ms = (time.perf_counter() - started) * 1000
+            _record_ttft(ttft_ms)
+        parts.append(token)
+        if on_token:
+            on_token(token, current_id)
+
+    return "".join(parts), ttft_ms
@@ -1,42 +1,147 @@
 from tavily import TavilyClient
 import os
+import threading
+import time
 from dotenv import load_dotenv
 from langchain_core.tools import tool
+from lookup_cache import TTLCache
 load_dotenv()
 
+'''
+web search results are cached per normalized query (lowercased, whitespace
+collapsed) for SEARCH_CACHE_TTL seconds. when several rooms ask the same
+thing at once only the first call goes upstream; the others wait for it
+and share its result.
+'''
+
+_tavily = None
+_search_cache = TTLCache(
+    maxsize=int(os.getenv("SEARCH_CACHE_SIZE", 1000)),
+    ttl=float(os.getenv("SEARCH_CACHE_TTL", 600)),
+)
+_inflight = {}  # normalized query -> _InflightSearch
+_inflight_lock = threading.Lock()
+
+_upstream_stats = {
+    "calls": 0,
+    "errors": 0,
+    "coalesced": 0,
+    "total_ms": 0.0,
+    "max_ms": 0.0,
+}
+
+
+class _InflightSearch:
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def get_search_client():
+    global _tavily
+    if _tavily is None:
+        _tavily = TavilyClient(api_key = os.getenv("TAVILY_API_KEY"))
+    return _tavily
+
+
+def set_search_client(client):
+    """Swap the upstream client (e.g. a local fake in tests) and drop cached results."""
+    global _tavily
+    _tavily = client
+    _search_cache.clear()
+
+
+def normalize_query(query):
+    return " ".join(str(query).lower().split())
+
+
+def _search_upstream(query):
+    started = time.perf_counter()
+    try:
+        return get_search_client().search(query)
+    except Exception:
+        _upstream_stats["errors"] += 1
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        _upstream_stats["calls"] += 1
+        _upstream_stats["total_ms"] += elapsed_ms
+        if elapsed_ms > _upstream_stats["max_ms"]:
+            _upstream_stats["max_ms"] = elapsed_ms
+
+
+def cached_search(query):
+    """Search through the cache, coalescing concurrent identical queries."""
+    key = normalize_query(query)
+    response = _search_cache.get(key)
+    if response is not None:
+        return response
+
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _InflightSearch()
+            _inflight[key] = call
+
+    if not leader:
+        _upstream_stats["coalesced"] += 1
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    try:
+        call.result = _search_upstream(query)
+        _search_cache.set(key, call.result)
+        return call.result
+    except Exception as e:
+        call.error = e
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+
+def search_stats():
+    """Cache hit rate and upstream call counts / latency."""
+    stats = {f"cache_{k}": v for k, v in _search_cache.stats().items()}
+    stats.update({f"upstream_{k}": v for k, v in _upstream_stats.items()})
+    calls = _upstream_stats["calls"]
+    stats["upstream_avg_ms"] = _upstream_stats["total_ms"] / calls if calls else 0.0
+    return stats
+
+
 @tool
 def web_search_tool(query):
     """ This tool searches the web for the most relevant infomration based on the user's query.
-    
+
     Args:
         query: The search query string
-        
+
     Returns:
         A formatted string containing top search results with titles, content, and URLs
-        
-    """
-    tavily = TavilyClient(api_key = os.getenv("TAVILY_API_KEY"))
 
-    response = tavily.search(query)
+    """
+    response = cached_search(query)
 
     if not response:
         return "No results found"
-    
+
     results = response["results"]
     formatted_results = []
     for i, result in enumerate(results[:5], 1):  # top 5 results
         title = result.get("title", "No title")
         content = result.get("content", "No content")
         url = result.get("url", "No URL")
-        
+
         formatted_results.append(
             f"[{i}] {title}\n"
             f"Content: {content}\n"
             f"Source: {url}\n"
         )
-    
-    return "\n".join(formatted_results)
-
-
-
 
+    return "\n".join(formatted_results)
@@ -1,17 +1,34 @@
 from dotenv import load_dotenv
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 import os
+import socket_events
 from socket_events import register_socket_events
 from flask_socketio import SocketIO
 import secrets
-import string
-from models import db, Room, UserRoom, User, Message
+from models import db, UserRoom, User
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import jwt
 from flask_migrate import Migrate
-from s3_utils import get_s3_client, convert_object_key_to_url
+from s3_utils import get_s3_client, presign_get_url
+from persistence import message_writer, membership_writer
+from room_memory import memory_writer
+import message_index
+from history import DEFAULT_PAGE_SIZE
+import history_cache
+from search import search_messages, DEFAULT_SEARCH_LIMIT
+from export import export_room_ndjson
+import archive
+from lookup_cache import get_room_id
+import rooms
+from session_store import create_session_store, get_message_queue_url
+from event_log import event_log
+import metrics
+from auth_tokens import issue_token, token_response, verify_token
+from serializer import socketio_serializer_options
+from presence import presence
+import click
 import eventlet
 
 eventlet.monkey_patch()
@@ -43,14 +60,15 @@ app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY')
 db.init_app(app)
 migrate = Migrate(app, db)
+message_writer.init_app(app)
+membership_writer.init_app(app)
+memory_writer.init_app(app)
+message_index.init_app(app)
+history_cache.init_app(app)
 # Use threading mode for better compatibility (works with Python 3.13)
 # For production with Python 3.12, can switch back to eventlet
-# #region agent log - Hypothesis A: ping/pong configuration for Render 60s timeout
 import logging
 logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-logger.info(f"Initializing SocketIO with ping_interval=25, ping_timeout=10 (Render timeout fix)")
-# #endregion
 socketio = SocketIO(
     app,
     cors_allowed_origins=cors_origins,
@@ -61,48 +79,101 @@ socketio = SocketIO(
     # Hypothesis A: Configure ping/pong to keep connection alive through Render's 60s timeout
     ping_interval=25,  # Send ping every 25 seconds
     ping_timeout=10,   # Wait 10 seconds for pong response
-    # Hypothesis B: Enable engineio logger to see if pings are being sent
-    logger=True,
-    engineio_logger=True
+    # per-packet Socket.IO / Engine.IO logging only in the debug log profile (see event_log.py)
+    logger=event_log.socketio_logger,
+    engineio_logger=event_log.socketio_logger,
+    # set SOCKETIO_MESSAGE_QUEUE=redis://... to broadcast across worker processes
+    message_queue=get_message_queue_url(),
+    # orjson-backed JSON by default, SOCKETIO_SERIALIZER=msgpack for binary packets
+    **socketio_serializer_options()
 )
 
 
-register_socket_events(socketio)
+register_socket_events(socketio, create_session_store())
+
+metrics.init_app(app)
+metrics.register_gauge("chat_connected_sockets", "Sockets with an authenticated session",
+                       lambda: socket_events.session_store.count())
+metrics.register_gauge("chat_active_rooms", "Rooms with a connected socket in this process",
+                       lambda: presence.room_count())
+metrics.register_gauge("chat_online_users", "Users with at least one connected socket in this process",
+                       lambda: presence.stats()["users"])
+metrics.register_gauge("chat_message_queue_depth", "Messages waiting for the write-behind writer",
+                       lambda: message_writer.stats()["queue_depth"])
+metrics.register_gauge("chat_message_last_flush_ms", "Duration of the last write-behind flush",
+                       lambda: message_writer.stats()["last_flush_ms"])
+metrics.register_gauge("chat_messages_dropped", "Messages dropped by the write-behind overflow policy",
+                       lambda: message_writer.stats()["dropped"])
+metrics.register_gauge("chat_messages_failed", "Messages the write-behind writer dropped because the database rejected them",
+                       lambda: message_writer.stats()["failed"])
+metrics.register_gauge("chat_message_write_retries", "Write-behind flushes that hit a transient database error",
+                       lambda: message_writer.stats()["retries"])
+metrics.register_gauge("chat_membership_queue_depth", "Room memberships waiting for the write-behind writer",
+                       lambda: membership_writer.stats()["queue_depth"])
+metrics.register_gauge("chat_memory_queue_depth", "Messages waiting for room memory extraction",
+                       lambda: memory_writer.stats()["queue_depth"])
+metrics.register_gauge("chat_embedding_queue_depth", "Messages waiting to be embedded for agent retrieval",
+                       lambda: message_index.embedding_writer.stats()["queue_depth"])
+metrics.register_gauge("chat_message_index_bytes", "Memory held by the in-process message vector index",
+                       lambda: message_index.message_index.stats()["bytes"])
+metrics.register_gauge("chat_history_cache_hit_rate", "History page cache hit rate in this process",
+                       lambda: history_cache.stats()["hit_rate"])
+
+# compile the agent graph at startup instead of on the first @agent message
+if os.getenv("AGENT_WARMUP", "false").lower() == "true":
+    from agent import warm_up_agent
+    warm_up_agent()
 
 #helper functions for the rest of the app
-def generate_room_code():
-    alphabet = string.ascii_uppercase + string.digits
-    
-    code = ''
-    for _ in range(8):
-        code += ''.join(secrets.choice(alphabet))
+def has_bearer_token(env_var):
+    """Whether the request carries `Bearer <$env_var>`. Always False if the env var is unset."""
+    expected = os.getenv(env_var)
+    auth_header = request.headers.get('Authorization', '')
+    return bool(expected) and secrets.compare_digest(auth_header, f"Bearer {expected}")
+
+def bearer_user_id():
+    """user_id of the `Authorization: Bearer <jwt>` on the request, None if it's missing, invalid or expired."""
+    auth_header = request.headers.get('Authorization', '')
+    if not auth_header.startswith('Bearer '):
+        return None
+    try:
+        return verify_token(auth_header[len('Bearer '):], app.config['SECRET_KEY'])['user_id']
+    except jwt.InvalidTokenError:
+        return None
 
-    return code
+def is_room_member(user_id, room_id):
+    # memberships are upserted write-behind, so a user who just joined may only be in presence yet
+    return presence.user_in_room(user_id, room_id) or db.session.get(UserRoom, (user_id, room_id)) is not None
 
 def generate_jwt_token(user_id):
-    payload = {
-        'user_id': user_id,
-        'exp': datetime.utcnow() + timedelta(hours=1)  # Token expires in 1 hour
-    }
-    token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    # expires in ~1 hour, with jitter (see auth_tokens.py)
+    token, _ = issue_token(user_id, app.config['SECRET_KEY'])
     return token
 
 
 
 @app.route('/create_room', methods = ['POST'])
 def create_room():
-    room_code = generate_room_code()
+    # code comes from a pre-generated pool, collisions are retried (see rooms.py)
+    room_code = rooms.create_room()
 
-    while True:
-        if not Room.query.filter_by(room_code=room_code).first():
-            break
+    return jsonify({"room_code": room_code}), 200
 
-    room = Room(room_code = room_code)
 
-    db.session.add(room)
-    db.session.commit()
+@app.route('/create_rooms', methods = ['POST'])
+def create_rooms():
+    # bulk provisioning for onboarding jobs, only enabled when ROOM_PROVISIONING_TOKEN is set
+    if not has_bearer_token("ROOM_PROVISIONING_TOKEN"):
+        return jsonify({"error": "Unauthorized"}), 401
 
-    return jsonify({"room_code": room_code}), 200
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 0))
+        room_codes = rooms.create_rooms(count)
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify({"room_codes": room_codes}), 200
 
 
 @app.route('/room_code_check', methods = ['POST'])
@@ -110,10 +181,8 @@ def room_code_check():
     data = request.get_json()
     room_code = data.get('room_code')
 
-    
-    room = Room.query.filter_by(room_code=room_code).first()
 
-    if room:
+    if get_room_id(room_code) is not None:
         return jsonify({"exists": True}), 200
     else:
         return jsonify({"exists": False}), 200
@@ -148,8 +217,8 @@ def login():
         db.session.add(user)
         db.session.commit()
 
-    token = generate_jwt_token(user.user_id)
-    return jsonify({"token": token}), 200
+    # token plus expires_in / refresh_in hints for in-band refresh over the socket
+    return jsonify(token_response(user.user_id, app.config['SECRET_KEY'])), 200
 
 
 @app.route('/get_previous_messages', methods = ['GET'])
@@ -157,23 +226,106 @@ def get_previous_messages():
     room_code = request.args.get('room_code')
     if not room_code:
         return jsonify({"error": "room_code parameter is required"}), 400
-    
-    room = Room.query.filter_by(room_code=room_code).first()
-    if not room:
+
+    try:
+        before = int(request.args['before']) if 'before' in request.args else None
+        after = int(request.args['after']) if 'after' in request.args else None
+        limit = int(request.args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"error": "before, after and limit must be integers"}), 400
+    if before is not None and after is not None:
+        return jsonify({"error": "use either before or after, not both"}), 400
+
+    room_id = get_room_id(room_code)
+    if room_id is None:
         return jsonify({"error": "Room not found"}), 404
-    
-    messages = Message.query.filter_by(room_id=room.room_id).order_by(Message.timestamp.asc()).all()
-    # Convert messages to serializable format
-    messages_data = [{
-        "message_id": msg.message_id,
-        "user_id": msg.user_id,
-        "username": msg.user.username,
-        "content": msg.content,
-        "object_key": msg.image_url,
-        "timestamp": msg.timestamp.isoformat() if msg.timestamp else None
-    } for msg in messages]
-    
-    return jsonify({"messages": messages_data}), 200
+
+    # reloads revalidate with If-None-Match and get a 304 while the room is unchanged (see history_cache.py)
+    etag, last_modified = history_cache.history_version(room_id)
+    # HTTP dates are whole seconds
+    last_modified = last_modified.replace(microsecond=0)
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains(etag)
+    else:
+        not_modified = request.if_modified_since is not None and request.if_modified_since >= last_modified
+    if not_modified:
+        response = Response(status=304)
+    else:
+        body = history_cache.history_page_body(room_id, etag, before=before, after=after, limit=limit)
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # only once its second is over, so a later write always gets a later Last-Modified
+    if datetime.now(timezone.utc) - last_modified >= timedelta(seconds=1):
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/search_messages', methods = ['GET'])
+def search_room_messages():
+    user_id = bearer_user_id()
+    if user_id is None:
+        return jsonify({"error": "Authentication required"}), 401
+
+    room_code = request.args.get('room_code')
+    query = request.args.get('q', '').strip()
+    if not room_code or not query:
+        return jsonify({"error": "room_code and q parameters are required"}), 400
+
+    try:
+        limit = int(request.args.get('limit', DEFAULT_SEARCH_LIMIT))
+        offset = int(request.args.get('offset', 0))
+    except ValueError:
+        return jsonify({"error": "limit and offset must be integers"}), 400
+
+    room_id = get_room_id(room_code)
+    # only members can search a room, same as the search_messages socket event
+    if room_id is None or not is_room_member(user_id, room_id):
+        return jsonify({"error": "Room not found"}), 404
+
+    # ranked best match first, see search.py
+    messages_data, next_offset = search_messages(room_id, query, limit=limit, offset=offset)
+
+    return jsonify({
+        "messages": messages_data,
+        "next_offset": next_offset,
+    }), 200
+
+def parse_utc_timestamp(value):
+    """ISO 8601 timestamp as naive UTC, which is how messages store theirs. Offsets are converted."""
+    timestamp = datetime.fromisoformat(value)
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+@app.route('/export_room', methods = ['GET'])
+def export_room():
+    # compliance exports, only enabled when EXPORT_TOKEN is set
+    if not has_bearer_token("EXPORT_TOKEN"):
+        return jsonify({"error": "Unauthorized"}), 401
+
+    room_code = request.args.get('room_code')
+    if not room_code:
+        return jsonify({"error": "room_code parameter is required"}), 400
+    compress = request.args.get('compress')
+    if compress not in (None, 'zstd'):
+        return jsonify({"error": "compress must be zstd"}), 400
+    try:
+        since = parse_utc_timestamp(request.args['since']) if 'since' in request.args else None
+        until = parse_utc_timestamp(request.args['until']) if 'until' in request.args else None
+    except ValueError:
+        return jsonify({"error": "since and until must be ISO 8601 timestamps"}), 400
+
+    room_id = get_room_id(room_code)
+    if room_id is None:
+        return jsonify({"error": "Room not found"}), 404
+
+    # streamed from a server-side cursor, nothing is built up in memory (see export.py)
+    filename = f"room-{room_code}.ndjson" + (".zst" if compress else "")
+    return Response(
+        stream_with_context(export_room_ndjson(room_id, since=since, until=until, compress=compress)),
+        mimetype="application/zstd" if compress else "application/x-ndjson",
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
 
 @app.route('/get_upload_url', methods = ['GET', 'POST'])
 def get_upload_url():
@@ -203,17 +355,27 @@ def get_image_url():
     object_key = data.get('object_key')
     if not object_key:
         return jsonify({"error": "object_key required"}), 400
-    s3 = get_s3_client()
     try:
-        url = s3.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': 'agent-messaging', 'Key': object_key},
-            ExpiresIn=3600
-        )
+        url = presign_get_url(object_key)
         return jsonify({"url": url}), 200
     except ClientError as e:
         return jsonify({"error": str(e)}), 500
 
+@app.cli.command("archive-messages")
+@click.option("--older-than-days", type=int, default=archive.ARCHIVE_AFTER_DAYS, show_default=True)
+@click.option("--segment-rows", type=int, default=archive.ARCHIVE_SEGMENT_ROWS, show_default=True)
+def archive_messages(older_than_days, segment_rows):
+    """Move messages older than --older-than-days to archive segments (see archive.py)."""
+    rooms_archived, messages_archived = archive.archive_cold_messages(older_than_days, segment_rows)
+    click.echo(f"archived {messages_archived} messages from {rooms_archived} rooms")
+
+@app.cli.command("backfill-embeddings")
+@click.option("--batch-size", type=int, default=500, show_default=True)
+def backfill_embeddings(batch_size):
+    """Embed every message that has no vector for the current embedder yet (see message_index.py)."""
+    embedded = message_index.backfill_embeddings(batch_size)
+    click.echo(f"embedded {embedded} messages with {message_index.get_embedder().name}")
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     socketio.run(app, host='0.0.0.0', port=port, debug=False)
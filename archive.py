@@ -0,0 +1,294 @@
+import logging
+import os
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+
+import orjson
+import zstandard
+from sqlalchemy import delete, select
+
+from models import db, ArchiveSegment, Message, MessageEmbedding, User
+from lookup_cache import TTLCache
+from s3_utils import BUCKET, get_s3_client
+
+logger = logging.getLogger(__name__)
+
+'''
+hot / cold tiering of room history
+
+messages older than ARCHIVE_AFTER_DAYS are moved out of the messages
+table into compressed segments in object storage, so history queries,
+indexes and vacuum only pay for the hot tier.
+
+    - archive_cold_messages() (flask archive-messages, run it from cron)
+      cuts each room's cold messages into segments: oldest first, one
+      calendar month at most, ARCHIVE_SEGMENT_ROWS messages at most
+    - a segment is zstd-compressed NDJSON in the /export_room line format,
+      stored under archive/messages/<room_id>/<yyyy-mm>/<first>-<last>.ndjson.zst
+      in the segment store: a local directory (ARCHIVE_DIR, the default)
+      or S3 (ARCHIVE_STORE=s3, ARCHIVE_BUCKET)
+    - archive_segments is the manifest: room, object key, (timestamp,
+      message_id) range and message count per segment
+    - the object is written before the rows are deleted, in the same
+      transaction as the manifest row, so a failed run leaves the
+      messages hot and at worst an orphaned object
+    - read_archived() continues a history page into the archive
+      (history.py calls it when a page runs off the hot tier); decoded
+      segments are cached by object key, they never change. the cache
+      holds at most ARCHIVE_SEGMENT_CACHE_MESSAGES decoded messages
+      (~1 KB each as dicts, so the default 50000 is ~50 MB per worker)
+
+only the oldest hot messages are ever archived, so every archived message
+sorts before every hot one, and segment_id order is (timestamp,
+message_id) order within a room.
+
+archived messages are no longer in full-text search or agent retrieval
+(their embeddings are deleted with them), /export_room still includes them.
+'''
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", 90))
+ARCHIVE_SEGMENT_ROWS = int(os.getenv("ARCHIVE_SEGMENT_ROWS", 5000))
+ARCHIVE_PREFIX = "archive/messages"
+# segments are written once and read rarely, so spend more cpu on the ratio than export does
+ZSTD_LEVEL = 10
+# manifest rows fetched per query when walking a room's segments
+MANIFEST_BATCH = 16
+
+# messages: history page dicts, oldest first. positions: message_id -> index in messages
+_Segment = namedtuple("_Segment", ["messages", "positions"])
+
+_segment_cache = TTLCache(
+    maxsize=int(os.getenv("ARCHIVE_SEGMENT_CACHE_MESSAGES", 50000)),
+    ttl=float(os.getenv("ARCHIVE_SEGMENT_CACHE_TTL", 3600)),
+    weigh=lambda segment: len(segment.messages),
+)
+
+
+class LocalSegmentStore:
+    """Segments as files under a directory. For local runs and tests."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write then rename, so a reader never sees half a segment
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def get(self, key):
+        with open(self._path(key), "rb") as f:
+            return f.read()
+
+
+class S3SegmentStore:
+
+    def __init__(self, bucket=BUCKET):
+        self.bucket = bucket
+
+    def put(self, key, data):
+        get_s3_client().put_object(Bucket=self.bucket, Key=key, Body=data, ContentType="application/zstd")
+
+    def get(self, key):
+        return get_s3_client().get_object(Bucket=self.bucket, Key=key)["Body"].read()
+
+
+_segment_store = None
+
+
+def get_segment_store():
+    global _segment_store
+    if _segment_store is None:
+        if os.getenv("ARCHIVE_STORE", "local") == "s3":
+            _segment_store = S3SegmentStore(os.getenv("ARCHIVE_BUCKET", BUCKET))
+        else:
+            _segment_store = LocalSegmentStore(os.getenv("ARCHIVE_DIR", "archive"))
+    return _segment_store
+
+
+def set_segment_store(store):
+    global _segment_store
+    _segment_store = store
+    _segment_cache.clear()
+
+
+def _encode_segment(rows):
+    ndjson = b"".join(
+        orjson.dumps({
+            "message_id": row.message_id,
+            "user_id": row.user_id,
+            "username": row.username,
+            "content": row.content,
+            "object_key": row.image_url,
+            "timestamp": row.timestamp,
+        }) + b"\n"
+        for row in rows
+    )
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(ndjson)
+
+
+def read_segment_ndjson(segment):
+    """Decompressed NDJSON of a segment, uncached."""
+    return zstandard.ZstdDecompressor().decompressobj().decompress(get_segment_store().get(segment.object_key))
+
+
+def _load_segment(segment):
+    loaded = _segment_cache.get(segment.object_key)
+    if loaded is None:
+        messages = [orjson.loads(line) for line in read_segment_ndjson(segment).splitlines()]
+        positions = {message["message_id"]: i for i, message in enumerate(messages)}
+        loaded = _Segment(messages, positions)
+        _segment_cache.set(segment.object_key, loaded)
+    return loaded
+
+
+def _write_segment(room_id, rows):
+    first, last = rows[0], rows[-1]
+    ids = [row.message_id for row in rows]
+    object_key = f"{ARCHIVE_PREFIX}/{room_id}/{first.timestamp:%Y-%m}/{first.message_id}-{last.message_id}.ndjson.zst"
+    data = _encode_segment(rows)
+    get_segment_store().put(object_key, data)
+
+    db.session.add(ArchiveSegment(
+        room_id=room_id,
+        object_key=object_key,
+        message_count=len(rows),
+        compressed_bytes=len(data),
+        first_timestamp=first.timestamp,
+        last_timestamp=last.timestamp,
+        first_message_id=first.message_id,
+        last_message_id=last.message_id,
+        min_message_id=min(ids),
+        max_message_id=max(ids),
+    ))
+    # embeddings reference the messages
+    db.session.execute(delete(MessageEmbedding).where(MessageEmbedding.message_id.in_(ids)))
+    db.session.execute(delete(Message).where(Message.message_id.in_(ids)))
+    db.session.commit()
+
+
+def archive_room(room_id, cutoff, segment_rows=ARCHIVE_SEGMENT_ROWS):
+    """Move the room's messages older than cutoff into segments. Returns how many were archived."""
+    total = 0
+    while True:
+        rows = db.session.execute(
+            select(
+                Message.message_id,
+                Message.user_id,
+                User.username,
+                Message.content,
+                Message.image_url,
+                Message.timestamp,
+            ).join(User, User.user_id == Message.user_id)
+            .where(Message.room_id == room_id, Message.timestamp < cutoff)
+            .order_by(Message.timestamp.asc(), Message.message_id.asc())
+            .limit(segment_rows)
+        ).all()
+        if not rows:
+            return total
+        # a segment never spans two calendar months
+        month = (rows[0].timestamp.year, rows[0].timestamp.month)
+        rows = [row for row in rows if (row.timestamp.year, row.timestamp.month) == month]
+        _write_segment(room_id, rows)
+        total += len(rows)
+
+
+def archive_cold_messages(older_than_days=ARCHIVE_AFTER_DAYS, segment_rows=ARCHIVE_SEGMENT_ROWS):
+    """Archive every room's messages older than older_than_days. Returns (rooms, messages) archived."""
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    room_ids = db.session.execute(
+        select(Message.room_id).where(Message.timestamp < cutoff).distinct()
+    ).scalars().all()
+    total = 0
+    for room_id in room_ids:
+        archived = archive_room(room_id, cutoff, segment_rows)
+        total += archived
+        logger.info(f"room {room_id}: archived {archived} messages")
+    return len(room_ids), total
+
+
+def _segments(room_id, newest_first, from_segment_id=None):
+    """The room's manifest rows in order, starting next to from_segment_id."""
+    last_id = from_segment_id
+    while True:
+        query = ArchiveSegment.query.filter(ArchiveSegment.room_id == room_id)
+        if newest_first:
+            if last_id is not None:
+                query = query.filter(ArchiveSegment.segment_id < last_id)
+            query = query.order_by(ArchiveSegment.segment_id.desc())
+        else:
+            if last_id is not None:
+                query = query.filter(ArchiveSegment.segment_id > last_id)
+            query = query.order_by(ArchiveSegment.segment_id.asc())
+        batch = query.limit(MANIFEST_BATCH).all()
+        yield from batch
+        if len(batch) < MANIFEST_BATCH:
+            return
+        last_id = batch[-1].segment_id
+
+
+def _archived_messages(room_id, newest_first, segment=None, position=None):
+    if segment is not None:
+        messages = _load_segment(segment).messages
+        yield from (reversed(messages[:position]) if newest_first else messages[position + 1:])
+    for next_segment in _segments(room_id, newest_first, segment.segment_id if segment is not None else None):
+        messages = _load_segment(next_segment).messages
+        yield from (reversed(messages) if newest_first else messages)
+
+
+def find_archived(room_id, message_id):
+    """(segment, position) of an archived message, or None."""
+    candidates = ArchiveSegment.query.filter(
+        ArchiveSegment.room_id == room_id,
+        ArchiveSegment.min_message_id <= message_id,
+        ArchiveSegment.max_message_id >= message_id,
+    ).order_by(ArchiveSegment.segment_id).all()
+    for segment in candidates:
+        position = _load_segment(segment).positions.get(message_id)
+        if position is not None:
+            return segment, position
+    return None
+
+
+def read_archived(room_id, limit, before=None, after=None):
+    """
+    Up to limit archived messages in the direction of travel: newest first
+    before the cursor (or from the newest archived message without one),
+    oldest first after it. None if the cursor isn't an archived message.
+    """
+    if before is None and after is None:
+        return list(islice(_archived_messages(room_id, newest_first=True), limit))
+    found = find_archived(room_id, before if before is not None else after)
+    if found is None:
+        return None
+    segment, position = found
+    return list(islice(_archived_messages(room_id, after is None, segment, position), limit))
+
+
+def archived_ndjson(room_id, since=None, until=None):
+    """The room's archived messages as NDJSON chunks, oldest first, one per segment."""
+    for segment in _segments(room_id, newest_first=False):
+        if (since is not None and segment.last_timestamp < since) or \
+                (until is not None and segment.first_timestamp >= until):
+            continue
+        ndjson = read_segment_ndjson(segment)
+        if (since is not None and segment.first_timestamp < since) or \
+                (until is not None and segment.last_timestamp >= until):
+            # segment straddles the range, keep only the lines inside it
+            ndjson = b"".join(
+                line + b"\n" for line in ndjson.splitlines()
+                if _in_range(datetime.fromisoformat(orjson.loads(line)["timestamp"]), since, until)
+            )
+        if ndjson:
+            yield ndjson
+
+
+def _in_range(timestamp, since, until):
+    return (since is None or timestamp >= since) and (until is None or timestamp < until)
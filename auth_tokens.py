@@ -0,0 +1,70 @@
+import os
+import random
+from datetime import datetime, timedelta, timezone
+
+import jwt
+
+from lookup_cache import TTLCache
+
+'''
+jwt issuing / verification
+
+tokens used to expire exactly one hour after /auth/login, so clients that
+logged in together all had to reconnect + log in again at the same moment.
+
+    - exp gets up to JWT_EXPIRY_JITTER (fraction of the ttl) of random extra
+      lifetime, so a cohort's tokens don't expire on the same second
+    - every token response carries refresh_in: when the client should ask
+      for a new token over the socket (refresh_token event), randomly spread
+      between 50% and 80% of the ttl
+    - verify_token caches already-verified tokens, so reconnect bursts skip
+      the signature check; the exp claim is still checked on every hit
+'''
+
+TOKEN_TTL = int(os.getenv("JWT_TTL_SECONDS", 3600))  # 1 hour
+EXPIRY_JITTER = float(os.getenv("JWT_EXPIRY_JITTER", 0.1))
+
+_verified_tokens = TTLCache(
+    maxsize=int(os.getenv("JWT_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("JWT_CACHE_TTL", 300)),
+)
+
+
+def issue_token(user_id, secret):
+    """Returns (token, expires_in_seconds)."""
+    expires_in = int(TOKEN_TTL * (1 + random.uniform(0, EXPIRY_JITTER)))
+    payload = {
+        'user_id': user_id,
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=expires_in)
+    }
+    return jwt.encode(payload, secret, algorithm='HS256'), expires_in
+
+
+def token_response(user_id, secret):
+    """Token plus expiry / refresh hints, as sent by /auth/login and refresh_token."""
+    token, expires_in = issue_token(user_id, secret)
+    return {
+        "token": token,
+        "expires_in": expires_in,
+        "refresh_in": int(expires_in * random.uniform(0.5, 0.8)),
+    }
+
+
+def verify_token(token, secret):
+    """
+    Decode and verify a token, returning its payload.
+    Raises jwt.ExpiredSignatureError / jwt.InvalidTokenError like jwt.decode.
+    """
+    payload = _verified_tokens.get(token)
+    if payload is not None:
+        if payload['exp'] <= datetime.now(timezone.utc).timestamp():
+            _verified_tokens.invalidate(token)
+            raise jwt.ExpiredSignatureError("Signature has expired")
+        return payload
+    payload = jwt.decode(token, secret, algorithms=['HS256'])
+    _verified_tokens.set(token, payload)
+    return payload
+
+
+def token_cache_stats():
+    return _verified_tokens.stats()
@@ -0,0 +1,47 @@
+"""
+Per-call overhead of building the ReAct agent graph on every @agent call
+versus reusing the compiled graph from agent.get_agent_executor().
+
+Uses a fake chat model that answers instantly, so the numbers are pure
+graph construction + invocation overhead.
+
+    python bench_agent.py [iterations]
+"""
+import sys
+import time
+
+from langchain_core.messages import HumanMessage
+from langgraph.prebuilt import create_react_agent
+
+import agent
+from bench_fakes import make_fake_llm
+
+
+def rebuild_per_call(llm, messages):
+    # what run_agent used to do
+    executor = create_react_agent(llm, list(agent.DEFAULT_TOOLS), prompt=agent.SYSTEM_PROMPT)
+    return executor.invoke({"messages": messages})
+
+
+def cached(llm, messages):
+    executor = agent.get_agent_executor(llm=llm)
+    return executor.invoke({"messages": messages})
+
+
+def bench(name, fn, iterations):
+    llm = make_fake_llm()
+    messages = [HumanMessage(content="what's up")]
+    fn(llm, messages)  # warm up
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(llm, messages)
+    per_call_ms = (time.perf_counter() - started) / iterations * 1000
+    print(f"{name:<20} {per_call_ms:>8.2f} ms/call")
+    return per_call_ms
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    before = bench("rebuild per call", rebuild_per_call, iterations)
+    after = bench("cached graph", cached, iterations)
+    print(f"removed per call: {before - after:.2f} ms ({before / after:.1f}x)")
@@ -0,0 +1,77 @@
+"""
+Room creation throughput before and after rooms.py.
+
+    old code gen      the per-character secrets.choice loop
+    new code gen      generate_room_codes (one token_bytes call)
+    old create_room   SELECT code + INSERT + COMMIT per room
+    create_room       pooled code, INSERT + COMMIT, retry on collision
+    create_rooms      N rooms in one transaction (bulk endpoint)
+
+    python bench_create_room.py [rooms] [--db sqlite:////tmp/chat_room_bench.db]
+"""
+import argparse
+import secrets
+import string
+import time
+
+from flask import Flask
+
+from models import db, Room
+import rooms
+
+
+def old_generate_room_code():
+    alphabet = string.ascii_uppercase + string.digits
+    code = ''
+    for _ in range(8):
+        code += ''.join(secrets.choice(alphabet))
+    return code
+
+
+def old_create_room():
+    room_code = old_generate_room_code()
+    # the old loop never picked a new code; one check is the non-colliding cost
+    Room.query.filter_by(room_code=room_code).first()
+    db.session.add(Room(room_code=room_code))
+    db.session.commit()
+
+
+def reset(app):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    rooms.code_pool.clear()
+
+
+def timed(label, fn, count, setup=None, repeat=3):
+    # best of a few runs: sqlite commit times drift a lot between runs on the same file
+    seconds = float("inf")
+    for _ in range(repeat):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        fn()
+        seconds = min(seconds, time.perf_counter() - started)
+    print(f"{label:<18} {count / seconds:>12.0f} /s {seconds * 1000:>10.1f} ms total")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rooms", type=int, nargs="?", default=2000)
+    parser.add_argument("--db", default="sqlite:////tmp/chat_room_bench.db")
+    args = parser.parse_args()
+    n = args.rooms
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    db.init_app(app)
+
+    timed("old code gen", lambda: [old_generate_room_code() for _ in range(n)], n)
+    timed("new code gen", lambda: [rooms.generate_room_code() for _ in range(n)], n)
+    timed("new code gen bulk", lambda: rooms.generate_room_codes(n), n)
+
+    with app.app_context():
+        timed("old create_room", lambda: [old_create_room() for _ in range(n)], n, setup=lambda: reset(app))
+        timed("create_room", lambda: [rooms.create_room() for _ in range(n)], n, setup=lambda: reset(app))
+        timed("create_rooms", lambda: rooms.create_rooms(n), n, setup=lambda: reset(app))
+        print(f"rooms in table after bulk: {Room.query.count()}")
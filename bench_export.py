@@ -0,0 +1,89 @@
+"""
+Peak memory of exporting one big room, before and after export.py.
+
+    materialized   every row as a dict in one list, then one json body
+                   (what paging the whole room through history did)
+    ndjson         export_room_ndjson, server-side cursor, chunks discarded
+    ndjson+zstd    same, through the streaming compressor
+
+    python bench_export.py [rows] [--db sqlite:////tmp/chat_export_bench.db] [--reuse]
+"""
+import argparse
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import orjson
+from flask import Flask
+from sqlalchemy import insert
+
+from models import db, Message, Room, User
+from export import export_room_ndjson
+
+
+def seed(rows, batch=50000):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Room), [{"room_code": "EXPORT01"}])
+    db.session.execute(insert(User), [{"username": "exporter", "email": "export@example.invalid",
+                                       "oauth_provider": "bench", "oauth_id": "export"}])
+    db.session.commit()
+    start = datetime(2024, 1, 1)
+    for offset in range(0, rows, batch):
+        db.session.execute(insert(Message), [
+            {"content": f"message number {i} " + "lorem ipsum " * 8, "timestamp": start + timedelta(seconds=i),
+             "user_id": 1, "room_id": 1}
+            for i in range(offset, min(rows, offset + batch))
+        ])
+        db.session.commit()
+
+
+def materialized():
+    rows = db.session.query(Message.message_id, Message.user_id, User.username, Message.content,
+                            Message.image_url, Message.timestamp)\
+        .join(User, User.user_id == Message.user_id).filter(Message.room_id == 1)\
+        .order_by(Message.timestamp.asc(), Message.message_id.asc()).all()
+    body = orjson.dumps([{
+        "message_id": row.message_id,
+        "user_id": row.user_id,
+        "username": row.username,
+        "content": row.content,
+        "object_key": row.image_url,
+        "timestamp": row.timestamp.isoformat(),
+    } for row in rows])
+    return len(body)
+
+
+def streamed(compress=None):
+    return sum(len(chunk) for chunk in export_room_ndjson(1, compress=compress))
+
+
+def measure(label, fn):
+    db.session.expunge_all()
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = fn()
+    seconds = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<14} peak {peak / 2**20:>8.1f} MiB  {seconds:>6.2f} s  output {size / 2**20:>8.1f} MiB")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("rows", type=int, nargs="?", default=500_000)
+    parser.add_argument("--db", default="sqlite:////tmp/chat_export_bench.db")
+    parser.add_argument("--reuse", action="store_true", help="use the already seeded database")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    db.init_app(app)
+
+    with app.app_context():
+        if not args.reuse:
+            seed(args.rows)
+        print(f"{Message.query.count()} messages in the room")
+        measure("materialized", materialized)
+        measure("ndjson", streamed)
+        measure("ndjson+zstd", lambda: streamed("zstd"))
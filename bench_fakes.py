@@ -0,0 +1,51 @@
+"""
+Fake LLM / search / S3 backends for benchmarks and local runs.
+
+install() swaps them into agent, agent_tools, room_memory, message_index
+and s3_utils so nothing leaves the machine.
+"""
+import itertools
+import os
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+
+class FakeToolChatModel(GenericFakeChatModel):
+    """Streams a canned reply word by word and accepts bind_tools, which create_react_agent requires."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+def make_fake_llm(reply="lol sure, here's the deal: everything is fine"):
+    return FakeToolChatModel(messages=itertools.cycle([AIMessage(content=reply)]))
+
+
+class FakeSearchClient:
+    """Stands in for TavilyClient.search."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, query):
+        self.calls += 1
+        return {"results": [{"title": f"Result for {query}", "content": "nothing to see", "url": "http://example.invalid"}]}
+
+
+def install():
+    # presigning is local signing, so dummy credentials and an unroutable endpoint are enough
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+    os.environ.setdefault("AWS_REGION", "us-east-1")
+    os.environ.setdefault("S3_ENDPOINT_URL", "http://127.0.0.1:9")
+
+    import agent
+    import agent_tools
+    import message_index
+    import room_memory
+
+    agent._llm = make_fake_llm()
+    room_memory.set_memory_llm(make_fake_llm(reply="[]"))
+    message_index.set_embedder(message_index.HashEmbedder())
+    agent_tools.set_search_client(FakeSearchClient())
@@ -0,0 +1,74 @@
+"""
+Reload storm on /get_previous_messages before and after history_cache.py.
+
+    uncached       get_history_page + json body on every request (the old route)
+    cached         history_page_body, served from the page cache
+    304            If-None-Match with the current ETag, no body
+
+    python bench_history_cache.py [requests] [--db sqlite:////tmp/chat_history_bench.db]
+"""
+import argparse
+import time
+
+import orjson
+from flask import Flask
+from sqlalchemy import insert
+
+from models import db, Message, Room, User
+from history import get_history_page
+import history_cache
+
+
+def seed(messages):
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Room), [{"room_code": "HISTORY1"}])
+    db.session.execute(insert(User), [{"username": "reloader", "email": "history@example.invalid",
+                                       "oauth_provider": "bench", "oauth_id": "history"}])
+    db.session.execute(insert(Message), [{"content": f"message {i}", "user_id": 1, "room_id": 1}
+                                         for i in range(messages)])
+    db.session.commit()
+
+
+def uncached():
+    messages, has_more = get_history_page(1)
+    return orjson.dumps({"messages": messages, "has_more": has_more})
+
+
+def cached():
+    etag, _ = history_cache.history_version(1)
+    return history_cache.history_page_body(1, etag)
+
+
+def not_modified(client_etag):
+    etag, _ = history_cache.history_version(1)
+    assert etag == client_etag
+    return b""
+
+
+def timed(label, fn, count):
+    started = time.perf_counter()
+    for _ in range(count):
+        fn()
+    seconds = time.perf_counter() - started
+    print(f"{label:<10} {count / seconds:>10.0f} req/s {seconds / count * 1e6:>8.1f} us/req")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("requests", type=int, nargs="?", default=5000)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--db", default="sqlite:////tmp/chat_history_bench.db")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    db.init_app(app)
+
+    with app.app_context():
+        seed(args.messages)
+        etag, _ = history_cache.history_version(1)
+        timed("uncached", uncached, args.requests)
+        timed("cached", cached, args.requests)
+        timed("304", lambda: not_modified(etag), args.requests)
+        print(history_cache.stats())
@@ -0,0 +1,124 @@
+"""
+join_room membership write, before and after moving it to the batched
+upsert writer.
+
+    before  SELECT user_rooms + INSERT + COMMIT inline on every join
+    after   enqueue_membership() on the handler, background multi-row
+            INSERT ... ON CONFLICT DO NOTHING
+
+Reports per-join handler time, total time until everything is on disk
+and, for the old path, how many of N concurrent joins of the same pairs
+hit a primary key violation.
+
+    python bench_join_room.py [joins] [--db sqlite:////tmp/chat_join_bench.db]
+"""
+import argparse
+import threading
+import time
+
+from flask import Flask
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Room, User, UserRoom
+import persistence
+
+
+def make_app(db_url):
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = db_url
+    db.init_app(app)
+    return app
+
+
+def reset(app, users, rooms):
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        db.session.add_all(Room(room_code=f"R{i:05d}") for i in range(rooms))
+        db.session.add_all(
+            User(username=f"join-{i}", email=f"join-{i}@example.invalid", oauth_provider="bench", oauth_id=f"join-{i}")
+            for i in range(users)
+        )
+        db.session.commit()
+    persistence._known_memberships.clear()
+
+
+def old_join(user_id, room_id):
+    # what handle_join_room used to do
+    link = UserRoom.query.filter_by(user_id=user_id, room_id=room_id).first()
+    if not link:
+        db.session.add(UserRoom(user_id=user_id, room_id=room_id))
+        db.session.commit()
+
+
+def bench_old(app, pairs):
+    started = time.perf_counter()
+    with app.app_context():
+        for user_id, room_id in pairs:
+            old_join(user_id, room_id)
+    total_ms = (time.perf_counter() - started) * 1000
+    return total_ms / len(pairs), total_ms
+
+
+def bench_new(app, pairs):
+    started = time.perf_counter()
+    for user_id, room_id in pairs:
+        persistence.enqueue_membership(user_id, room_id)
+    handler_ms = (time.perf_counter() - started) * 1000
+    persistence.membership_writer.flush()
+    total_ms = (time.perf_counter() - started) * 1000
+    return handler_ms / len(pairs), total_ms
+
+
+def race_old(app, pairs, threads=8):
+    """Every thread joins the same pairs at once, like several tabs reconnecting after a deploy."""
+    errors = []
+
+    def worker():
+        with app.app_context():
+            for user_id, room_id in pairs:
+                try:
+                    old_join(user_id, room_id)
+                except IntegrityError:
+                    db.session.rollback()
+                    errors.append((user_id, room_id))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return len(errors)
+
+
+def count_links(app):
+    with app.app_context():
+        return UserRoom.query.count()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("joins", type=int, nargs="?", default=2000)
+    parser.add_argument("--db", default="sqlite:////tmp/chat_join_bench.db")
+    args = parser.parse_args()
+
+    users, rooms = 200, 20
+    pairs = [(1 + i % users, 1 + (i * 7) % rooms) for i in range(args.joins)]
+    app = make_app(args.db)
+    persistence.membership_writer.init_app(app)
+
+    reset(app, users, rooms)
+    old_per_join, old_total = bench_old(app, pairs)
+    old_links = count_links(app)
+
+    reset(app, users, rooms)
+    new_per_join, new_total = bench_new(app, pairs)
+    new_links = count_links(app)
+
+    reset(app, users, rooms)
+    violations = race_old(app, pairs[:200])
+
+    print(f"{'':<28} {'handler ms/join':>16} {'total ms':>10} {'links':>7}")
+    print(f"{'select + insert + commit':<28} {old_per_join:>16.3f} {old_total:>10.1f} {old_links:>7}")
+    print(f"{'batched upsert':<28} {new_per_join:>16.3f} {new_total:>10.1f} {new_links:>7}")
+    print(f"concurrent old-path joins hitting a primary key violation: {violations}")
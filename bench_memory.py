@@ -0,0 +1,96 @@
+"""
+Room memory extraction: one llm call per message (the old memory_decider)
+versus one call per room per flush (room_memory.memory_writer).
+
+Uses a fake model that answers after --latency seconds with a fixed memory,
+so the difference is the number of calls and the time spent waiting on them.
+
+    python bench_memory.py [messages] [--rooms 10] [--latency 0.2]
+"""
+import argparse
+import json
+import time
+
+from flask import Flask
+from langchain_core.messages import AIMessage
+
+from bench_fakes import FakeToolChatModel
+from models import db, Room, RoomMemory
+import room_memory
+
+
+class CountingReplies:
+    """Iterator for GenericFakeChatModel.messages that counts calls and simulates latency."""
+
+    def __init__(self, reply, latency):
+        self.reply = reply
+        self.latency = latency
+        self.calls = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.calls += 1
+        time.sleep(self.latency)
+        return AIMessage(content=self.reply)
+
+
+REPLY = json.dumps([{"type": "decision", "key": "Launch Date", "value": "we ship on friday"}])
+
+
+def make_llm(latency):
+    replies = CountingReplies(REPLY, latency)
+    return FakeToolChatModel(messages=replies), replies
+
+
+def per_message(rows, latency):
+    llm, replies = make_llm(latency)
+    for row in rows:
+        memories = room_memory.extract_memories([(row["username"], row["content"])], llm=llm)
+        room_memory.upsert_memories(row["room_id"], memories)
+        db.session.commit()
+    return replies.calls
+
+
+def batched(rows, latency):
+    llm, replies = make_llm(latency)
+    room_memory.set_memory_llm(llm)
+    room_memory._extract_batch(rows)
+    return replies.calls
+
+
+def reset(rooms):
+    db.drop_all()
+    db.create_all()
+    db.session.add_all(Room(room_code=f"M{i:05d}") for i in range(rooms))
+    db.session.commit()
+    room_memory._memory_cache.clear()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("messages", type=int, nargs="?", default=200)
+    parser.add_argument("--rooms", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake llm seconds per call")
+    parser.add_argument("--db", default="sqlite:////tmp/chat_memory_bench.db")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    db.init_app(app)
+
+    rows = [
+        {"room_id": 1 + i % args.rooms, "username": f"user{i % 7}", "content": f"message {i}: we ship on friday"}
+        for i in range(args.messages)
+    ]
+
+    with app.app_context():
+        print(f"{'':<14} {'llm calls':>10} {'seconds':>10} {'memories':>10}")
+        for label, fn in (("per message", per_message), ("batched", batched)):
+            reset(args.rooms)
+            started = time.perf_counter()
+            calls = fn(rows, args.latency)
+            seconds = time.perf_counter() - started
+            # same key every time, so each room should end up with exactly one memory
+            print(f"{label:<14} {calls:>10} {seconds:>10.2f} {RoomMemory.query.count():>10}")
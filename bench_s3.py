@@ -0,0 +1,61 @@
+"""
+Per-call cost of getting a presigned GET url, before and after sharing the
+S3 client and caching urls.
+
+Runs against a stubbed endpoint with dummy credentials. Presigning is pure
+local signing, so nothing is ever sent over the network.
+
+    python bench_s3.py [iterations]
+"""
+import os
+import sys
+import time
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "bench")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "bench")
+os.environ.setdefault("AWS_REGION", "us-east-1")
+os.environ.setdefault("S3_ENDPOINT_URL", "http://127.0.0.1:9")
+
+import s3_utils
+
+
+def per_call_new_client(key):
+    # what every request used to do
+    return s3_utils.new_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': s3_utils.BUCKET, 'Key': key},
+        ExpiresIn=s3_utils.PRESIGN_EXPIRES_IN
+    )
+
+
+def shared_client(key):
+    return s3_utils.get_s3_client().generate_presigned_url(
+        'get_object',
+        Params={'Bucket': s3_utils.BUCKET, 'Key': key},
+        ExpiresIn=s3_utils.PRESIGN_EXPIRES_IN
+    )
+
+
+def cached_url(key):
+    return s3_utils.presign_get_url(key)
+
+
+def bench(name, fn, iterations, keys):
+    fn(keys[0])  # warm up
+    started = time.perf_counter()
+    for i in range(iterations):
+        fn(keys[i % len(keys)])
+    per_call_us = (time.perf_counter() - started) / iterations * 1e6
+    print(f"{name:<24} {per_call_us:>10.1f} us/call")
+    return per_call_us
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    # history pages show the same images over and over, so reuse a small key set
+    keys = [f"uploads/bench-{i}" for i in range(50)]
+
+    before = bench("new client per call", per_call_new_client, iterations, keys)
+    shared = bench("shared client", shared_client, iterations * 10, keys)
+    cached = bench("shared client + cache", cached_url, iterations * 10, keys)
+    print(f"speedup: {before / shared:.1f}x shared, {before / cached:.1f}x cached")
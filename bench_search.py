@@ -0,0 +1,139 @@
+"""
+Full-text search latency on a large seeded messages table.
+
+Seeds --rows messages (default 2M) across --rooms rooms with random text
+from a Zipf-ish vocabulary, builds the search index, then times
+search.search_messages against the old way of finding a message (a
+LIKE scan over the room) for common, rare and multi-word queries.
+
+    python bench_search.py                                      # sqlite, FTS5
+    python bench_search.py --db postgresql://localhost/chat_bench --rows 5000000
+    python bench_search.py --reuse                              # skip seeding
+
+The sqlite default writes /tmp/chat_search_bench.db (a few hundred MB at 2M rows).
+"""
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import insert, text
+
+from models import db, Message, Room, User
+import search
+
+WORDS = (
+    "the a to and of i you it is that in we for on this lol ok be with just "
+    "deploy release friday lunch meeting pizza bug fix staging prod database "
+    "migration index query latency review design roadmap budget launch customer "
+    "invoice password rotate incident outage pager alert dashboard metrics "
+    "kubernetes terraform postgres redis kafka vacation birthday coffee standup"
+).split()
+RARE_WORDS = ["xylophone", "quokka", "zeppelin", "marzipan", "fjord", "kumquat", "obelisk", "yodel"]
+
+QUERIES = {
+    "common word": "deploy",
+    "rare word": "quokka",
+    "two words": "postgres migration",
+    "phrase-ish": "rotate the database password",
+}
+
+
+# a long tail of filler words so the vocabulary is closer to real chat than 75 words
+VOCABULARY = WORDS + [f"w{n:x}q" for n in range(5000)]
+# zipf-ish: the n-th word is n times rarer than the first
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+
+
+def random_message(rng):
+    length = rng.randint(4, 25)
+    words = rng.choices(VOCABULARY, weights=WEIGHTS, k=length)
+    if rng.random() < 0.001:
+        words.insert(rng.randrange(len(words)), rng.choice(RARE_WORDS))
+    return " ".join(words)
+
+
+def seed(rows, rooms, users, batch=50000):
+    rng = random.Random(42)
+    if db.session.get_bind().dialect.name == "sqlite":
+        # not part of the metadata, so drop_all leaves it behind
+        db.session.execute(text("DROP TABLE IF EXISTS messages_fts"))
+    db.drop_all()
+    db.create_all()
+    db.session.execute(insert(Room), [{"room_code": f"S{i:06d}"} for i in range(rooms)])
+    db.session.execute(insert(User), [
+        {"username": f"user{i}", "email": f"search-{i}@example.invalid", "oauth_provider": "bench", "oauth_id": f"search-{i}"}
+        for i in range(users)
+    ])
+    db.session.commit()
+
+    start = datetime(2024, 1, 1)
+    started = time.perf_counter()
+    for offset in range(0, rows, batch):
+        db.session.execute(insert(Message), [
+            {
+                "content": random_message(rng),
+                "timestamp": start + timedelta(seconds=i * 7),
+                "user_id": 1 + rng.randrange(users),
+                "room_id": 1 + rng.randrange(rooms),
+            }
+            for i in range(offset, min(rows, offset + batch))
+        ])
+        db.session.commit()
+        print(f"seeded {min(rows, offset + batch)}/{rows} messages ({time.perf_counter() - started:.0f}s)")
+
+    started = time.perf_counter()
+    search.ensure_search_index()
+    print(f"search index built in {time.perf_counter() - started:.1f}s")
+
+
+def like_scan(room_id, query, limit):
+    # the closest thing to search before search.py: filter the room's history by substring
+    return Message.query.filter(Message.room_id == room_id, Message.content.ilike(f"%{query}%"))\
+        .order_by(Message.message_id.desc()).limit(limit).all()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def bench(label, fn, rooms, iterations):
+    timings = []
+    hits = 0
+    for i in range(iterations):
+        room_id = 1 + (i * 7919) % rooms
+        started = time.perf_counter()
+        result = fn(room_id)
+        timings.append((time.perf_counter() - started) * 1000)
+        hits += len(result[0] if isinstance(result, tuple) else result)
+    print(f"  {label:<10} p50 {percentile(timings, 50):>8.2f} ms  p95 {percentile(timings, 95):>8.2f} ms  "
+          f"avg hits {hits / iterations:>5.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--rooms", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--db", default="sqlite:////tmp/chat_search_bench.db")
+    parser.add_argument("--reuse", action="store_true", help="use the already seeded database")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config["SQLALCHEMY_DATABASE_URI"] = args.db
+    db.init_app(app)
+
+    with app.app_context():
+        if not args.reuse:
+            seed(args.rows, args.rooms, args.users)
+        print(f"{Message.query.count()} messages in {args.rooms} rooms")
+        for name, query in QUERIES.items():
+            print(f"{name}: {query!r}")
+            bench("search", lambda room_id: search.search_messages(room_id, query, limit=args.limit),
+                  args.rooms, args.iterations)
+            bench("LIKE scan", lambda room_id: like_scan(room_id, query, args.limit),
+                  args.rooms, max(1, args.iterations // 5))
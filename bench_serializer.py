@@ -0,0 +1,79 @@
+"""
+Encode / decode cost and bytes on the wire of the Socket.IO serializers
+(stdlib json, orjson json, ormsgpack) for our main payloads.
+
+    python bench_serializer.py [iterations]
+"""
+import json
+import sys
+import time
+from datetime import datetime
+
+from socketio import packet
+
+from serializer import OrjsonJSON, OrmsgpackPacket
+
+
+class StdlibJSONPacket(packet.Packet):
+    json = json
+
+
+class OrjsonPacket(packet.Packet):
+    json = OrjsonJSON
+
+
+def history_page(size=50):
+    return {
+        "messages": [{
+            "message_id": 1000 + i,
+            "user_id": 7 + i % 5,
+            "username": f"user{i % 5}",
+            "content": "lol did anyone else see that the deploy went out at 3am again " * (1 + i % 3),
+            "object_key": f"uploads/{i:08d}" if i % 10 == 0 else None,
+            "timestamp": datetime(2026, 1, 1, 12, i % 60).isoformat(),
+        } for i in range(size)],
+        "has_more": True,
+        "before": 1000,
+        "after": 1000 + size - 1,
+    }
+
+
+PAYLOADS = {
+    "new_message": ["new_message", {"user_id": 42, "message": "ok who's coming to lunch", "username": "srikar", "image_url": None}],
+    "user_joined": ["user_joined", {"user_id": 42, "username": "srikar"}],
+    "history_page": ["history", history_page()],
+}
+
+SERIALIZERS = {
+    "stdlib json": StdlibJSONPacket,
+    "orjson": OrjsonPacket,
+    "ormsgpack": OrmsgpackPacket,
+}
+
+
+def bench(packet_class, data, iterations):
+    pkt = packet_class(packet.EVENT, data=data, namespace='/')
+    encoded = pkt.encode()
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        packet_class(packet.EVENT, data=data, namespace='/').encode()
+    encode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    started = time.perf_counter()
+    for _ in range(iterations):
+        packet_class(encoded_packet=encoded)
+    decode_us = (time.perf_counter() - started) / iterations * 1e6
+
+    size = len(encoded.encode() if isinstance(encoded, str) else encoded)
+    return encode_us, decode_us, size
+
+
+if __name__ == '__main__':
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{'payload':<14} {'serializer':<12} {'encode us':>10} {'decode us':>10} {'bytes':>8}")
+    for payload_name, data in PAYLOADS.items():
+        for serializer_name, packet_class in SERIALIZERS.items():
+            runs = iterations if payload_name != "history_page" else max(1, iterations // 20)
+            encode_us, decode_us, size = bench(packet_class, data, runs)
+            print(f"{payload_name:<14} {serializer_name:<12} {encode_us:>10.2f} {decode_us:>10.2f} {size:>8}")
@@ -0,0 +1,143 @@
+import os
+import threading
+import time
+
+'''
+adaptive broadcast coalescing
+
+normally every chat line is one new_message frame to every socket in the
+room. in bursty rooms with hundreds of members that's messages x members
+frames. clients can opt in on join_room ({room_code, batching: true}); for
+opted-in sockets a hot room's messages are collected for BATCH_WINDOW_MS
+and sent as one frame:
+
+ - new_messages
+    {
+        messages: [<new_message payload>, ...],
+    }
+
+a room is hot once it sees BATCH_RATE_THRESHOLD messages/sec and cools
+down again below half of that. while a room is cool, and for sockets that
+did not opt in, nothing changes.
+
+every socket in room <room_id> is also in exactly one of the sub-rooms
+"<room_id>:live" (one frame per message) or "<room_id>:batched".
+
+other room events that must not overtake chat lines (agent_status,
+agent_token) go out through emit(), which sends the room's pending batch
+first.
+'''
+
+
+def live_room(room_id):
+    return f"{room_id}:live"
+
+
+def batched_room(room_id):
+    return f"{room_id}:batched"
+
+
+class _RoomState:
+    __slots__ = ("window_start", "window_count", "rate", "hot", "pending", "flush_scheduled")
+
+    def __init__(self, now):
+        self.window_start = now
+        self.window_count = 0
+        self.rate = 0.0
+        self.hot = False
+        self.pending = []
+        self.flush_scheduled = False
+
+
+class RoomBroadcaster:
+
+    def __init__(self, socketio, window_ms=None, rate_threshold=None):
+        self.socketio = socketio
+        self.window = (window_ms or float(os.getenv("BATCH_WINDOW_MS", 100))) / 1000
+        self.rate_threshold = rate_threshold or float(os.getenv("BATCH_RATE_THRESHOLD", 20))
+        self._rooms = {}  # room_id -> _RoomState
+        self._lock = threading.Lock()
+        self.batches_sent = 0
+        self.messages_batched = 0
+
+    def _update_rate(self, state, now):
+        # rate over the last full second, re-evaluated once per second
+        elapsed = now - state.window_start
+        if elapsed >= 1.0:
+            state.rate = state.window_count / elapsed
+            state.window_start = now
+            state.window_count = 0
+            if not state.hot and state.rate >= self.rate_threshold:
+                state.hot = True
+            elif state.hot and state.rate < self.rate_threshold / 2:
+                state.hot = False
+        state.window_count += 1
+
+    def publish(self, room_id, payload):
+        """Broadcast a new_message payload, batching it for opted-in sockets when the room is hot."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None:
+                state = self._rooms[room_id] = _RoomState(now)
+            self._update_rate(state, now)
+            hot = state.hot
+            if hot:
+                state.pending.append(payload)
+                schedule = not state.flush_scheduled
+                state.flush_scheduled = True
+            else:
+                # room just cooled down: send what is still pending first to keep order
+                leftover, state.pending = state.pending, []
+
+        if hot:
+            self.socketio.emit("new_message", payload, room=live_room(room_id))
+            if schedule:
+                self.socketio.start_background_task(self._flush_later, room_id)
+            return
+
+        if leftover:
+            self._emit_batch(room_id, leftover)
+        self.socketio.emit("new_message", payload, room=room_id)
+
+    def emit(self, room_id, event, payload):
+        """Send an event to the whole room, after the messages still batched for it."""
+        with self._lock:
+            state = self._rooms.get(room_id)
+            pending = []
+            if state is not None and state.pending:
+                pending, state.pending = state.pending, []
+        if pending:
+            self._emit_batch(room_id, pending)
+        self.socketio.emit(event, payload, room=room_id)
+
+    def _flush_later(self, room_id):
+        self.socketio.sleep(self.window)
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None:
+                return
+            batch, state.pending = state.pending, []
+            state.flush_scheduled = False
+        if batch:
+            self._emit_batch(room_id, batch)
+
+    def _emit_batch(self, room_id, batch):
+        self.batches_sent += 1
+        self.messages_batched += len(batch)
+        self.socketio.emit("new_messages", {"messages": batch}, room=batched_room(room_id))
+
+    def forget(self, room_id):
+        """Drop rate state for a room nobody is in any more."""
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is not None and not state.pending:
+                del self._rooms[room_id]
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "hot_rooms": sum(1 for state in self._rooms.values() if state.hot),
+            "batches_sent": self.batches_sent,
+            "messages_batched": self.messages_batched,
+        }
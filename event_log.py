@@ -0,0 +1,155 @@
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+'''
+structured socket event log
+
+the socket handlers used to re-import modules, call logging.basicConfig,
+build a json dict (join_room copied all of socket_user_map into it) and
+open / append / close .cursor/debug.log on every single event.
+
+now a handler calls event_log.event(name, **fields), which is a level check,
+an optional sampling coin flip and a deque append. a background thread
+drains the ring buffer every flush_interval seconds and writes everything
+in one go, as json lines to EVENT_LOG_PATH or to the python logger when no
+path is set. if the buffer is full the oldest events are dropped.
+
+profiles (LOG_PROFILE, defaults to production; set LOG_PROFILE=debug locally):
+    - production  INFO events sampled at 1%, warnings and errors always,
+                  no Socket.IO / Engine.IO packet logging
+    - debug       everything, Socket.IO / Engine.IO packet logging on,
+                  written to .cursor/debug.log
+
+per-event sample rates override the profile's, e.g.
+EVENT_LOG_SAMPLE_RATES="send_message=0.001,join_room=0.1". a rate of 0
+drops the event (below WARNING) entirely.
+
+fields should be small scalars; never put per-connection collections in them.
+'''
+
+PROFILES = {
+    "production": {
+        "level": logging.INFO,
+        "sample_rate": 0.01,
+        "socketio_logger": False,
+        "path": None,
+    },
+    "debug": {
+        "level": logging.DEBUG,
+        "sample_rate": 1.0,
+        "socketio_logger": True,
+        "path": os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.cursor', 'debug.log'),
+    },
+}
+
+
+DEFAULT_PROFILE = "production"
+
+
+def parse_sample_rates(value):
+    """"name=rate,name=rate" -> {name: rate}. Raises ValueError on a malformed entry."""
+    rates = {}
+    for entry in (value or "").split(","):
+        if not entry.strip():
+            continue
+        name, sep, rate = entry.partition("=")
+        if not sep or not name.strip():
+            raise ValueError(f"Bad sample rate entry: {entry!r}")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class EventLog:
+
+    def __init__(self, profile=None, capacity=None, flush_interval=None, path=None, sample_rates=None):
+        self.profile = profile or os.getenv("LOG_PROFILE") or DEFAULT_PROFILE
+        if self.profile not in PROFILES:
+            raise ValueError(f"Unknown log profile: {self.profile}")
+        settings = PROFILES[self.profile]
+
+        self.level = settings["level"]
+        self.default_sample_rate = settings["sample_rate"]
+        # per-event overrides, e.g. {"send_message": 0.001}
+        if sample_rates is None:
+            sample_rates = parse_sample_rates(os.getenv("EVENT_LOG_SAMPLE_RATES"))
+        self.sample_rates = sample_rates
+        self.socketio_logger = settings["socketio_logger"]
+        self.path = path or os.getenv("EVENT_LOG_PATH") or settings["path"]
+        self.flush_interval = flush_interval or float(os.getenv("EVENT_LOG_FLUSH_INTERVAL", 1.0))
+
+        self._buffer = deque(maxlen=capacity or int(os.getenv("EVENT_LOG_CAPACITY", 10000)))
+        self._thread = None
+        self._running = False
+        self.dropped = 0
+        self.sampled_out = 0
+
+    def event(self, name, level=logging.INFO, **fields):
+        if level < self.level:
+            return
+        # warnings and errors are never sampled out
+        if level < logging.WARNING:
+            rate = self.sample_rates.get(name, self.default_sample_rate)
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((time.time(), name, level, fields))
+        if not self._running:
+            self.start()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="event-log-flusher", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while self._running:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"event log flush failed: {e}")
+
+    def _drain(self):
+        events = []
+        while self._buffer:
+            try:
+                events.append(self._buffer.popleft())
+            except IndexError:
+                break
+        return events
+
+    def flush(self):
+        events = self._drain()
+        if not events:
+            return
+        if self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(b"".join(
+                    orjson.dumps({"ts": ts, "event": name, "level": logging.getLevelName(level), **fields}, default=str) + b"\n"
+                    for ts, name, level, fields in events
+                ))
+        else:
+            for ts, name, level, fields in events:
+                logger.log(level, "%s %s", name, orjson.dumps(fields, default=str).decode())
+
+    def stop(self):
+        self._running = False
+        self.flush()
+
+
+event_log = EventLog()
@@ -0,0 +1,84 @@
+from itertools import chain
+
+import orjson
+import zstandard
+from sqlalchemy import select
+
+from models import db, Message, User
+import archive
+
+'''
+streaming room export for compliance jobs
+
+exporting a room used to mean paging /get_previous_messages, which builds
+every row, dict and the whole json body in memory. export_room_ndjson
+walks the room with a server-side cursor instead (stream_results +
+yield_per, a named cursor on postgres) and yields NDJSON a chunk at a
+time, optionally through a streaming zstd compressor, so memory stays
+flat however big the room is.
+
+archived messages (archive.py) come first, straight from their segments,
+then the hot tier.
+
+one line per message, oldest first:
+    {"message_id":..,"user_id":..,"username":..,"content":..,"object_key":..,"timestamp":..}
+'''
+
+EXPORT_CHUNK_ROWS = 1000
+ZSTD_LEVEL = 3
+
+
+def _export_rows(room_id, since=None, until=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    query = select(
+        Message.message_id,
+        Message.user_id,
+        User.username,
+        Message.content,
+        Message.image_url,
+        Message.timestamp,
+    ).join(User, User.user_id == Message.user_id)\
+        .where(Message.room_id == room_id)\
+        .order_by(Message.timestamp.asc(), Message.message_id.asc())
+    if since is not None:
+        query = query.where(Message.timestamp >= since)
+    if until is not None:
+        query = query.where(Message.timestamp < until)
+
+    result = db.session.execute(query.execution_options(stream_results=True, yield_per=chunk_rows))
+    for rows in result.partitions():
+        yield rows
+
+
+def _hot_ndjson(room_id, since, until, chunk_rows):
+    for rows in _export_rows(room_id, since, until, chunk_rows):
+        yield b"".join(
+            orjson.dumps({
+                "message_id": row.message_id,
+                "user_id": row.user_id,
+                "username": row.username,
+                "content": row.content,
+                "object_key": row.image_url,
+                "timestamp": row.timestamp,
+            }) + b"\n"
+            for row in rows
+        )
+
+
+def export_room_ndjson(room_id, since=None, until=None, compress=None, chunk_rows=EXPORT_CHUNK_ROWS):
+    """
+    Yields the room's messages as NDJSON bytes, one chunk per chunk_rows messages
+    (one per segment for archived messages). compress="zstd" yields a single zstd frame instead.
+    """
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj() if compress == "zstd" else None
+
+    chunks = chain(archive.archived_ndjson(room_id, since, until), _hot_ndjson(room_id, since, until, chunk_rows))
+    for chunk in chunks:
+        if compressor is not None:
+            chunk = compressor.compress(chunk)
+            if not chunk:
+                # zstd buffers small inputs; nothing to send yet
+                continue
+        yield chunk
+
+    if compressor is not None:
+        yield compressor.flush()
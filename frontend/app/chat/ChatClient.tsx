@@ -2,7 +2,7 @@
 
 import { useSession } from 'next-auth/react';
 import { useRouter, useSearchParams } from 'next/navigation';
-import { useEffect, useState, useRef } from 'react';
+import { useEffect, useLayoutEffect, useState, useRef } from 'react';
 import { io, Socket } from 'socket.io-client';
 
 interface Message {
@@ -14,11 +14,38 @@ interface Message {
   username?: string;
 }
 
+interface HistoryMessage {
+  user_id: number | string;
+  content: string;
+  object_key?: string;
+  username?: string;
+}
+
+// One page of /get_previous_messages; `before` is the cursor for the next older page
+interface HistoryPage {
+  messages: HistoryMessage[];
+  has_more: boolean;
+  before: number | null;
+}
+
+const formatHistory = (page: HistoryMessage[]): Message[] =>
+  page.map((m) => ({
+    user_id: m.user_id,
+    username: m.username,
+    message: m.content,
+    object_key: m.object_key || undefined,
+  }));
+
 export default function ChatPage() {
   const { data: session, status } = useSession();
   const router = useRouter();
   const searchParams = useSearchParams();
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  const scrollContainerRef = useRef<HTMLDivElement>(null);
+  // scrollHeight before older messages were prepended, so the view can stay put
+  const prependScrollHeightRef = useRef<number | null>(null);
+  // scroll events fire faster than state updates; this keeps it to one page request at a time
+  const loadingOlderRef = useRef(false);
   const socketRef = useRef<Socket | null>(null);
   const isConnectingRef = useRef(false);
   const currentRoomRef = useRef<string | null>(null);
@@ -32,15 +59,55 @@ export default function ChatPage() {
   const [input, setInput] = useState('');
   const [isConnected, setIsConnected] = useState(false);
   const [agentStatus, setAgentStatus] = useState<'idle' | 'thinking' | 'responding' | 'failed'>('idle');
+  const [agentDraft, setAgentDraft] = useState('');
   const [selectedImage, setSelectedImage] = useState<File | null>(null);
   const [imagePreview, setImagePreview] = useState<string | null>(null);
   const [isUploading, setIsUploading] = useState(false);
   const [imageUrls, setImageUrls] = useState<Record<string, string>>({});
-
-  // Auto-scroll to bottom when new messages arrive or agent status changes
-  useEffect(() => {
+  // History paging: cursor of the oldest loaded message and whether older pages exist
+  const [olderCursor, setOlderCursor] = useState<number | null>(null);
+  const [hasOlder, setHasOlder] = useState(false);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+
+  // Auto-scroll to bottom when new messages arrive or agent status changes,
+  // but keep the reader where they are when older history is prepended
+  useLayoutEffect(() => {
+    const container = scrollContainerRef.current;
+    if (prependScrollHeightRef.current !== null && container) {
+      container.scrollTop += container.scrollHeight - prependScrollHeightRef.current;
+      prependScrollHeightRef.current = null;
+      return;
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-  }, [messages, agentStatus]);
+  }, [messages, agentStatus, agentDraft]);
+
+  const loadOlderMessages = async () => {
+    if (!roomCode || !hasOlder || loadingOlderRef.current || olderCursor === null) return;
+    loadingOlderRef.current = true;
+    setIsLoadingOlder(true);
+    try {
+      const apiUrl = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:5000';
+      const res = await fetch(`${apiUrl}/get_previous_messages?room_code=${roomCode}&before=${olderCursor}`);
+      if (!res.ok) throw new Error(`HTTP ${res.status}`);
+      const page: HistoryPage = await res.json();
+      prependScrollHeightRef.current = scrollContainerRef.current?.scrollHeight ?? null;
+      setMessages((prev) => [...formatHistory(page.messages), ...prev]);
+      setOlderCursor(page.before);
+      setHasOlder(page.has_more);
+    } catch (err) {
+      console.error('Failed to load older messages:', err);
+    } finally {
+      loadingOlderRef.current = false;
+      setIsLoadingOlder(false);
+    }
+  };
+
+  const handleMessagesScroll = () => {
+    const container = scrollContainerRef.current;
+    if (container && container.scrollTop < 100) {
+      loadOlderMessages();
+    }
+  };
 
   // Resolve presigned URLs for previous messages that have object_key
   useEffect(() => {
@@ -126,7 +193,7 @@ export default function ChatPage() {
   
         if (!response.ok) throw new Error('Failed to get JWT token');
   
-        const { token } = await response.json();
+        const { token, refresh_in } = await response.json();
         if (!token) throw new Error('No token received');
   
         // #region agent log
@@ -157,19 +224,17 @@ export default function ChatPage() {
         currentRoomRef.current = roomCode;
         setSocket(socketInstance);
         setMessages([]);
+        setOlderCursor(null);
+        setHasOlder(false);
 
-        // Load previous messages from the backend
+        // Load the newest page of history; older pages load on scroll-back
         try {
           const prevRes = await fetch(`${apiUrl}/get_previous_messages?room_code=${roomCode}`);
           if (prevRes.ok) {
-            const { messages: prevMessages } = await prevRes.json();
-            const formatted: Message[] = prevMessages.map((m: { user_id: number | string; content: string; object_key?: string; username?: string }) => ({
-              user_id: m.user_id,
-              username: m.username,
-              message: m.content,
-              object_key: m.object_key || undefined,
-            }));
-            setMessages(formatted);
+            const page: HistoryPage = await prevRes.json();
+            setMessages(formatHistory(page.messages));
+            setOlderCursor(page.before);
+            setHasOlder(page.has_more);
           }
         } catch (err) {
           console.error('Failed to load previous messages:', err);
@@ -211,7 +276,7 @@ export default function ChatPage() {
           });
           // #endregion
           setIsConnected(true);
-          socketInstance.emit('join_room', { room_code: roomCode });
+          socketInstance.emit('join_room', { room_code: roomCode, batching: true });
           isConnectingRef.current = false;
         });
 
@@ -233,13 +298,44 @@ export default function ChatPage() {
         });
   
         socketInstance.on('new_message', (data: Message) => {
+          if (data.user_id === 'agent') setAgentDraft('');
           setMessages((prev) => [...prev, data]);
         });
 
+        // Hot rooms deliver messages in batches (we opt in on join_room)
+        socketInstance.on('new_messages', (data: { messages: Message[] }) => {
+          setMessages((prev) => [...prev, ...data.messages]);
+        });
+
+        // Streamed agent reply; a new message_id means the agent started a new message
+        let draftMessageId: string | null = null;
+        socketInstance.on('agent_token', (data: { token: string, message_id: string }) => {
+          if (data.message_id !== draftMessageId) {
+            draftMessageId = data.message_id;
+            setAgentDraft(data.token);
+          } else {
+            setAgentDraft((prev) => prev + data.token);
+          }
+        });
+
+        // Rotate the JWT over the socket before it expires so reconnects keep working
+        let refreshTimer: ReturnType<typeof setTimeout> | null = null;
+        const scheduleRefresh = (seconds?: number) => {
+          if (refreshTimer) clearTimeout(refreshTimer);
+          if (!seconds) return;
+          refreshTimer = setTimeout(() => socketInstance.emit('refresh_token'), seconds * 1000);
+        };
+        socketInstance.on('token_refreshed', (data: { token: string, refresh_in: number }) => {
+          socketInstance.auth = { token: data.token };
+          scheduleRefresh(data.refresh_in);
+        });
+        scheduleRefresh(refresh_in);
+
         // Listen for agent status updates
         socketInstance.on('agent_status', (data: { status: 'idle' | 'thinking' | 'responding' | 'failed', error?: string }) => {
           console.log('[DEBUG] Agent status update:', data);
           setAgentStatus(data.status);
+          if (data.status === 'idle' || data.status === 'failed') setAgentDraft('');
           
           // Auto-reset failed status after 3 seconds
           if (data.status === 'failed') {
@@ -493,8 +589,19 @@ export default function ChatPage() {
       </header>
 
       {/* Messages Area */}
-      <div className="flex-1 overflow-y-auto">
+      <div ref={scrollContainerRef} onScroll={handleMessagesScroll} className="flex-1 overflow-y-auto">
         <div className="max-w-4xl mx-auto px-4 sm:px-6 py-6">
+          {hasOlder && (
+            <div className="flex justify-center mb-4">
+              <button
+                onClick={loadOlderMessages}
+                disabled={isLoadingOlder}
+                className="px-3 py-1 text-xs font-medium text-slate-500 bg-white border border-slate-200 rounded-full hover:bg-slate-50 disabled:opacity-50"
+              >
+                {isLoadingOlder ? 'Loading…' : 'Load earlier messages'}
+              </button>
+            </div>
+          )}
           {messages.length === 0 ? (
             <div className="flex flex-col items-center justify-center h-full min-h-[300px] text-center">
               <div className="w-16 h-16 bg-slate-200 rounded-full flex items-center justify-center mb-4">
@@ -591,7 +698,10 @@ export default function ChatPage() {
                             <span className="text-sm text-white/90">Thinking...</span>
                           </>
                         )}
-                        {agentStatus === 'responding' && (
+                        {agentStatus === 'responding' && agentDraft && (
+                          <p className="text-sm leading-relaxed break-words text-white">{agentDraft}</p>
+                        )}
+                        {agentStatus === 'responding' && !agentDraft && (
                           <>
                             <svg className="w-4 h-4 text-white/80 animate-spin" fill="none" viewBox="0 0 24 24">
                               <circle className="opacity-25" cx="12" cy="12" r="10" stroke="currentColor" strokeWidth="4"></circle>
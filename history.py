@@ -0,0 +1,111 @@
+from sqlalchemy import tuple_
+
+from models import db, Message, User
+import archive
+
+'''
+room history pages for /get_previous_messages
+
+keyset pagination over (timestamp, message_id), which is exactly the
+ix_messages_room_id_timestamp_message_id index, so a page is one index
+range scan no matter how far back the client has scrolled.
+
+    - no cursor      newest `limit` messages
+    - before=<id>    the `limit` messages right before message <id>
+    - after=<id>     the `limit` messages right after message <id>
+
+usernames come from a join in the same query (no msg.user lazy load per row)
+
+when a page runs off the hot tier it continues into the room's archived
+segments (archive.py), so clients page through archived history the same
+way. archived messages always sort before hot ones, so a page is hot rows
+then archived rows going back, and archived rows then hot rows going forward.
+'''
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def _cursor_key(message_id):
+    cursor_ts = db.session.query(Message.timestamp)\
+        .filter(Message.message_id == message_id)\
+        .scalar_subquery()
+    return tuple_(cursor_ts, message_id)
+
+
+def _page_query(room_id):
+    return db.session.query(
+        Message.message_id,
+        Message.user_id,
+        User.username,
+        Message.content,
+        Message.image_url,
+        Message.timestamp,
+    ).join(User, User.user_id == Message.user_id)\
+        .filter(Message.room_id == room_id)
+
+
+def _message_dict(row):
+    return {
+        "message_id": row.message_id,
+        "user_id": row.user_id,
+        "username": row.username,
+        "content": row.content,
+        "object_key": row.image_url,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None
+    }
+
+
+def _is_hot(message_id):
+    return db.session.query(Message.message_id).filter(Message.message_id == message_id).first() is not None
+
+
+def _read_through(room_id, before, after, hot, count):
+    """Up to count messages continuing a page that ran off the hot tier, in the page's order."""
+    cursor = after if after is not None else before
+    if cursor is None or hot or _is_hot(cursor):
+        # the cursor is hot: going back continues at the newest archived message,
+        # going forward there is nothing after the hot tier
+        return [] if after is not None else archive.read_archived(room_id, count)
+
+    # the cursor is archived, or doesn't exist
+    messages = archive.read_archived(room_id, count, before=before, after=after)
+    if messages is None:
+        return []
+    if after is not None and len(messages) < count:
+        # past the newest archived message, continue at the oldest hot one
+        rows = _page_query(room_id)\
+            .order_by(Message.timestamp.asc(), Message.message_id.asc())\
+            .limit(count - len(messages)).all()
+        messages += [_message_dict(row) for row in rows]
+    return messages
+
+
+def get_history_page(room_id, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """
+    Returns (messages, has_more). messages are oldest first.
+    has_more says whether there is another page in the direction of travel.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    key = tuple_(Message.timestamp, Message.message_id)
+
+    query = _page_query(room_id)
+
+    if after is not None:
+        query = query.filter(key > _cursor_key(after))\
+            .order_by(Message.timestamp.asc(), Message.message_id.asc())
+    else:
+        if before is not None:
+            query = query.filter(key < _cursor_key(before))
+        query = query.order_by(Message.timestamp.desc(), Message.message_id.desc())
+
+    # one extra row tells us if there is another page without a COUNT
+    messages = [_message_dict(row) for row in query.limit(limit + 1).all()]
+    if len(messages) <= limit:
+        messages += _read_through(room_id, before, after, messages, limit + 1 - len(messages))
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+    if after is None:
+        messages.reverse()
+
+    return messages, has_more
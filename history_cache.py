@@ -0,0 +1,175 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import orjson
+
+from history import get_history_page, DEFAULT_PAGE_SIZE
+from lookup_cache import TTLCache
+from persistence import on_messages_written
+from session_store import get_message_queue_url
+
+'''
+conditional GETs and a page cache for /get_previous_messages
+
+the client refetches the newest history page on every reload and
+reconnect, even when nothing changed. now:
+
+    - every room has a version, bumped after each message writer flush
+      that wrote to the room (persistence.on_messages_written), plus the
+      time of the last bump for Last-Modified
+    - versions live in redis when SOCKETIO_MESSAGE_QUEUE points at one,
+      so every worker agrees, else in process memory. a room's version
+      starts at the time it is first seen in microseconds, so versions
+      handed out before a restart are never handed out again
+    - the ETag is the room's version. If-None-Match with the current one
+      gets a 304 without touching the database
+    - clients without ETags revalidate with If-Modified-Since. HTTP dates
+      are whole seconds, so Last-Modified is left out while the last bump
+      is less than a second old: a write after the client's copy then
+      always lands in a later second. If-None-Match wins when both are sent
+    - serialized page bodies are cached per room (LRU over rooms), tagged
+      with the version they were built at. a bump drops the room's pages
+      in this process and makes other workers' pages stale
+    - the version is read before the page is queried, so a body can be
+      newer than its version but never older
+
+Cache-Control: no-cache makes browsers revalidate with If-None-Match on
+every fetch instead of reusing the page blindly.
+'''
+
+HISTORY_CACHE_ROOMS = int(os.getenv("HISTORY_CACHE_ROOMS", 5000))
+HISTORY_CACHE_PAGES_PER_ROOM = int(os.getenv("HISTORY_CACHE_PAGES_PER_ROOM", 16))
+HISTORY_CACHE_TTL = float(os.getenv("HISTORY_CACHE_TTL", 600))
+
+
+def _now_us():
+    return time.time_ns() // 1000
+
+
+class MemoryRoomVersions:
+
+    def __init__(self):
+        self._versions = {}  # room_id -> (version, modified_at in epoch seconds)
+        self._lock = threading.Lock()
+
+    def get(self, room_id):
+        """(version, modified_at) of the room's history."""
+        entry = self._versions.get(room_id)
+        if entry is None:
+            with self._lock:
+                entry = self._versions.setdefault(room_id, (_now_us(), time.time()))
+        return entry
+
+    def bump(self, room_ids):
+        now = time.time()
+        with self._lock:
+            for room_id in room_ids:
+                version, _ = self._versions.get(room_id, (_now_us(), now))
+                self._versions[room_id] = (version + 1, now)
+
+
+class RedisRoomVersions:
+
+    def __init__(self, url=None, client=None, prefix="chat"):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self._versions_key = f"{prefix}:room_versions"
+        self._modified_key = f"{prefix}:room_modified"
+
+    def get(self, room_id):
+        """(version, modified_at) of the room's history."""
+        pipe = self._redis.pipeline()
+        pipe.hsetnx(self._versions_key, room_id, _now_us())
+        pipe.hsetnx(self._modified_key, room_id, time.time())
+        pipe.hget(self._versions_key, room_id)
+        pipe.hget(self._modified_key, room_id)
+        _, _, version, modified_at = pipe.execute()
+        return int(version), float(modified_at)
+
+    def bump(self, room_ids):
+        now = time.time()
+        pipe = self._redis.pipeline()
+        for room_id in room_ids:
+            pipe.hsetnx(self._versions_key, room_id, _now_us())
+            pipe.hincrby(self._versions_key, room_id, 1)
+            pipe.hset(self._modified_key, room_id, now)
+        pipe.execute()
+
+
+def create_room_versions(url=None):
+    url = url or get_message_queue_url()
+    if url and url.startswith(("redis://", "rediss://")):
+        return RedisRoomVersions(url)
+    return MemoryRoomVersions()
+
+
+room_versions = MemoryRoomVersions()
+
+# room_id -> (version, {(before, after, limit): body})
+_pages = TTLCache(maxsize=HISTORY_CACHE_ROOMS, ttl=HISTORY_CACHE_TTL)
+_page_hits = 0
+_page_misses = 0
+
+
+def _bump_written_rooms(rows):
+    room_ids = {row["room_id"] for row in rows}
+    room_versions.bump(room_ids)
+    for room_id in room_ids:
+        _pages.invalidate(room_id)
+
+
+def init_app(app, versions=None):
+    global room_versions
+    room_versions = versions or create_room_versions()
+    on_messages_written(_bump_written_rooms)
+
+
+def history_version(room_id):
+    """(etag, last_modified) of the room's history."""
+    version, modified_at = room_versions.get(room_id)
+    return f"room-{room_id}-v{version}", datetime.fromtimestamp(modified_at, timezone.utc)
+
+
+def history_page_body(room_id, etag, before=None, after=None, limit=DEFAULT_PAGE_SIZE):
+    """Serialized /get_previous_messages body, from the page cache when it was built at etag."""
+    global _page_hits, _page_misses
+    key = (before, after, limit)
+    cached = _pages.get(room_id)
+    if cached is not None and cached[0] == etag:
+        body = cached[1].get(key)
+        if body is not None:
+            _page_hits += 1
+            return body
+    _page_misses += 1
+
+    messages, has_more = get_history_page(room_id, before=before, after=after, limit=limit)
+    body = orjson.dumps({
+        "messages": messages,
+        "has_more": has_more,
+        # cursors for the next page in each direction
+        "before": messages[0]["message_id"] if messages else before,
+        "after": messages[-1]["message_id"] if messages else after,
+    })
+
+    if cached is None or cached[0] != etag:
+        cached = (etag, {})
+        _pages.set(room_id, cached)
+    pages = cached[1]
+    if len(pages) >= HISTORY_CACHE_PAGES_PER_ROOM:
+        pages.clear()
+    pages[key] = body
+    return body
+
+
+def stats():
+    lookups = _page_hits + _page_misses
+    return {
+        "rooms": len(_pages),
+        "hits": _page_hits,
+        "misses": _page_misses,
+        "hit_rate": _page_hits / lookups if lookups else 0.0,
+    }
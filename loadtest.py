@@ -0,0 +1,300 @@
+"""
+Socket.IO load test.
+
+Starts app.socketio in a subprocess (SQLite by default, or any DATABASE_URL
+such as a local Postgres) with fake LLM, search and S3 backends, then
+drives N authenticated clients across M rooms through join_room,
+send_message and leave_room.
+
+Reports messages/sec and p50/p95/p99 broadcast fan-out latency (send to
+receipt of new_message on every member of the room), plus SQL statements
+per message from /metrics, and writes everything as JSON so runs can be
+diffed between commits.
+
+    python loadtest.py --clients 50 --rooms 5 --messages 20
+    python loadtest.py --db postgresql://localhost/chat_bench --out before.json
+
+--token-ttl T makes the server issue T-second tokens. After the message
+phase every client drops its connection, waits until the original tokens
+have expired and reconnects. Rejected reconnects are clients that would
+have to go through /auth/login again. Add --refresh to have clients
+rotate their token in-band (refresh_token) and compare the two runs.
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import requests
+import socketio as socketio_client
+
+
+def serve(args):
+    os.environ["DATABASE_URL"] = args.db
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    os.environ.setdefault("LOG_PROFILE", "production")
+    if args.token_ttl:
+        os.environ["JWT_TTL_SECONDS"] = str(args.token_ttl)
+
+    import bench_fakes
+    bench_fakes.install()
+
+    from app import app, socketio
+    from models import db
+
+    with app.app_context():
+        # only wipe throwaway sqlite files; never drop tables on a real server
+        if args.db.startswith("sqlite"):
+            db.drop_all()
+        db.create_all()
+
+    socketio.run(app, host="127.0.0.1", port=args.port, debug=False, log_output=False)
+
+
+def wait_for_server(base_url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{base_url}/metrics", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+def sql_statement_count(base_url):
+    text = requests.get(f"{base_url}/metrics").text
+    return sum(int(n) for n in re.findall(r'^chat_db_query_seconds_count\{[^}]*\} (\d+)', text, re.M))
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(p / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+class SimClient:
+
+    def __init__(self, index, base_url, login, room_code, transports, batching=False):
+        self.index = index
+        self.batching = batching
+        self.base_url = base_url
+        self.token = login["token"]
+        self.refresh_in = login.get("refresh_in")
+        self.refresh_timer = None
+        self.room_code = room_code
+        self.transports = transports
+        self.latencies = []
+        self.received = 0
+        self.lock = threading.Lock()
+        self.joined = threading.Event()
+        self.sio = socketio_client.Client(reconnection=False)
+        self.sio.on("new_message", self._on_message)
+        self.sio.on("new_messages", self._on_messages)
+        self.sio.on("user_joined", self._on_joined)
+        self.sio.on("token_refreshed", self._on_token_refreshed)
+
+    def _on_joined(self, data):
+        if data.get("user_id") is not None:
+            self.joined.set()
+
+    def _on_token_refreshed(self, data):
+        self.token = data["token"]
+        self.schedule_refresh(data["refresh_in"])
+
+    def schedule_refresh(self, seconds):
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+        self.refresh_timer = threading.Timer(seconds, lambda: self.sio.emit("refresh_token"))
+        self.refresh_timer.daemon = True
+        self.refresh_timer.start()
+
+    def _on_message(self, data):
+        received_at = time.time()
+        text = data.get("message") or ""
+        if text.startswith("bench|"):
+            sent_at = float(text.split("|")[3])
+            with self.lock:
+                self.latencies.append((received_at - sent_at) * 1000)
+                self.received += 1
+
+    def _on_messages(self, data):
+        for message in data["messages"]:
+            self._on_message(message)
+
+    def connect(self):
+        self.sio.connect(self.base_url, auth={"token": self.token}, transports=self.transports)
+        self.sio.emit("join_room", {"room_code": self.room_code, "batching": self.batching})
+
+    def send(self, count, interval):
+        for seq in range(count):
+            self.sio.emit("send_message", {
+                "room_code": self.room_code,
+                "message": f"bench|{self.index}|{seq}|{time.time():.6f}",
+            })
+            time.sleep(interval)
+
+    def reconnect(self):
+        """Reconnect with the current token. Returns False if the server rejected it."""
+        self.sio.disconnect()
+        try:
+            self.connect()
+            return True
+        except socketio_client.exceptions.ConnectionError:
+            return False
+
+    def leave(self):
+        if self.refresh_timer:
+            self.refresh_timer.cancel()
+        if self.sio.connected:
+            self.sio.emit("leave_room", {"room_code": self.room_code})
+            self.sio.disconnect()
+
+
+def run(args):
+    base_url = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", "--port", str(args.port), "--db", args.db,
+         "--token-ttl", str(args.token_ttl)],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    try:
+        wait_for_server(base_url)
+
+        room_codes = [requests.post(f"{base_url}/create_room").json()["room_code"] for _ in range(args.rooms)]
+        logins = [
+            requests.post(f"{base_url}/auth/login", json={
+                "provider": "bench",
+                "provider_id": f"bench-{i}",
+                "email": f"bench-{i}@example.invalid",
+                "name": f"bench-{i}",
+            }).json()
+            for i in range(args.clients)
+        ]
+
+        try:
+            import websocket  # noqa: F401  (websocket-client)
+            transports = ["websocket"]
+        except ImportError:
+            transports = ["polling"]
+
+        clients = [
+            SimClient(i, base_url, logins[i], room_codes[i % args.rooms], transports, batching=args.batching)
+            for i in range(args.clients)
+        ]
+        connect_started = time.perf_counter()
+        for client in clients:
+            client.connect()
+        for client in clients:
+            client.joined.wait(10)
+        connect_seconds = time.perf_counter() - connect_started
+        if args.refresh:
+            for client in clients:
+                client.schedule_refresh(client.refresh_in)
+
+        members_per_room = {code: 0 for code in room_codes}
+        for client in clients:
+            members_per_room[client.room_code] += 1
+        expected_deliveries = sum(members * members * args.messages for members in members_per_room.values())
+
+        statements_before = sql_statement_count(base_url)
+        started = time.perf_counter()
+        senders = [threading.Thread(target=c.send, args=(args.messages, args.interval)) for c in clients]
+        for sender in senders:
+            sender.start()
+        for sender in senders:
+            sender.join()
+
+        deadline = time.time() + args.timeout
+        while sum(c.received for c in clients) < expected_deliveries and time.time() < deadline:
+            time.sleep(0.05)
+        duration = time.perf_counter() - started
+
+        expiry_reconnect = None
+        if args.token_ttl:
+            # wait out the longest possible (jittered) lifetime of the login tokens
+            login_expiry = max(login["expires_in"] for login in logins)
+            time.sleep(max(0, login_expiry + 1 - (time.perf_counter() - connect_started)))
+            rejected = sum(1 for client in clients if not client.reconnect())
+            expiry_reconnect = {
+                "reconnects": len(clients),
+                "rejected": rejected,
+                "relogin_rate": round(rejected / len(clients), 3),
+            }
+
+        for client in clients:
+            client.leave()
+        # let the write-behind writer catch up before reading the counters
+        time.sleep(0.5)
+        statements = sql_statement_count(base_url) - statements_before
+
+        latencies = sorted(l for c in clients for l in c.latencies)
+        sent = args.clients * args.messages
+        delivered = len(latencies)
+        results = {
+            "commit": subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip(),
+            "config": {
+                "clients": args.clients,
+                "rooms": args.rooms,
+                "messages_per_client": args.messages,
+                "interval_s": args.interval,
+                "db": args.db.split("@")[-1],
+                "transport": transports[0],
+                "token_ttl_s": args.token_ttl,
+                "in_band_refresh": args.refresh,
+                "batching": args.batching,
+            },
+            "connect_join_seconds": round(connect_seconds, 3),
+            "messages_sent": sent,
+            "deliveries_expected": expected_deliveries,
+            "deliveries": delivered,
+            "duration_s": round(duration, 3),
+            "messages_per_sec": round(sent / duration, 1),
+            "deliveries_per_sec": round(delivered / duration, 1),
+            "fanout_latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "sql_statements_per_message": round(statements / sent, 2) if sent else None,
+            "expiry_reconnect": expiry_reconnect,
+        }
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(json.dumps(results, indent=2))
+        return results
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=20)
+    parser.add_argument("--rooms", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=20, help="messages sent per client")
+    parser.add_argument("--interval", type=float, default=0.05, help="seconds between a client's messages")
+    parser.add_argument("--timeout", type=float, default=30, help="seconds to wait for deliveries")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--db", default=os.getenv("LOADTEST_DATABASE_URL", "sqlite:////tmp/chat_loadtest.db"))
+    parser.add_argument("--out", default="loadtest_results.json")
+    parser.add_argument("--token-ttl", type=int, default=0, help="token lifetime in seconds for the expiry scenario")
+    parser.add_argument("--refresh", action="store_true", help="rotate tokens in-band with refresh_token")
+    parser.add_argument("--batching", action="store_true", help="opt clients in to new_messages batches")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    if args.serve:
+        serve(args)
+    else:
+        run(args)
@@ -0,0 +1,138 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from models import db, Room, User
+
+'''
+identity lookup cache
+
+every socket event used to query rooms by room_code and users by user_id
+just to get a room_id and a username. those basically never change, so
+they live in small process-local caches:
+    - LRU eviction once maxsize entries are stored
+    - entries expire after ttl seconds so a rename eventually shows up
+    - invalidate_room / invalidate_user drop an entry right away
+    - hits / misses counters for checking the hit rate
+    - TTLCache(weigh=...) caps the total weight of the values (e.g. messages
+      in a decoded archive segment) instead of the number of entries
+
+misses (room or user not found) are not cached, so a room created a
+moment ago is found on the next lookup.
+'''
+
+
+class TTLCache:
+
+    def __init__(self, maxsize, ttl, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # weigh(value) -> size; maxsize then caps the total size instead of the entry count
+        self.weigh = weigh
+        self._data = OrderedDict()  # key -> (expires_at, value, weight)
+        self._weight = 0
+        # critical sections never yield, so a plain lock is fine under eventlet too
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    del self._data[key]
+                    self._weight -= entry[2]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        weight = self.weigh(value) if self.weigh else 1
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._weight -= old[2]
+            self._data[key] = (time.monotonic() + self.ttl, value, weight)
+            self._weight += weight
+            while self._weight > self.maxsize and self._data:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._weight -= evicted
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is not None:
+                self._weight -= entry[2]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._weight = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "weight": self._weight,
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+room_id_cache = TTLCache(
+    maxsize=int(os.getenv("ROOM_CACHE_SIZE", 10000)),
+    ttl=float(os.getenv("ROOM_CACHE_TTL", 3600)),
+)
+username_cache = TTLCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", 50000)),
+    ttl=float(os.getenv("USER_CACHE_TTL", 600)),
+)
+
+
+def get_room_id(room_code):
+    """room_code -> room_id, or None if the room does not exist."""
+    if not room_code:
+        return None
+    room_id = room_id_cache.get(room_code)
+    if room_id is None:
+        row = db.session.query(Room.room_id).filter_by(room_code=room_code).first()
+        if row is None:
+            return None
+        room_id = row.room_id
+        room_id_cache.set(room_code, room_id)
+    return room_id
+
+
+def get_username(user_id):
+    """user_id -> username, or None if the user does not exist."""
+    if user_id is None:
+        return None
+    username = username_cache.get(user_id)
+    if username is None:
+        row = db.session.query(User.username).filter_by(user_id=user_id).first()
+        if row is None:
+            return None
+        username = row.username
+        username_cache.set(user_id, username)
+    return username
+
+
+def invalidate_room(room_code):
+    room_id_cache.invalidate(room_code)
+
+
+def invalidate_user(user_id):
+    username_cache.invalidate(user_id)
@@ -0,0 +1,395 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import xxhash
+from sqlalchemy import insert
+
+from models import db, Message, MessageEmbedding, User
+from persistence import BatchWriter, TRANSIENT_DB_ERRORS, on_messages_written
+from room_memory import TRANSIENT_OPENAI_ERRORS
+
+logger = logging.getLogger(__name__)
+
+'''
+retrieval over older room history
+
+the agent only ever saw the last 10 messages. this keeps an embedding per
+message so run_agent can also pull in the older messages most relevant to
+the question, without sending the whole history.
+
+    - embedders: HashEmbedder (feature hashing, deterministic, no network)
+      for tests / local runs, OpenAIEmbedder in production. MESSAGE_EMBEDDER
+      picks one; default is openai when OPENAI_API_KEY is set
+    - after every message writer flush (when message_ids are known) the new
+      rows are queued on embedding_writer, which embeds them in batches,
+      stores the vectors in message_embeddings and appends them to the
+      in-memory index
+    - RoomVectorIndex keeps one float32 matrix per room, loaded from
+      message_embeddings on first search. a room costs
+      vectors x (dim x 4 + 8) bytes (plus up to 2x while its arrays grow):
+      ~61 MB for 10000 vectors of text-embedding-3-small (1536 dims),
+      ~10 MB at 256 dims. rooms are evicted LRU once the index holds
+      more than MESSAGE_INDEX_MAX_MB, and a room never keeps more than
+      MESSAGE_INDEX_PER_ROOM vectors or more than fit in the budget
+    - search is a matrix product of normalized vectors (cosine) and
+      argpartition for the top k, for any number of queries at once
+    - retrieve_context fills a fixed token budget with the best hits that
+      are older than the recent window the agent already gets
+
+[Agent] replies and image-only messages are not embedded.
+'''
+
+MESSAGE_INDEX_ENABLED = os.getenv("MESSAGE_INDEX", "true").lower() == "true"
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 8))
+RETRIEVAL_TOKEN_BUDGET = int(os.getenv("RETRIEVAL_TOKEN_BUDGET", 800))
+RETRIEVAL_MIN_SCORE = float(os.getenv("RETRIEVAL_MIN_SCORE", 0.2))
+
+_TOKEN_RE = re.compile(r"\w+")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class HashEmbedder:
+    """Signed feature hashing of words and word bigrams. Deterministic and offline."""
+
+    def __init__(self, dim=256):
+        self.dim = dim
+        self.name = f"hash-{dim}"
+
+    def embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = _TOKEN_RE.findall(text.lower())
+            for feature in tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]:
+                h = xxhash.xxh64_intdigest(feature)
+                out[row, h % self.dim] += 1.0 if h >> 63 else -1.0
+        return _normalize(out)
+
+
+class OpenAIEmbedder:
+    """OpenAI embeddings API, one request per batch of texts."""
+
+    def __init__(self, model="text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+        self.name = f"openai:{model}"
+        self._client = OpenAIEmbeddings(model=model)
+
+    def embed(self, texts):
+        return _normalize(np.asarray(self._client.embed_documents(list(texts)), dtype=np.float32))
+
+
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        kind = os.getenv("MESSAGE_EMBEDDER") or ("openai" if os.getenv("OPENAI_API_KEY") else "hash")
+        if kind == "openai":
+            _embedder = OpenAIEmbedder(os.getenv("MESSAGE_EMBEDDING_MODEL", "text-embedding-3-small"))
+        else:
+            _embedder = HashEmbedder()
+    return _embedder
+
+
+def set_embedder(embedder):
+    global _embedder
+    _embedder = embedder
+    message_index.clear()
+
+
+def _row_bytes(dim):
+    # float32 vector + int64 message_id
+    return dim * 4 + 8
+
+
+class _RoomVectors:
+    __slots__ = ("ids", "vectors", "size", "loaded", "pending")
+
+    def __init__(self):
+        self.ids = None
+        self.vectors = None
+        self.size = 0
+        self.loaded = False
+        # vectors added while the room was being loaded from the db
+        self.pending = []
+
+    @property
+    def nbytes(self):
+        return self.ids.nbytes + self.vectors.nbytes if self.vectors is not None else 0
+
+    def extend(self, ids, vectors, max_size):
+        n = len(ids)
+        if n == 0:
+            return
+        if self.vectors is None or self.size + n > len(self.ids) or self.size + n > max_size:
+            # always reallocate instead of shifting in place, so searches holding
+            # a view of the old arrays never see them change
+            keep = min(self.size, max_size - min(n, max_size))
+            capacity = min(max_size, max(64, 2 * (keep + n)))
+            new_ids = np.empty(capacity, dtype=np.int64)
+            new_vectors = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            if keep:
+                new_ids[:keep] = self.ids[self.size - keep:self.size]
+                new_vectors[:keep] = self.vectors[self.size - keep:self.size]
+            self.ids, self.vectors, self.size = new_ids, new_vectors, keep
+        n = min(n, max_size)
+        self.ids[self.size:self.size + n] = ids[-n:]
+        self.vectors[self.size:self.size + n] = vectors[-n:]
+        self.size += n
+
+
+class RoomVectorIndex:
+
+    def __init__(self, max_bytes, per_room, max_rooms=1000):
+        self.max_bytes = max_bytes
+        self.per_room = per_room
+        self.max_rooms = max_rooms
+        self._rooms = OrderedDict()  # room_id -> _RoomVectors
+        # db loads run outside the lock
+        self._lock = threading.Lock()
+        self.loads = 0
+        self.evictions = 0
+        self.searches = 0
+
+    def _room_cap(self, dim):
+        """Vectors a room may keep: per_room, or fewer if a room that size wouldn't fit in the budget."""
+        return max(1, min(self.per_room, self.max_bytes // _row_bytes(dim)))
+
+    def _extend(self, state, ids, vectors):
+        # caller holds the lock
+        state.extend(ids, vectors, self._room_cap(vectors.shape[1]))
+        self._evict()
+
+    def _evict(self):
+        # caller holds the lock. least recently searched rooms go first; the newest one always stays
+        total = sum(state.nbytes for state in self._rooms.values())
+        while len(self._rooms) > 1 and (total > self.max_bytes or len(self._rooms) > self.max_rooms):
+            _, evicted = self._rooms.popitem(last=False)
+            total -= evicted.nbytes
+            self.evictions += 1
+
+    def add(self, room_id, ids, vectors):
+        """Append vectors of newly written messages. Rooms not in memory pick them up when loaded."""
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None:
+                return
+            if not state.loaded:
+                state.pending.append((np.asarray(ids, dtype=np.int64), vectors))
+                return
+            self._extend(state, np.asarray(ids, dtype=np.int64), vectors)
+
+    def _load(self, room_id, embedder):
+        with self._lock:
+            state = self._rooms.get(room_id)
+            if state is None:
+                state = self._rooms[room_id] = _RoomVectors()
+                self._evict()
+            else:
+                self._rooms.move_to_end(room_id)
+            if state.loaded:
+                return state
+
+        rows = (db.session.query(MessageEmbedding.message_id, MessageEmbedding.vector)
+                .filter_by(room_id=room_id, model=embedder.name)
+                .order_by(MessageEmbedding.message_id.desc())
+                .limit(self.per_room).all())
+        rows.reverse()
+
+        with self._lock:
+            if state.loaded:
+                return state
+            self.loads += 1
+            loaded_ids = set()
+            if rows:
+                ids = np.fromiter((r.message_id for r in rows), dtype=np.int64, count=len(rows))
+                vectors = np.frombuffer(b"".join(r.vector for r in rows), dtype=np.float32).reshape(len(rows), -1)
+                self._extend(state, ids, vectors)
+                loaded_ids = set(ids.tolist())
+            for pending_ids, pending_vectors in state.pending:
+                keep = np.array([i not in loaded_ids for i in pending_ids.tolist()], dtype=bool)
+                if keep.any():
+                    self._extend(state, pending_ids[keep], pending_vectors[keep])
+            state.pending = []
+            state.loaded = True
+            return state
+
+    def search(self, room_id, queries, k, embedder=None):
+        """
+        Top k (message_id, score) per query row, best first.
+        queries is an (n, dim) array of normalized vectors.
+        """
+        state = self._load(room_id, embedder or get_embedder())
+        with self._lock:
+            ids = state.ids[:state.size] if state.size else None
+            vectors = state.vectors[:state.size] if state.size else None
+            self.searches += 1
+        if ids is None:
+            return [[] for _ in range(len(queries))]
+
+        scores = queries @ vectors.T
+        k = min(k, len(ids))
+        results = []
+        for row in scores:
+            top = np.argpartition(-row, k - 1)[:k] if k < len(ids) else np.arange(len(ids))
+            top = top[np.argsort(-row[top])]
+            results.append([(int(ids[i]), float(row[i])) for i in top])
+        return results
+
+    def clear(self):
+        with self._lock:
+            self._rooms.clear()
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "vectors": sum(state.size for state in self._rooms.values()),
+            "bytes": sum(state.nbytes for state in self._rooms.values()),
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "searches": self.searches,
+        }
+
+
+message_index = RoomVectorIndex(
+    max_bytes=int(float(os.getenv("MESSAGE_INDEX_MAX_MB", 256)) * 2**20),
+    per_room=int(os.getenv("MESSAGE_INDEX_PER_ROOM", 10000)),
+    max_rooms=int(os.getenv("MESSAGE_INDEX_ROOMS", 1000)),
+)
+
+
+def _embed_rows(rows):
+    embedder = get_embedder()
+    vectors = embedder.embed([row["content"] for row in rows])
+    db.session.execute(insert(MessageEmbedding), [
+        {"message_id": row["message_id"], "room_id": row["room_id"], "model": embedder.name,
+         "vector": vectors[i].tobytes()}
+        for i, row in enumerate(rows)
+    ])
+    db.session.commit()
+
+    by_room = {}
+    for i, row in enumerate(rows):
+        by_room.setdefault(row["room_id"], []).append(i)
+    for room_id, positions in by_room.items():
+        message_index.add(room_id, [rows[i]["message_id"] for i in positions], vectors[positions])
+
+
+embedding_writer = BatchWriter(
+    "embeddings",
+    _embed_rows,
+    max_queue=int(os.getenv("EMBEDDING_MAX_QUEUE", 10000)),
+    batch_size=int(os.getenv("EMBEDDING_BATCH_SIZE", 100)),
+    flush_interval=float(os.getenv("EMBEDDING_FLUSH_INTERVAL", 1.0)),
+    overflow="drop_oldest",
+    transient_errors=TRANSIENT_DB_ERRORS + TRANSIENT_OPENAI_ERRORS,
+    # one embeddings request per batch, don't bisect it into many
+    split_failed_batches=False,
+)
+
+
+def _embeddable(content):
+    return content and content != "[Image]" and not content.startswith("[Agent]")
+
+
+def _queue_for_embedding(rows):
+    for row in rows:
+        if _embeddable(row["content"]):
+            embedding_writer.enqueue({"message_id": row["message_id"], "room_id": row["room_id"], "content": row["content"]})
+
+
+def init_app(app):
+    if not MESSAGE_INDEX_ENABLED:
+        return
+    embedding_writer.init_app(app)
+    on_messages_written(_queue_for_embedding)
+
+
+def backfill_embeddings(batch_size=500):
+    """Embed every message that has no vector for the current embedder yet. Returns how many were embedded."""
+    embedder = get_embedder()
+    total = 0
+    last_id = 0
+    while True:
+        rows = (db.session.query(Message.message_id, Message.room_id, Message.content)
+                .outerjoin(MessageEmbedding, MessageEmbedding.message_id == Message.message_id)
+                .filter(MessageEmbedding.message_id.is_(None), Message.message_id > last_id)
+                .order_by(Message.message_id)
+                .limit(batch_size).all())
+        if not rows:
+            return total
+        last_id = rows[-1].message_id
+        batch = [{"message_id": r.message_id, "room_id": r.room_id, "content": r.content}
+                 for r in rows if _embeddable(r.content)]
+        if batch:
+            _embed_rows(batch)
+            total += len(batch)
+            logger.info(f"embedded {total} messages with {embedder.name}")
+
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens in text for gpt-4o models; ~4 characters per token if tiktoken can't load its encoding."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text))
+
+
+def retrieve_context(room_id, query, before=None, k=RETRIEVAL_K, token_budget=RETRIEVAL_TOKEN_BUDGET):
+    """
+    Up to k messages older than `before` most relevant to query, fitting in token_budget.
+    Returns [{message_id, username, content, timestamp}], oldest first.
+    """
+    embedder = get_embedder()
+    # over-fetch: some hits fall inside the recent window or under the score floor
+    hits = message_index.search(room_id, embedder.embed([query]), k * 4, embedder=embedder)[0]
+    hits = [(message_id, score) for message_id, score in hits if score >= RETRIEVAL_MIN_SCORE]
+    if not hits:
+        return []
+
+    rows = (db.session.query(Message.message_id, Message.content, Message.timestamp, User.username)
+            .join(User, User.user_id == Message.user_id)
+            .filter(Message.message_id.in_([message_id for message_id, _ in hits])).all())
+    by_id = {row.message_id: row for row in rows}
+
+    selected = []
+    used = 0
+    for message_id, _ in hits:
+        row = by_id.get(message_id)
+        if row is None or (before is not None and row.timestamp >= before):
+            continue
+        cost = count_tokens(f"{row.username}: {row.content}")
+        if used + cost > token_budget:
+            continue
+        used += cost
+        selected.append({"message_id": row.message_id, "username": row.username,
+                         "content": row.content, "timestamp": row.timestamp})
+        if len(selected) == k:
+            break
+    selected.sort(key=lambda m: m["timestamp"])
+    return selected
+
+
+def format_retrieved(messages):
+    """System prompt section listing retrieved older messages."""
+    lines = [f"- [{m['timestamp']:%Y-%m-%d %H:%M}] {m['username']}: {m['content']}" for m in messages]
+    return "Earlier messages in this room that may be relevant:\n" + "\n".join(lines)
@@ -0,0 +1,209 @@
+import functools
+import os
+import secrets
+import threading
+import time
+from bisect import bisect_left
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+'''
+prometheus metrics
+
+    - chat_socket_event_seconds      latency histogram per Socket.IO event
+    - chat_socket_event_errors_total handler exceptions per event
+    - chat_http_request_seconds      latency histogram per REST route
+    - chat_http_requests_total       requests per route / method / status
+    - chat_db_query_seconds          latency of every SQL statement
+    - chat_agent_seconds             run_agent / run_agent_stream latency
+    - gauges registered with register_gauge(), read at scrape time
+
+served in the prometheus text format on GET /metrics, only to scrapers
+sending `Authorization: Bearer <METRICS_TOKEN>`. with METRICS_TOKEN unset
+the endpoint always answers 401.
+
+recording is a bisect into a short bucket list plus a few increments, so it
+is cheap enough to leave on in production.
+'''
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+
+
+class Histogram:
+
+    def __init__(self, name, help, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with _lock:
+            series_items = [(labels, list(series)) for labels, series in self._series.items()]
+        for labels, series in series_items:
+            label_str = _labels(self.label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_str},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_str},le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{label_str}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label_str}}} {series[-1]}")
+        return lines
+
+
+class Counter:
+
+    def __init__(self, name, help, label_names):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with _lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{{{_labels(self.label_names, labels)}}} {value}")
+        return lines
+
+
+class Gauge:
+    """A gauge that is either set / inc / dec'd directly or read from a callback at scrape time."""
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self._fn = fn
+        self._value = 0
+
+    def inc(self, amount=1):
+        with _lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with _lock:
+            self._value -= amount
+
+    def set(self, value):
+        self._value = value
+
+    def render(self):
+        try:
+            value = self._fn() if self._fn else self._value
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+def _labels(names, values):
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+socket_event_seconds = Histogram("chat_socket_event_seconds", "Socket.IO handler latency", ("event",))
+socket_event_errors = Counter("chat_socket_event_errors_total", "Socket.IO handler exceptions", ("event",))
+http_request_seconds = Histogram("chat_http_request_seconds", "REST route latency", ("route", "method"))
+http_requests = Counter("chat_http_requests_total", "REST requests", ("route", "method", "status"))
+db_query_seconds = Histogram("chat_db_query_seconds", "SQL statement latency", ("kind",))
+agent_seconds = Histogram("chat_agent_seconds", "Agent run latency", ("mode",))
+pending_agent_jobs = Gauge("chat_pending_agent_jobs", "Agent runs in progress")
+
+_gauges = [pending_agent_jobs]
+
+
+def register_gauge(name, help, fn):
+    """Expose fn() as a gauge, evaluated on every scrape."""
+    _gauges.append(Gauge(name, help, fn))
+
+
+def track_event(event_name):
+    """Decorator for Socket.IO handlers: records latency and exceptions."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return handler(*args, **kwargs)
+            except Exception:
+                socket_event_errors.inc(event_name)
+                raise
+            finally:
+                socket_event_seconds.observe(time.perf_counter() - started, event_name)
+        return wrapper
+    return decorator
+
+
+def render_metrics():
+    lines = []
+    for metric in (socket_event_seconds, socket_event_errors, http_request_seconds,
+                   http_requests, db_query_seconds, agent_seconds, *_gauges):
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_metrics_started", None)
+    if started is not None:
+        kind = statement.lstrip().split(" ", 1)[0].upper()
+        db_query_seconds.observe(time.perf_counter() - started, kind)
+
+
+def init_app(app):
+    """Time every REST route and SQL statement, and serve GET /metrics."""
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop("metrics_started", None)
+        if started is not None and request.endpoint != "metrics":
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            http_request_seconds.observe(time.perf_counter() - started, route, request.method)
+            http_requests.inc(route, request.method, response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics():
+        # same check as app.has_bearer_token; app imports this module, not the other way round
+        expected = os.getenv("METRICS_TOKEN")
+        auth_header = request.headers.get('Authorization', '')
+        if not expected or not secrets.compare_digest(auth_header, f"Bearer {expected}"):
+            return Response("Unauthorized\n", status=401, mimetype="text/plain")
+        return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+    if not event.contains(Engine, "before_cursor_execute", _before_cursor_execute):
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
@@ -0,0 +1,49 @@
+"""add message full text search
+
+Revision ID: c4e8a1b2d3f5
+Revises: b7d2e9f01c3a
+Create Date: 2026-10-17 17:22:35.118406
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4e8a1b2d3f5'
+down_revision = 'b7d2e9f01c3a'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.create_index(
+            'ix_messages_content_fts', 'messages',
+            [sa.text("to_tsvector('english', content)")],
+            unique=False, postgresql_using='gin'
+        )
+    elif bind.dialect.name == 'sqlite':
+        # external-content FTS5 table over messages.content, kept in sync by triggers
+        op.execute("CREATE VIRTUAL TABLE messages_fts USING fts5("
+                   "content, room_id, content='messages', content_rowid='message_id')")
+        op.execute("CREATE TRIGGER messages_fts_ai AFTER INSERT ON messages BEGIN "
+                   "INSERT INTO messages_fts(rowid, content, room_id) VALUES (new.message_id, new.content, new.room_id); END")
+        op.execute("CREATE TRIGGER messages_fts_ad AFTER DELETE ON messages BEGIN "
+                   "INSERT INTO messages_fts(messages_fts, rowid, content, room_id) VALUES ('delete', old.message_id, old.content, old.room_id); END")
+        op.execute("CREATE TRIGGER messages_fts_au AFTER UPDATE OF content, room_id ON messages BEGIN "
+                   "INSERT INTO messages_fts(messages_fts, rowid, content, room_id) VALUES ('delete', old.message_id, old.content, old.room_id); "
+                   "INSERT INTO messages_fts(rowid, content, room_id) VALUES (new.message_id, new.content, new.room_id); END")
+        op.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.drop_index('ix_messages_content_fts', table_name='messages')
+    elif bind.dialect.name == 'sqlite':
+        op.execute("DROP TRIGGER IF EXISTS messages_fts_au")
+        op.execute("DROP TRIGGER IF EXISTS messages_fts_ad")
+        op.execute("DROP TRIGGER IF EXISTS messages_fts_ai")
+        op.execute("DROP TABLE IF EXISTS messages_fts")
@@ -49,11 +49,12 @@ class User(db.Model):
     oauth_provider = db.Column(db.String(50), nullable=False)
     oauth_id = db.Column(db.String(100), unique=True, nullable=False)
 
-    # messages sent by this user
+    # messages sent by this user. write_only so loading a user never pulls
+    # their whole history; history.py reads messages with explicit queries
     messages = db.relationship(
         "Message",
         backref="user",
-        lazy="selectin"
+        lazy="write_only"
     )
 
     # association objects
@@ -63,12 +64,12 @@ class User(db.Model):
         cascade="all, delete-orphan"
     )
 
-    # convenience: user.rooms → list[Room]
+    # convenience: user.rooms → list[Room] (loaded on access only)
     rooms = db.relationship(
         "Room",
         secondary="user_rooms",
         viewonly=True,
-        lazy="selectin"
+        lazy="select"
     )
 
 
@@ -80,11 +81,12 @@ class Room(db.Model):
     name = db.Column(db.String(80), nullable=True)
     room_code = db.Column(db.String(20), unique=True, nullable=False)
 
-    # messages in this room
+    # messages in this room. write_only so Room lookups on the socket hot
+    # path stay a single row; history.py reads messages with explicit queries
     messages = db.relationship(
         "Message",
         backref="room",
-        lazy="selectin"
+        lazy="write_only"
     )
 
     # association objects
@@ -94,16 +96,26 @@ class Room(db.Model):
         cascade="all, delete-orphan"
     )
 
-    # convenience: room.users -> list[User]
+    # convenience: room.users -> list[User] (loaded on access only)
     users = db.relationship(
         "User",
         secondary="user_rooms",
         viewonly=True,
-        lazy="selectin"
+        lazy="select"
     )
 
 class Message(db.Model):
     __tablename__ = "messages"
+    __table_args__ = (
+        # history pages are range scans over (room, time) with message_id as tiebreaker
+        db.Index("ix_messages_room_id_timestamp_message_id", "room_id", "timestamp", "message_id"),
+        # full-text search (search.py). postgres only; sqlite uses the messages_fts FTS5 table
+        db.Index(
+            "ix_messages_content_fts",
+            db.text("to_tsvector('english', content)"),
+            postgresql_using="gin",
+        ).ddl_if(dialect="postgresql"),
+    )
 
     message_id = db.Column(db.Integer, primary_key=True)
 
@@ -130,3 +142,81 @@ class Message(db.Model):
     )
 
 
+class RoomMemory(db.Model):
+    """Long-term facts the agent should remember about a room, one row per (room, key)."""
+    __tablename__ = "room_memories"
+    __table_args__ = (
+        # memories are deduplicated by key: a newer value for the same key replaces the old one
+        db.UniqueConstraint("room_id", "key", name="uq_room_memories_room_id_key"),
+    )
+
+    memory_id = db.Column(db.Integer, primary_key=True)
+
+    room_id = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.room_id"),
+        nullable=False
+    )
+    type = db.Column(db.String(20), nullable=False)
+    key = db.Column(db.String(120), nullable=False)
+    value = db.Column(db.Text, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+
+class MessageEmbedding(db.Model):
+    """Embedding vector of a message, for retrieving older context for the agent."""
+    __tablename__ = "message_embeddings"
+    __table_args__ = (
+        # a room's vectors are loaded all at once when its index is built
+        db.Index("ix_message_embeddings_room_id_model", "room_id", "model"),
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("messages.message_id"),
+        primary_key=True
+    )
+    room_id = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.room_id"),
+        nullable=False
+    )
+    # embedder name; vectors from different embedders are not comparable
+    model = db.Column(db.String(64), nullable=False)
+    # float32 array as raw bytes
+    vector = db.Column(db.LargeBinary, nullable=False)
+
+
+class ArchiveSegment(db.Model):
+    """Manifest entry for a compressed segment of a room's archived (cold) messages, see archive.py."""
+    __tablename__ = "archive_segments"
+    __table_args__ = (
+        # history read-through walks a room's segments in order
+        db.Index("ix_archive_segments_room_id_segment_id", "room_id", "segment_id"),
+    )
+
+    segment_id = db.Column(db.Integer, primary_key=True)
+
+    room_id = db.Column(
+        db.Integer,
+        db.ForeignKey("rooms.room_id"),
+        nullable=False
+    )
+    # key in the segment store (local directory or S3)
+    object_key = db.Column(db.String(512), unique=True, nullable=False)
+    message_count = db.Column(db.Integer, nullable=False)
+    compressed_bytes = db.Column(db.Integer, nullable=False)
+
+    # (timestamp, message_id) range of the messages in the segment
+    first_timestamp = db.Column(db.DateTime, nullable=False)
+    last_timestamp = db.Column(db.DateTime, nullable=False)
+    first_message_id = db.Column(db.Integer, nullable=False)
+    last_message_id = db.Column(db.Integer, nullable=False)
+    # message_ids aren't ordered like timestamps, so keep their bounds for cursor lookups
+    min_message_id = db.Column(db.Integer, nullable=False)
+    max_message_id = db.Column(db.Integer, nullable=False)
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
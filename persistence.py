@@ -0,0 +1,351 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert, tuple_
+from sqlalchemy.exc import InterfaceError, OperationalError, TimeoutError as PoolTimeoutError
+
+from lookup_cache import TTLCache
+from models import db, Message, UserRoom
+
+logger = logging.getLogger(__name__)
+
+'''
+write-behind persistence
+
+send_message used to do db.session.add + commit for every chat line on the
+event handler, so every broadcast waited on a full db round trip.
+
+Now rows go into a bounded in-process queue and a background writer flushes
+them as one multi-row INSERT when either
+    - the queue reaches batch_size rows, or
+    - flush_interval seconds have passed
+
+overflow policy (what happens when the queue is full):
+    - "flush"       write the queue inline on the caller (backpressure, no loss)
+    - "drop_oldest" throw away the oldest queued row
+    - "drop_newest" throw away the row being enqueued
+
+failed flushes:
+    - transient errors (database down, connection dropped, pool timeout)
+      put the batch back at the front of the queue and the writer backs
+      off exponentially (retry_delay doubling up to max_retry_delay). rows
+      wait in the bounded queue meanwhile, so the overflow policy, not a
+      retry counter, decides what is lost in a long outage. "flush" can't
+      write through an outage, so a full queue drops its oldest row then
+    - any other error is blamed on the rows: the batch is split in halves
+      until the bad rows are alone, and only those are dropped (counted
+      in stats()["failed"]). writers whose flush isn't a plain insert
+      pass split_failed_batches=False to drop the failing batch instead
+    - a flush that only partly succeeded raises RetryLater(rows, cause):
+      just those rows go back in the queue, with the same backoff
+
+stop() runs at interpreter exit and writes whatever is still queued.
+
+the same writer batches user_rooms membership rows from join_room. those
+are written as INSERT ... ON CONFLICT DO NOTHING, so concurrent or repeated
+joins are idempotent instead of racing a SELECT-then-INSERT into a primary
+key violation, and a join storm after a deploy becomes a few multi-row
+statements instead of one commit per join.
+'''
+
+OVERFLOW_POLICIES = ("flush", "drop_oldest", "drop_newest")
+# errors that say nothing about the rows, just that the database isn't reachable right now.
+# writers that call other services pass their own transient errors in (see room_memory.py)
+TRANSIENT_DB_ERRORS = (OperationalError, InterfaceError, PoolTimeoutError)
+
+
+class RetryLater(Exception):
+    """Raised by a flush function when only `rows` of its batch must be retried, after a transient `cause`."""
+
+    def __init__(self, rows, cause):
+        super().__init__(str(cause))
+        self.rows = rows
+        self.cause = cause
+
+
+class BatchWriter:
+
+    def __init__(self, name, flush_rows, max_queue=None, batch_size=None,
+                 flush_interval=None, overflow=None, transient_errors=TRANSIENT_DB_ERRORS,
+                 split_failed_batches=True, retry_delay=None, max_retry_delay=None):
+        self.name = name
+        self._flush_rows = flush_rows
+        self.max_queue = max_queue or int(os.getenv("WRITE_BEHIND_MAX_QUEUE", 10000))
+        self.batch_size = batch_size or int(os.getenv("WRITE_BEHIND_BATCH_SIZE", 500))
+        self.flush_interval = flush_interval or float(os.getenv("WRITE_BEHIND_FLUSH_INTERVAL", 0.05))
+        self.overflow = overflow or os.getenv("WRITE_BEHIND_OVERFLOW", "flush")
+        if self.overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {self.overflow}")
+        self.transient_errors = transient_errors
+        self.split_failed_batches = split_failed_batches
+        self.retry_delay = retry_delay or float(os.getenv("WRITE_BEHIND_RETRY_DELAY", 0.1))
+        self.max_retry_delay = max_retry_delay or float(os.getenv("WRITE_BEHIND_MAX_RETRY_DELAY", 30))
+
+        self._app = None
+        self._queue = deque()
+        # locks, the wake event and the thread are created in init_app so
+        # they pick up eventlet's monkey patching (app.py patches after imports)
+        self._lock = None
+        self._flush_lock = None
+        self._wake = None
+        self._thread = None
+        self._running = False
+        self._failed_attempts = 0
+        self._retry_at = 0.0
+
+        self._stats = {
+            "enqueued": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "retries": 0,
+            "flushes": 0,
+            "max_queue_depth": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def init_app(self, app):
+        self._app = app
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        atexit.register(self.stop)
+
+    def _ensure_started(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"{self.name}-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, row):
+        """Queue one row for writing. Returns False if the row was dropped."""
+        self._ensure_started()
+        overflowed = False
+        with self._lock:
+            if len(self._queue) >= self.max_queue:
+                if self.overflow == "drop_newest":
+                    self._stats["dropped"] += 1
+                    return False
+                if self.overflow == "drop_oldest":
+                    self._queue.popleft()
+                    self._stats["dropped"] += 1
+                else:
+                    overflowed = True
+        if overflowed:
+            # backpressure: write inline (a no-op while backing off)
+            self.flush()
+        with self._lock:
+            if overflowed and len(self._queue) >= self.max_queue:
+                # the database is down, a full queue can't be flushed
+                self._queue.popleft()
+                self._stats["dropped"] += 1
+            self._queue.append(row)
+            self._stats["enqueued"] += 1
+            depth = len(self._queue)
+            if depth > self._stats["max_queue_depth"]:
+                self._stats["max_queue_depth"] = depth
+
+        if not overflowed and depth >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def flush(self, force=False):
+        """
+        Write everything currently queued, batch_size rows per INSERT.
+        Does nothing while backing off after a transient error, unless force is set.
+        """
+        with self._flush_lock:
+            if not force and time.monotonic() < self._retry_at:
+                return
+            while True:
+                with self._lock:
+                    if not self._queue:
+                        return
+                    batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+
+                started = time.perf_counter()
+                unwritten = self._write_batch(batch)
+                if unwritten:
+                    # put the rest back in front so ordering is preserved
+                    with self._lock:
+                        self._queue.extendleft(reversed(unwritten))
+                    return
+
+                elapsed_ms = (time.perf_counter() - started) * 1000
+                self._failed_attempts = 0
+                self._retry_at = 0.0
+                self._stats["flushes"] += 1
+                self._stats["last_flush_ms"] = elapsed_ms
+                self._stats["total_flush_ms"] += elapsed_ms
+                if elapsed_ms > self._stats["max_flush_ms"]:
+                    self._stats["max_flush_ms"] = elapsed_ms
+
+    def _write_batch(self, batch):
+        """Write a batch, splitting it around bad rows. Returns the rows left unwritten by a transient error."""
+        chunks = deque([batch])
+        while chunks:
+            chunk = chunks.popleft()
+            try:
+                with self._app.app_context():
+                    self._flush_rows(chunk)
+            except Exception as e:
+                with self._app.app_context():
+                    db.session.rollback()
+                if isinstance(e, RetryLater):
+                    self._stats["written"] += len(chunk) - len(e.rows)
+                    self._back_off(e.cause)
+                    return e.rows + [row for rest in chunks for row in rest]
+                if isinstance(e, self.transient_errors):
+                    self._back_off(e)
+                    return chunk + [row for rest in chunks for row in rest]
+                if len(chunk) == 1 or not self.split_failed_batches:
+                    logger.error(f"{self.name} writer dropping {len(chunk)} rows: {e}")
+                    self._stats["failed"] += len(chunk)
+                    continue
+                middle = len(chunk) // 2
+                chunks.extendleft([chunk[middle:], chunk[:middle]])
+                continue
+            self._stats["written"] += len(chunk)
+        return []
+
+    def _back_off(self, error):
+        self._failed_attempts += 1
+        self._stats["retries"] += 1
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (self._failed_attempts - 1))
+        self._retry_at = time.monotonic() + delay
+        logger.warning(f"{self.name} writer flush failed (attempt {self._failed_attempts}), retrying in {delay:.2f}s: {error}")
+
+    def _run(self):
+        while self._running:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"{self.name} writer loop error: {e}")
+
+    def stop(self):
+        """Stop the background writer and flush anything still queued."""
+        self._running = False
+        if self._wake is not None:
+            self._wake.set()
+        if self._app is not None:
+            self.flush(force=True)
+
+    def stats(self):
+        """Snapshot of writer counters, including current queue depth."""
+        snapshot = dict(self._stats)
+        snapshot["queue_depth"] = len(self._queue)
+        snapshot["avg_flush_ms"] = (
+            snapshot["total_flush_ms"] / snapshot["flushes"] if snapshot["flushes"] else 0.0
+        )
+        return snapshot
+
+
+# called with the written rows (message_id filled in) after every message flush
+_written_hooks = []
+
+
+def on_messages_written(hook):
+    """Register hook(rows) to run after each flush of the message writer. Rows carry their message_id."""
+    _written_hooks.append(hook)
+    return hook
+
+
+def _insert_returning_ids(rows):
+    if db.session.get_bind().dialect.insert_executemany_returning_sort_by_parameter_order:
+        result = db.session.execute(
+            insert(Message).returning(Message.message_id, sort_by_parameter_order=True), rows
+        )
+        return result.scalars().all()
+    # no ordered RETURNING for executemany (e.g. MySQL): one INSERT per row, ids from the cursor
+    return [db.session.execute(insert(Message.__table__), row).inserted_primary_key[0] for row in rows]
+
+
+def _insert_messages(rows):
+    if not _written_hooks:
+        # a list of dicts makes this an executemany, which SQLAlchemy sends as
+        # multi-row INSERT ... VALUES statements
+        db.session.execute(insert(Message), rows)
+        db.session.commit()
+        return
+    message_ids = _insert_returning_ids(rows)
+    db.session.commit()
+    written = [dict(row, message_id=message_id) for row, message_id in zip(rows, message_ids)]
+    for hook in _written_hooks:
+        # the messages are committed: a failing hook must not make the writer retry them
+        try:
+            hook(written)
+        except Exception as e:
+            logger.error(f"messages written hook {hook.__name__} failed: {e}")
+
+
+message_writer = BatchWriter("messages", _insert_messages)
+
+
+def enqueue_message(user_id, room_id, content, image_url=None, timestamp=None):
+    """Queue a chat message for persistence. The timestamp defaults to now, not flush time."""
+    return message_writer.enqueue({
+        "user_id": user_id,
+        "room_id": room_id,
+        "content": content,
+        "image_url": image_url,
+        "timestamp": timestamp or datetime.utcnow(),
+    })
+
+
+# (user_id, room_id) pairs already known to be in user_rooms, so repeat joins skip the queue
+_known_memberships = TTLCache(
+    maxsize=int(os.getenv("MEMBERSHIP_CACHE_SIZE", 50000)),
+    ttl=float(os.getenv("MEMBERSHIP_CACHE_TTL", 3600)),
+)
+
+
+def upsert_insert(model):
+    """insert() for the current db that supports on_conflict_do_*, or None if the dialect has no upsert."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(model)
+
+
+def _upsert_memberships(rows):
+    # the same user can join the same room several times within one batch
+    rows = list({(row["user_id"], row["room_id"]): row for row in rows}.values())
+    stmt = upsert_insert(UserRoom)
+    if stmt is not None:
+        db.session.execute(stmt.on_conflict_do_nothing(index_elements=["user_id", "room_id"]), rows)
+    else:
+        # no portable upsert: skip the pairs that already exist. the writer is the only
+        # thing inserting memberships in this process, so this only races other workers
+        existing = set(db.session.query(UserRoom.user_id, UserRoom.room_id).filter(
+            tuple_(UserRoom.user_id, UserRoom.room_id).in_([(r["user_id"], r["room_id"]) for r in rows])
+        ).all())
+        rows = [r for r in rows if (r["user_id"], r["room_id"]) not in existing]
+        if rows:
+            db.session.execute(insert(UserRoom), rows)
+    db.session.commit()
+    for row in rows:
+        _known_memberships.set((row["user_id"], row["room_id"]), True)
+
+
+membership_writer = BatchWriter("memberships", _upsert_memberships)
+
+
+def enqueue_membership(user_id, room_id):
+    """Queue an idempotent user_rooms insert. Returns False if the pair is already known to exist."""
+    if _known_memberships.get((user_id, room_id)):
+        return False
+    return membership_writer.enqueue({"user_id": user_id, "room_id": room_id})
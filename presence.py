@@ -0,0 +1,157 @@
+import os
+import threading
+
+'''
+room / socket / user presence index
+
+before this, "which rooms is this socket in" meant asking python-socketio
+(rooms(sid)) on every event, disconnect had no idea which rooms to send
+user_left to, and "who is online in room X" needed socketio internals or
+the db. the index keeps every direction up to date with O(1) set / dict
+updates on connect / join / leave / disconnect:
+
+    socket -> user      _socket_user
+    user   -> sockets   _user_sockets
+    socket -> rooms     _socket_rooms
+    room   -> sockets   _room_sockets
+    room   -> users     _room_users  {user_id: number of that user's sockets in the room}
+
+_room_users is what dedupes multi-tab users: a user "joins" a room when
+their first socket joins it and "leaves" when their last one does, so
+user_joined / user_left are only broadcast on those edges.
+
+memory stays bounded: empty sets / dicts are dropped as soon as they
+empty, and a socket can be in at most PRESENCE_MAX_ROOMS_PER_SOCKET rooms.
+
+state is per process, like python-socketio's own room table. with several
+workers / instances each one knows about the sockets it accepted, so:
+
+- in_room(socket_id, ...) is always right: sticky sessions keep a socket's
+  events on the process that accepted it
+- users_in_room / user_in_room / is_online and the chat_active_rooms /
+  chat_online_users gauges only cover this process. get_presence answers
+  for the caller's instance; membership checks outside a socket
+  (is_room_member in app.py) fall back to user_rooms in the db
+'''
+
+MAX_ROOMS_PER_SOCKET = int(os.getenv("PRESENCE_MAX_ROOMS_PER_SOCKET", 50))
+
+
+class PresenceIndex:
+
+    def __init__(self, max_rooms_per_socket=MAX_ROOMS_PER_SOCKET):
+        self.max_rooms_per_socket = max_rooms_per_socket
+        self._socket_user = {}
+        self._user_sockets = {}
+        self._socket_rooms = {}
+        self._room_sockets = {}
+        self._room_users = {}
+        self._lock = threading.Lock()
+
+    def connect(self, socket_id, user_id):
+        with self._lock:
+            self._socket_user[socket_id] = user_id
+            self._user_sockets.setdefault(user_id, set()).add(socket_id)
+
+    def join(self, socket_id, room_id):
+        """
+        Record socket_id joining room_id.
+        Returns True if this made the user present in the room (their first socket there),
+        False if they already were. Raises ValueError if the socket is unknown or in too many rooms.
+        """
+        with self._lock:
+            user_id = self._socket_user.get(socket_id)
+            if user_id is None:
+                raise ValueError("unknown socket")
+            socket_rooms = self._socket_rooms.setdefault(socket_id, set())
+            if room_id in socket_rooms:
+                return False
+            if len(socket_rooms) >= self.max_rooms_per_socket:
+                raise ValueError("too many rooms")
+            socket_rooms.add(room_id)
+            self._room_sockets.setdefault(room_id, set()).add(socket_id)
+            users = self._room_users.setdefault(room_id, {})
+            users[user_id] = users.get(user_id, 0) + 1
+            return users[user_id] == 1
+
+    def _leave(self, socket_id, user_id, room_id):
+        # caller holds the lock and has checked socket_id is in room_id.
+        # returns (user_gone, room_empty)
+        sockets = self._room_sockets[room_id]
+        sockets.discard(socket_id)
+        users = self._room_users[room_id]
+        users[user_id] -= 1
+        user_gone = users[user_id] == 0
+        if user_gone:
+            del users[user_id]
+        room_empty = not sockets
+        if room_empty:
+            del self._room_sockets[room_id]
+            del self._room_users[room_id]
+        return user_gone, room_empty
+
+    def leave(self, socket_id, room_id):
+        """
+        Record socket_id leaving room_id.
+        Returns (user_gone, room_empty): whether that was the user's last socket in the
+        room and whether the room now has no sockets at all. (False, False) if it wasn't in the room.
+        """
+        with self._lock:
+            socket_rooms = self._socket_rooms.get(socket_id)
+            if not socket_rooms or room_id not in socket_rooms:
+                return False, False
+            socket_rooms.discard(room_id)
+            if not socket_rooms:
+                del self._socket_rooms[socket_id]
+            return self._leave(socket_id, self._socket_user[socket_id], room_id)
+
+    def disconnect(self, socket_id):
+        """
+        Forget a socket and all of its rooms.
+        Returns (user_id, rooms_left, rooms_emptied): the rooms the user is no longer present
+        in, and the rooms that have no sockets left.
+        """
+        with self._lock:
+            user_id = self._socket_user.pop(socket_id, None)
+            if user_id is None:
+                return None, [], []
+            user_sockets = self._user_sockets[user_id]
+            user_sockets.discard(socket_id)
+            if not user_sockets:
+                del self._user_sockets[user_id]
+            rooms_left, rooms_emptied = [], []
+            for room_id in self._socket_rooms.pop(socket_id, ()):
+                user_gone, room_empty = self._leave(socket_id, user_id, room_id)
+                if user_gone:
+                    rooms_left.append(room_id)
+                if room_empty:
+                    rooms_emptied.append(room_id)
+            return user_id, rooms_left, rooms_emptied
+
+    def in_room(self, socket_id, room_id):
+        return room_id in self._socket_rooms.get(socket_id, ())
+
+    def user_in_room(self, user_id, room_id):
+        return user_id in self._room_users.get(room_id, ())
+
+    def users_in_room(self, room_id):
+        """user_ids present in the room, each once no matter how many tabs they have open."""
+        with self._lock:
+            return list(self._room_users.get(room_id, ()))
+
+    def is_online(self, user_id):
+        return user_id in self._user_sockets
+
+    def room_count(self):
+        """Rooms with at least one socket in this process."""
+        return len(self._room_sockets)
+
+    def stats(self):
+        return {
+            "sockets": len(self._socket_user),
+            "users": len(self._user_sockets),
+            "rooms": len(self._room_sockets),
+        }
+
+
+presence = PresenceIndex()
@@ -0,0 +1,163 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime
+
+from models import db, Message, User
+from session_store import get_message_queue_url
+
+'''
+rolling per-room context for the agent
+
+get_room_conversation_history used to query the db, look up every author
+separately and drop [Agent] rows on every @agent mention. now each room
+keeps a bounded deque of its latest messages in memory:
+
+    - send_message appends each message as it is sent
+    - a room we have no context for is hydrated from the db on first read
+    - at most ROOM_CONTEXT_MESSAGES entries per room and ROOM_CONTEXT_ROOMS
+      rooms; the least recently used room is dropped first
+    - recent(before=...) only returns messages sent before a given time,
+      so an @agent question isn't in its own history
+
+the buffer is per process: a worker only appends the messages sent
+through it. so a room is re-hydrated when it was last hydrated more than
+ROOM_CONTEXT_TTL seconds ago; the default is 10 with
+SOCKETIO_MESSAGE_QUEUE set (several workers) and never without.
+
+messages are persisted write-behind, so a hydration keeps the buffered
+messages the db doesn't have yet and merges them in by timestamp. that
+way a message is never both loaded from the db and appended.
+'''
+
+
+class _RoomContext:
+    __slots__ = ("entries", "hydrated_at")
+
+    def __init__(self, maxlen):
+        self.entries = deque(maxlen=maxlen)
+        self.hydrated_at = None  # time.monotonic() of the last hydration
+
+
+class RoomContextBuffer:
+
+    def __init__(self, max_rooms, per_room, ttl=0):
+        self.max_rooms = max_rooms
+        self.per_room = per_room
+        self.ttl = ttl  # seconds before a room is re-hydrated, 0 for never
+        self._rooms = OrderedDict()  # room_id -> _RoomContext
+        self._lock = threading.Lock()
+        self.hydrations = 0
+        self.evictions = 0
+
+    def _get_or_create(self, room_id):
+        # caller holds the lock
+        ctx = self._rooms.get(room_id)
+        if ctx is None:
+            ctx = _RoomContext(self.per_room)
+            self._rooms[room_id] = ctx
+            while len(self._rooms) > self.max_rooms:
+                self._rooms.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._rooms.move_to_end(room_id)
+        return ctx
+
+    def append(self, room_id, user_id, username, content, object_key=None, timestamp=None):
+        entry = {
+            "user_id": user_id,
+            "username": username,
+            "content": content,
+            "object_key": object_key,
+            "timestamp": timestamp or datetime.utcnow(),
+        }
+        with self._lock:
+            self._get_or_create(room_id).entries.append(entry)
+
+    def _fresh(self, ctx, now):
+        return ctx is not None and ctx.hydrated_at is not None and \
+            (not self.ttl or now - ctx.hydrated_at < self.ttl)
+
+    def recent(self, room_id, limit, before=None):
+        """
+        Latest `limit` messages of a room sent before `before` (all of them
+        without it), oldest first. Hits the db only on a cold or stale room.
+        """
+        with self._lock:
+            ctx = self._rooms.get(room_id)
+            if self._fresh(ctx, time.monotonic()):
+                self._rooms.move_to_end(room_id)
+                return _latest(ctx.entries, limit, before)
+
+        loaded = _load_recent(room_id, self.per_room)
+
+        with self._lock:
+            ctx = self._get_or_create(room_id)
+            now = time.monotonic()
+            if not self._fresh(ctx, now):
+                _merge(ctx.entries, loaded)
+                ctx.hydrated_at = now
+                self.hydrations += 1
+            return _latest(ctx.entries, limit, before)
+
+    def invalidate(self, room_id):
+        with self._lock:
+            self._rooms.pop(room_id, None)
+
+    def stats(self):
+        return {
+            "rooms": len(self._rooms),
+            "max_rooms": self.max_rooms,
+            "per_room": self.per_room,
+            "ttl": self.ttl,
+            "hydrations": self.hydrations,
+            "evictions": self.evictions,
+        }
+
+
+def _latest(entries, limit, before):
+    if before is not None:
+        entries = [entry for entry in entries if entry["timestamp"] < before]
+    return list(entries)[-limit:]
+
+
+def _merge(entries, loaded):
+    """Replace entries with loaded plus the buffered messages the db doesn't have yet, by timestamp."""
+    stored = {(entry["user_id"], entry["timestamp"]) for entry in loaded}
+    pending = [entry for entry in entries if (entry["user_id"], entry["timestamp"]) not in stored]
+    entries.clear()
+    # the deque keeps the newest maxlen
+    entries.extend(sorted(loaded + pending, key=lambda entry: entry["timestamp"]))
+
+
+def _load_recent(room_id, limit):
+    rows = db.session.query(
+        Message.user_id,
+        User.username,
+        Message.content,
+        Message.image_url,
+        Message.timestamp,
+    ).join(User, User.user_id == Message.user_id)\
+        .filter(
+            Message.room_id == room_id,
+            ~Message.content.startswith("[Agent]"),
+        )\
+        .order_by(Message.timestamp.desc(), Message.message_id.desc())\
+        .limit(limit)\
+        .all()
+    rows.reverse()
+    return [{
+        "user_id": row.user_id,
+        "username": row.username,
+        "content": row.content,
+        "object_key": row.image_url,
+        "timestamp": row.timestamp,
+    } for row in rows]
+
+
+room_context = RoomContextBuffer(
+    max_rooms=int(os.getenv("ROOM_CONTEXT_ROOMS", 1000)),
+    per_room=int(os.getenv("ROOM_CONTEXT_MESSAGES", 50)),
+    ttl=float(os.getenv("ROOM_CONTEXT_TTL", 10 if get_message_queue_url() else 0)),
+)
@@ -0,0 +1,281 @@
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+
+import openai
+from dotenv import load_dotenv
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_openai import ChatOpenAI
+
+from lookup_cache import TTLCache
+from models import db, RoomMemory
+from persistence import BatchWriter, RetryLater, TRANSIENT_DB_ERRORS, upsert_insert
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+'''
+room memory
+
+agent.memory_decider used to be one llm call per message, kept its results
+in an unbounded process-local dict and was never called from anywhere.
+
+    1. send_message queues (room_id, username, content) on memory_writer,
+       a BatchWriter like the message writer but with a long flush interval
+    2. each flush groups the queued messages by room and makes ONE
+       extraction call per room with all of them, passing the keys the room
+       already has so the model reuses them for updates
+    3. results are upserted into room_memories, unique on (room_id, key):
+       a newer value for a known key replaces the old one
+    4. get_room_memories serves a room's memory set from a TTL cache that
+       is dropped whenever this process writes to the room
+    5. build_agent_messages puts the memories in front of the conversation
+
+extraction is best effort: when the queue is full the oldest messages are
+dropped. rooms are extracted one by one, so a failing room doesn't take
+the rest of the batch with it: openai connection / rate limit / 5xx and
+database outages retry that room and the ones after it with backoff
+(rooms already done aren't extracted again), any other failure drops
+that room's messages only.
+on by default when OPENAI_API_KEY is set (ROOM_MEMORY=true/false overrides).
+set_memory_llm() swaps the model, e.g. for a fake one in benchmarks.
+'''
+
+MEMORY_ENABLED = os.getenv("ROOM_MEMORY", "true" if os.getenv("OPENAI_API_KEY") else "false").lower() == "true"
+MEMORY_TYPES = ("decision", "preference", "goal", "fact", "constraint")
+# memories put in the agent prompt, most recently updated first
+MEMORY_PROMPT_LIMIT = int(os.getenv("ROOM_MEMORY_PROMPT_LIMIT", 50))
+MAX_KEY_LENGTH = 120
+
+MEMORY_PROMPT = ChatPromptTemplate.from_template("""
+You are a memory extraction system for a group chat room.
+
+Extract ONLY stable, long-term information worth remembering from the messages below.
+Do NOT infer or guess.
+
+Rules:
+- Memory must be explicitly stated
+- Memory must remain valid beyond this conversation
+- Ignore jokes, opinions, hypotheticals, and short-term plans
+- If a message updates something the room already remembers, reuse that key
+- Output JSON only, no markdown formatting
+
+Allowed memory types:
+- decision
+- preference
+- goal
+- fact
+- constraint
+
+Keys the room already remembers:
+{known_keys}
+
+Return a JSON array, or [] if nothing qualifies:
+[
+{{
+"type": "...",
+"key": "...",
+"value": "..."
+}}
+]
+
+Messages:
+{messages}
+""")
+
+_mem_llm = None
+
+
+def get_mem_llm():
+    """Get or create the memory extraction LLM instance."""
+    global _mem_llm
+    if _mem_llm is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise ValueError("OPENAI_API_KEY environment variable is not set")
+        _mem_llm = ChatOpenAI(model="gpt-4o-mini", temperature=0.0, api_key=api_key)
+    return _mem_llm
+
+
+def set_memory_llm(llm):
+    global _mem_llm
+    _mem_llm = llm
+
+
+def normalize_key(key):
+    return " ".join(str(key).lower().split())[:MAX_KEY_LENGTH]
+
+
+def parse_memories(content):
+    """Validated memories from an extraction reply. Anything malformed is skipped."""
+    content = content.strip()
+    # Remove markdown code blocks if present
+    if content.startswith("```"):
+        content = content.split("```")[1]
+        if content.startswith("json"):
+            content = content[4:]
+        content = content.strip()
+    if not content or content.lower() == "null":
+        return []
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        return []
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return []
+
+    memories = []
+    for memory in parsed:
+        if not isinstance(memory, dict) or memory.get("type") not in MEMORY_TYPES:
+            continue
+        key = normalize_key(memory.get("key") or "")
+        value = memory.get("value")
+        if not key or not isinstance(value, str) or not value.strip():
+            continue
+        memories.append({"type": memory["type"], "key": key, "value": value.strip()})
+    return memories
+
+
+def extract_memories(messages, known_keys=(), llm=None):
+    """
+    One extraction call for a batch of (username, content) messages from the same room.
+    Returns a list of {type, key, value}, deduplicated by key (last one wins).
+    """
+    chain = MEMORY_PROMPT | (llm or get_mem_llm())
+    response = chain.invoke({
+        "known_keys": "\n".join(f"- {key}" for key in known_keys) or "(none)",
+        "messages": "\n".join(f"{username}: {content}" for username, content in messages),
+    })
+    content = response.content if isinstance(response.content, str) else ""
+    deduped = OrderedDict()
+    for memory in parse_memories(content):
+        deduped[memory["key"]] = memory
+    return list(deduped.values())
+
+
+def upsert_memories(room_id, memories):
+    """Insert or update a room's memories by key. Caller commits."""
+    if not memories:
+        return
+    now = datetime.utcnow()
+    rows = [
+        {"room_id": room_id, "type": m["type"], "key": m["key"], "value": m["value"],
+         "created_at": now, "updated_at": now}
+        for m in memories
+    ]
+    stmt = upsert_insert(RoomMemory)
+    if stmt is not None:
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=["room_id", "key"],
+            set_={"type": stmt.excluded.type, "value": stmt.excluded.value, "updated_at": stmt.excluded.updated_at},
+        ), rows)
+        return
+    existing = {
+        m.key: m for m in RoomMemory.query.filter(
+            RoomMemory.room_id == room_id, RoomMemory.key.in_([row["key"] for row in rows])
+        )
+    }
+    for row in rows:
+        memory = existing.get(row["key"])
+        if memory is None:
+            db.session.add(RoomMemory(**row))
+        else:
+            memory.type, memory.value, memory.updated_at = row["type"], row["value"], now
+
+
+_memory_cache = TTLCache(
+    maxsize=int(os.getenv("ROOM_MEMORY_CACHE_ROOMS", 1000)),
+    ttl=float(os.getenv("ROOM_MEMORY_CACHE_TTL", 300)),
+)
+
+
+def get_room_memories(room_id):
+    """A room's memories as a tuple of {type, key, value}, most recently updated first."""
+    memories = _memory_cache.get(room_id)
+    if memories is None:
+        rows = (RoomMemory.query.filter_by(room_id=room_id)
+                .order_by(RoomMemory.updated_at.desc())
+                .limit(MEMORY_PROMPT_LIMIT).all())
+        memories = tuple({"type": r.type, "key": r.key, "value": r.value} for r in rows)
+        _memory_cache.set(room_id, memories)
+    return memories
+
+
+def invalidate_room_memories(room_id):
+    _memory_cache.invalidate(room_id)
+
+
+def format_memories(memories):
+    """System prompt section listing a room's memories."""
+    lines = [f"- [{m['type']}] {m['key']}: {m['value']}" for m in memories]
+    return "Things this chat room has asked you to remember:\n" + "\n".join(lines)
+
+
+# openai being unreachable says nothing about the rows either (also used by message_index.py)
+TRANSIENT_OPENAI_ERRORS = (
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.RateLimitError,
+    openai.InternalServerError,
+)
+MEMORY_TRANSIENT_ERRORS = TRANSIENT_DB_ERRORS + TRANSIENT_OPENAI_ERRORS
+
+
+def _extract_batch(rows):
+    by_room = OrderedDict()
+    for row in rows:
+        by_room.setdefault(row["room_id"], []).append(row)
+    room_ids = list(by_room)
+
+    for i, room_id in enumerate(room_ids):
+        messages = [(row["username"], row["content"]) for row in by_room[room_id]]
+        try:
+            known_keys = [m["key"] for m in get_room_memories(room_id)]
+            memories = extract_memories(messages, known_keys)
+            if memories:
+                upsert_memories(room_id, memories)
+                db.session.commit()
+                invalidate_room_memories(room_id)
+        except MEMORY_TRANSIENT_ERRORS as e:
+            db.session.rollback()
+            # retry this room and the rest after the backoff, not the rooms already done
+            raise RetryLater([row for later in room_ids[i:] for row in by_room[later]], e)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"memory extraction for room {room_id} failed, dropping {len(messages)} messages: {e}")
+            extraction_stats["failed"] += len(messages)
+            continue
+        extraction_stats["calls"] += 1
+        extraction_stats["messages"] += len(messages)
+        extraction_stats["memories"] += len(memories)
+
+
+extraction_stats = {
+    "calls": 0,
+    "messages": 0,
+    "memories": 0,
+    "failed": 0,
+}
+
+memory_writer = BatchWriter(
+    "room_memory",
+    _extract_batch,
+    max_queue=int(os.getenv("ROOM_MEMORY_MAX_QUEUE", 5000)),
+    batch_size=int(os.getenv("ROOM_MEMORY_BATCH_SIZE", 200)),
+    flush_interval=float(os.getenv("ROOM_MEMORY_FLUSH_INTERVAL", 10)),
+    overflow="drop_oldest",
+    transient_errors=MEMORY_TRANSIENT_ERRORS,
+    # failures are handled per room in _extract_batch, don't bisect batches into more llm calls
+    split_failed_batches=False,
+)
+
+
+def enqueue_for_memory(room_id, username, content):
+    """Queue a chat message for memory extraction. Returns False if memory is disabled or it was skipped."""
+    if not MEMORY_ENABLED or not content or content == "[Image]":
+        return False
+    return memory_writer.enqueue({"room_id": room_id, "username": username, "content": content})
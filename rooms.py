@@ -0,0 +1,136 @@
+import os
+import secrets
+import string
+import threading
+from collections import deque
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Room
+
+'''
+room provisioning
+
+create_room used to SELECT the code in a while True that never picked a
+new one, so a collision spun forever, and every room cost a SELECT plus an
+INSERT.
+
+    - codes come from a pool that is refilled in chunks: one token_bytes
+      call for the whole chunk, and one SELECT ... IN to drop codes that
+      already exist
+    - create_room just INSERTs (and returns the code it inserted, nothing
+      is read back); the unique constraint on room_code is the real check,
+      and on a violation it retries with the next code
+    - create_rooms provisions many rooms in a single transaction (bulk
+      endpoint for onboarding jobs)
+'''
+
+ROOM_CODE_ALPHABET = string.ascii_uppercase + string.digits
+ROOM_CODE_LENGTH = 8
+MAX_ATTEMPTS = 5
+MAX_BULK_ROOMS = int(os.getenv("MAX_BULK_ROOMS", 10000))
+
+# bytes >= this would make b % len(alphabet) favour the first few characters
+_UNBIASED_LIMIT = 256 - 256 % len(ROOM_CODE_ALPHABET)
+_SELECT_CHUNK = 500
+
+
+def generate_room_codes(count, length=ROOM_CODE_LENGTH):
+    """count random codes, drawn from one token_bytes call where possible."""
+    alphabet = ROOM_CODE_ALPHABET
+    chars = []
+    needed = count * length
+    while len(chars) < needed:
+        # ~2% of bytes get rejected, ask for a little more than needed
+        chars.extend(alphabet[b % len(alphabet)] for b in secrets.token_bytes(needed - len(chars) + 16)
+                     if b < _UNBIASED_LIMIT)
+    joined = ''.join(chars[:needed])
+    return [joined[i:i + length] for i in range(0, needed, length)]
+
+
+def generate_room_code():
+    return generate_room_codes(1)[0]
+
+
+def _existing_codes(codes):
+    existing = set()
+    for i in range(0, len(codes), _SELECT_CHUNK):
+        chunk = codes[i:i + _SELECT_CHUNK]
+        existing.update(db.session.scalars(select(Room.room_code).where(Room.room_code.in_(chunk))))
+    return existing
+
+
+def _fresh_codes(count):
+    """count codes that are unique among themselves and not in the rooms table (as of now)."""
+    codes = []
+    seen = set()
+    while len(codes) < count:
+        candidates = [c for c in generate_room_codes(count - len(codes)) if c not in seen]
+        existing = _existing_codes(candidates)
+        for code in candidates:
+            if code not in existing:
+                seen.add(code)
+                codes.append(code)
+    return codes
+
+
+class RoomCodePool:
+    """Pre-generated room codes, refilled in chunks of `size`."""
+
+    def __init__(self, size=None):
+        self.size = size or int(os.getenv("ROOM_CODE_POOL_SIZE", 256))
+        self._codes = deque()
+        # refills run outside the lock
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self._codes:
+                return self._codes.popleft()
+        # needs the db, so run it outside the lock; concurrent refills just make the pool bigger
+        codes = _fresh_codes(self.size)
+        with self._lock:
+            self._codes.extend(codes[1:])
+        return codes[0]
+
+    def clear(self):
+        with self._lock:
+            self._codes.clear()
+
+    def __len__(self):
+        return len(self._codes)
+
+
+code_pool = RoomCodePool()
+
+
+def create_room(name=None):
+    """Insert a room with a fresh code, retrying on a code collision. Returns its room code."""
+    for _ in range(MAX_ATTEMPTS):
+        code = code_pool.take()
+        try:
+            # a core insert: no Room instance to expire on commit and reload just to read the code
+            db.session.execute(insert(Room), [{"room_code": code, "name": name}])
+            db.session.commit()
+            return code
+        except IntegrityError:
+            # someone else took the code between the pool refill and now
+            db.session.rollback()
+    raise RuntimeError(f"could not allocate a unique room code after {MAX_ATTEMPTS} attempts")
+
+
+def create_rooms(count):
+    """Provision `count` rooms in one transaction. Returns their room codes."""
+    if count < 1 or count > MAX_BULK_ROOMS:
+        raise ValueError(f"count must be between 1 and {MAX_BULK_ROOMS}")
+    for _ in range(MAX_ATTEMPTS):
+        codes = _fresh_codes(count)
+        try:
+            db.session.execute(insert(Room), [{"room_code": code} for code in codes])
+            db.session.commit()
+            return codes
+        except IntegrityError:
+            # a concurrent create_room took one of the codes: redo the whole batch
+            db.session.rollback()
+    raise RuntimeError(f"could not allocate {count} unique room codes after {MAX_ATTEMPTS} attempts")
@@ -1,21 +1,61 @@
 import os
+import threading
 import boto3
+from botocore.config import Config
 from dotenv import load_dotenv
+from lookup_cache import TTLCache
 
 load_dotenv()
 
-def get_s3_client():
+BUCKET = "agent-messaging"
+PRESIGN_EXPIRES_IN = 3600  # 1 hour
+# cached GET urls are handed out until this many seconds before they expire,
+# so a client never receives a url that is about to stop working
+PRESIGN_REFRESH_MARGIN = int(os.getenv("S3_PRESIGN_REFRESH_MARGIN", 300))
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+_presigned_get_urls = TTLCache(
+    maxsize=int(os.getenv("S3_PRESIGN_CACHE_SIZE", 10000)),
+    ttl=PRESIGN_EXPIRES_IN - PRESIGN_REFRESH_MARGIN,
+)
+
+
+def new_s3_client():
+    """Build a new client. Prefer get_s3_client(), which reuses one."""
     return boto3.client(
         "s3",
         aws_access_key_id=os.getenv("AWS_ACCESS_KEY_ID"),
         aws_secret_access_key=os.getenv("AWS_SECRET_ACCESS_KEY"),
-        region_name=os.getenv("AWS_REGION")
+        region_name=os.getenv("AWS_REGION"),
+        endpoint_url=os.getenv("S3_ENDPOINT_URL") or None,
+        config=Config(max_pool_connections=int(os.getenv("S3_MAX_POOL_CONNECTIONS", 20))),
     )
 
+
+def get_s3_client():
+    """Process-wide S3 client. boto3 clients are thread safe, so one is shared."""
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                _s3_client = new_s3_client()
+    return _s3_client
+
+
+def presign_get_url(object_key):
+    """Presigned GET url for object_key, reused until shortly before it expires."""
+    url = _presigned_get_urls.get(object_key)
+    if url is None:
+        url = get_s3_client().generate_presigned_url(
+            'get_object',
+            Params={'Bucket': BUCKET, 'Key': object_key},
+            ExpiresIn=PRESIGN_EXPIRES_IN
+        )
+        _presigned_get_urls.set(object_key, url)
+    return url
+
+
 def convert_object_key_to_url(object_key):
-    s3 = get_s3_client()
-    return s3.generate_presigned_url(
-        'get_object',
-        Params={'Bucket': 'agent-messaging', 'Key': object_key},
-        ExpiresIn=3600
-    )
\ No newline at end of file
+    return presign_get_url(object_key)
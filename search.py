@@ -0,0 +1,168 @@
+import re
+
+from sqlalchemy import func, literal_column, text
+
+from models import db, Message, User
+
+'''
+room-scoped full-text message search
+
+the only way to find an old message used to be paging through
+/get_previous_messages. now /search_messages (and the search_messages
+socket event) run an indexed full-text query, for room members only
+(/search_messages takes the login jwt as Authorization: Bearer):
+
+    - postgres: GIN index on to_tsvector('english', content)
+      (ix_messages_content_fts), websearch_to_tsquery for the user's
+      query, ranked by ts_rank
+    - sqlite (local runs): external-content FTS5 table messages_fts over
+      (content, room_id) kept in sync by triggers, ranked by bm25. room_id
+      is an indexed column so the room filter is part of the MATCH instead
+      of a post-filter over every room's hits
+
+results are best match first, newest first on ties, paginated with
+limit / offset (offset capped at MAX_SEARCH_OFFSET, ranked results have no
+stable keyset). same message dicts as history pages, plus rank.
+
+the index comes from the migration; ensure_search_index() creates it on a
+database made with db.create_all() (benchmarks, load tests).
+'''
+
+DEFAULT_SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+MAX_SEARCH_OFFSET = 1000
+TS_CONFIG = literal_column("'english'")
+
+_TERM_RE = re.compile(r"\w+", re.UNICODE)
+# dropped from sqlite queries, like postgres' english config does; they match almost every row
+STOP_WORDS = frozenset(
+    "a an and are as at be but by for if in into is it no not of on or such that the their then "
+    "there these they this to was will with i you we me my our your".split()
+)
+
+SQLITE_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    "content, room_id, content='messages', content_rowid='message_id')",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ai AFTER INSERT ON messages BEGIN "
+    "INSERT INTO messages_fts(rowid, content, room_id) VALUES (new.message_id, new.content, new.room_id); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_ad AFTER DELETE ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content, room_id) VALUES ('delete', old.message_id, old.content, old.room_id); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_fts_au AFTER UPDATE OF content, room_id ON messages BEGIN "
+    "INSERT INTO messages_fts(messages_fts, rowid, content, room_id) VALUES ('delete', old.message_id, old.content, old.room_id); "
+    "INSERT INTO messages_fts(rowid, content, room_id) VALUES (new.message_id, new.content, new.room_id); END",
+)
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def ensure_search_index():
+    """Create the sqlite FTS table and triggers if missing (postgres gets its index from the model / migration)."""
+    if _dialect() != "sqlite":
+        return
+    exists = db.session.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    )).first()
+    for statement in SQLITE_FTS_DDL:
+        db.session.execute(text(statement))
+    if not exists:
+        # index rows that were there before the table
+        db.session.execute(text("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')"))
+    db.session.commit()
+
+
+def _fts5_query(room_id, query):
+    terms = _TERM_RE.findall(query)
+    # a query made only of stop words still searches for them
+    terms = [term for term in terms if term.lower() not in STOP_WORDS] or terms
+    if not terms:
+        return None
+    # quote every term so user input can't be parsed as FTS5 syntax; terms are ANDed
+    quoted = " ".join('"' + term + '"' for term in terms)
+    return f'room_id : "{int(room_id)}" AND content : ({quoted})'
+
+
+def _columns():
+    return (
+        Message.message_id,
+        Message.user_id,
+        User.username,
+        Message.content,
+        Message.image_url,
+        Message.timestamp,
+    )
+
+
+def _postgres_search(room_id, query, limit, offset):
+    document = func.to_tsvector(TS_CONFIG, Message.content)
+    ts_query = func.websearch_to_tsquery(TS_CONFIG, query)
+    rank = func.ts_rank(document, ts_query).label("rank")
+    return db.session.query(*_columns(), rank)\
+        .join(User, User.user_id == Message.user_id)\
+        .filter(Message.room_id == room_id, document.op("@@")(ts_query))\
+        .order_by(rank.desc(), Message.message_id.desc())\
+        .limit(limit + 1).offset(offset).all()
+
+
+def _sqlite_search(room_id, query, limit, offset):
+    match = _fts5_query(room_id, query)
+    if not match:
+        return []
+    # bm25 is lower for better matches; negate it so rank is "higher is better" like ts_rank.
+    # the room_id column gets weight 0 so only content decides the ranking
+    return db.session.execute(text(
+        "SELECT m.message_id, m.user_id, u.username, m.content, m.image_url, m.timestamp, "
+        "-bm25(messages_fts, 1.0, 0.0) AS rank "
+        "FROM messages_fts "
+        "JOIN messages m ON m.message_id = messages_fts.rowid "
+        "JOIN users u ON u.user_id = m.user_id "
+        "WHERE messages_fts MATCH :match "
+        "ORDER BY bm25(messages_fts, 1.0, 0.0), m.message_id DESC "
+        "LIMIT :limit OFFSET :offset"
+    ), {"match": match, "limit": limit + 1, "offset": offset}).all()
+
+
+def search_messages(room_id, query, limit=DEFAULT_SEARCH_LIMIT, offset=0):
+    """
+    Returns (messages, next_offset), best match first.
+    next_offset is None when there are no more results.
+    """
+    limit = max(1, min(limit, MAX_SEARCH_LIMIT))
+    offset = max(0, min(offset, MAX_SEARCH_OFFSET))
+    query = (query or "").strip()
+    if not query:
+        return [], None
+
+    dialect = _dialect()
+    if dialect == "postgresql":
+        rows = _postgres_search(room_id, query, limit, offset)
+    elif dialect == "sqlite":
+        rows = _sqlite_search(room_id, query, limit, offset)
+    else:
+        raise NotImplementedError(f"full-text search is not supported on {dialect}")
+
+    # one extra row tells us if there is another page without a COUNT
+    has_more = len(rows) > limit and offset + limit <= MAX_SEARCH_OFFSET
+    rows = rows[:limit]
+
+    messages = [{
+        "message_id": row.message_id,
+        "user_id": row.user_id,
+        "username": row.username,
+        "content": row.content,
+        "object_key": row.image_url,
+        "timestamp": _isoformat(row.timestamp),
+        "rank": float(row.rank),
+    } for row in rows]
+
+    return messages, offset + limit if has_more else None
+
+
+def _isoformat(timestamp):
+    # text() queries on sqlite return the stored string, not a datetime
+    if timestamp is None:
+        return None
+    if isinstance(timestamp, str):
+        return timestamp.replace(" ", "T")
+    return timestamp.isoformat()
@@ -0,0 +1,66 @@
+import os
+
+import orjson
+import ormsgpack
+from socketio import packet
+
+'''
+Socket.IO wire serializers
+
+    - json     (default) the regular Socket.IO text protocol, but encoded /
+               decoded with orjson instead of the stdlib json module.
+               works with every stock socket.io client.
+    - msgpack  binary packets encoded with ormsgpack, same layout as
+               socket.io-msgpack-parser. clients must be built with that
+               parser (new io(url, { parser: msgpackParser })).
+
+python-socketio encodes a packet once per emit and sends the same bytes to
+every socket in the room, so the format is chosen per deployment with
+SOCKETIO_SERIALIZER, not per connection. clients opt in by pointing at a
+deployment (or a separate worker pool) that runs msgpack.
+'''
+
+
+class OrjsonJSON:
+    """Drop-in for the json module (dumps / loads) backed by orjson."""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        # python-socketio passes separators=...; orjson output is already compact
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
+class OrmsgpackPacket(packet.Packet):
+    """Socket.IO packet encoded as a single msgpack map, like socket.io-msgpack-parser."""
+
+    uses_binary_events = False
+
+    def encode(self):
+        out = {'type': self.packet_type, 'data': self.data, 'nsp': self.namespace}
+        if self.id is not None:
+            out['id'] = self.id
+        return ormsgpack.packb(out, option=ormsgpack.OPT_NON_STR_KEYS)
+
+    def decode(self, encoded_packet):
+        decoded = ormsgpack.unpackb(encoded_packet)
+        self.packet_type = decoded['type']
+        self.data = decoded.get('data')
+        self.id = decoded.get('id')
+        self.namespace = decoded['nsp']
+
+
+SERIALIZERS = ("json", "msgpack")
+
+
+def socketio_serializer_options(name=None):
+    """Keyword arguments for SocketIO(...) selecting the wire serializer."""
+    name = name or os.getenv("SOCKETIO_SERIALIZER", "json")
+    if name not in SERIALIZERS:
+        raise ValueError(f"Unknown Socket.IO serializer: {name}")
+    if name == "msgpack":
+        return {"serializer": OrmsgpackPacket}
+    return {"json": OrjsonJSON}
@@ -0,0 +1,160 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+'''
+per-socket session store
+
+socket_user_map used to be a module level dict, which only works with a
+single worker process: a socket's user_id lived in whichever process
+accepted the connection. the store hides where that state lives:
+
+    - MemorySessionStore  a dict, for one process / local dev
+    - RedisSessionStore   a redis hash shared by every worker
+
+cross-process broadcast is handled by Flask-SocketIO itself once
+SocketIO(message_queue=...) points at the same redis url, so with
+SOCKETIO_MESSAGE_QUEUE=redis://... we can run N workers behind a load
+balancer with sticky sessions (needed for the polling transport).
+
+RedisSessionStore keeps one hash per worker (sockets are sticky, so a
+socket's handlers always run in the worker that holds its entry). workers
+heartbeat into a sorted set; the hashes of workers that stopped
+heartbeating for SESSION_WORKER_TTL seconds (a crashed or killed worker)
+are deleted at startup and whenever sockets are counted, and expire on
+their own after that long anyway.
+
+RedisSessionStore takes an optional client so tests can pass a
+fakeredis.FakeRedis() instead of a real server.
+'''
+
+
+class SocketSessionStore:
+    """Interface for socket_id -> user_id state."""
+
+    def set_user(self, socket_id, user_id):
+        raise NotImplementedError
+
+    def get_user(self, socket_id):
+        raise NotImplementedError
+
+    def remove(self, socket_id):
+        """Forget a socket. Returns the user_id it belonged to, or None."""
+        raise NotImplementedError
+
+    def count(self):
+        """Number of tracked sockets."""
+        raise NotImplementedError
+
+
+class MemorySessionStore(SocketSessionStore):
+
+    def __init__(self):
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def set_user(self, socket_id, user_id):
+        with self._lock:
+            self._users[socket_id] = user_id
+
+    def get_user(self, socket_id):
+        return self._users.get(socket_id)
+
+    def remove(self, socket_id):
+        with self._lock:
+            return self._users.pop(socket_id, None)
+
+    def count(self):
+        return len(self._users)
+
+
+class RedisSessionStore(SocketSessionStore):
+
+    def __init__(self, url=None, client=None, prefix="chat", worker_id=None, worker_ttl=None, heartbeat=True):
+        if client is None:
+            import redis
+            client = redis.Redis.from_url(url)
+        self._redis = client
+        self._prefix = prefix
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.worker_ttl = worker_ttl or int(os.getenv("SESSION_WORKER_TTL", 60))
+        self._workers_key = f"{prefix}:session_workers"
+        self._users_key = self._worker_users_key(self.worker_id)
+
+        self.heartbeat()
+        self.prune_dead_workers()
+        if heartbeat:
+            threading.Thread(target=self._heartbeat_loop, name="session-heartbeat", daemon=True).start()
+
+    def _worker_users_key(self, worker_id):
+        return f"{self._prefix}:socket_users:{worker_id}"
+
+    def heartbeat(self):
+        """Mark this worker alive and push back the expiry of its sockets."""
+        pipe = self._redis.pipeline()
+        pipe.zadd(self._workers_key, {self.worker_id: time.time()})
+        pipe.expire(self._users_key, self.worker_ttl)
+        pipe.execute()
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(self.worker_ttl / 3)
+            try:
+                self.heartbeat()
+            except Exception:
+                # redis blips are retried on the next beat; the entries live for worker_ttl
+                pass
+
+    def prune_dead_workers(self):
+        """Delete the socket entries of workers that stopped heartbeating. Returns how many were pruned."""
+        dead = self._redis.zrangebyscore(self._workers_key, "-inf", time.time() - self.worker_ttl)
+        if not dead:
+            return 0
+        pipe = self._redis.pipeline()
+        for worker_id in dead:
+            worker_id = worker_id.decode() if isinstance(worker_id, bytes) else worker_id
+            pipe.delete(self._worker_users_key(worker_id))
+            pipe.zrem(self._workers_key, worker_id)
+        pipe.execute()
+        return len(dead)
+
+    def set_user(self, socket_id, user_id):
+        pipe = self._redis.pipeline()
+        pipe.hset(self._users_key, socket_id, user_id)
+        pipe.expire(self._users_key, self.worker_ttl)
+        pipe.execute()
+
+    def get_user(self, socket_id):
+        value = self._redis.hget(self._users_key, socket_id)
+        return int(value) if value is not None else None
+
+    def remove(self, socket_id):
+        pipe = self._redis.pipeline()
+        pipe.hget(self._users_key, socket_id)
+        pipe.hdel(self._users_key, socket_id)
+        value, _ = pipe.execute()
+        return int(value) if value is not None else None
+
+    def count(self):
+        """Sockets tracked by all live workers."""
+        self.prune_dead_workers()
+        workers = self._redis.zrange(self._workers_key, 0, -1)
+        pipe = self._redis.pipeline()
+        for worker_id in workers:
+            worker_id = worker_id.decode() if isinstance(worker_id, bytes) else worker_id
+            pipe.hlen(self._worker_users_key(worker_id))
+        return sum(pipe.execute())
+
+
+def get_message_queue_url():
+    """Redis url shared by SocketIO(message_queue=...) and the session store, or None."""
+    return os.getenv("SOCKETIO_MESSAGE_QUEUE") or None
+
+
+def create_session_store(url=None):
+    url = url or get_message_queue_url()
+    if url and url.startswith(("redis://", "rediss://")):
+        return RedisSessionStore(url)
+    return MemorySessionStore()
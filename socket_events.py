@@ -1,13 +1,32 @@
-from flask import Flask, request, session
-from flask_socketio import SocketIO, join_room, leave_room, emit, rooms
-from models import db, User, Room, Message, UserRoom
+from flask import request, session
+from flask_socketio import SocketIO, join_room, leave_room, emit
 from flask import current_app
 import jwt
-from flask import g
-from agent import run_agent
-
-# Store user_id per socket connection to avoid session collision issues in threading mode
-socket_user_map = {}
+import logging
+import os
+from agent import run_agent, run_agent_stream
+from persistence import enqueue_message, enqueue_membership
+from lookup_cache import get_room_id, get_username
+from session_store import MemorySessionStore
+from s3_utils import presign_get_url
+from room_context import room_context
+from room_memory import enqueue_for_memory
+from datetime import datetime
+from event_log import event_log
+from metrics import track_event, agent_seconds, pending_agent_jobs
+import time
+from auth_tokens import verify_token, token_response
+from broadcast import RoomBroadcaster, live_room, batched_room
+from presence import presence
+from search import search_messages, DEFAULT_SEARCH_LIMIT
+
+# Store user_id per socket connection to avoid session collision issues in threading mode.
+# register_socket_events swaps in a shared (redis) store when running several workers
+session_store = MemorySessionStore()
+broadcaster = None
+
+# stream @agent replies token by token (agent_token events) instead of one final message
+AGENT_STREAMING = os.getenv("AGENT_STREAMING", "true").lower() == "true"
 '''
 websocket planning
 
@@ -52,13 +71,26 @@ Client -> server events:
   - join_room
   {
     room_code,
-  
+    batching, (optional, opt in to new_messages batches in hot rooms, see broadcast.py)
   }
   - send_message
   {
     room_code,
     message:,
   }
+ - refresh_token
+  {}
+  - get_presence
+  {
+    room_code,
+  }
+  - search_messages
+  {
+    room_code,
+    q,
+    limit, (optional)
+    offset, (optional)
+  }
   
 
 Server -> client events:
@@ -70,293 +102,239 @@ Server -> client events:
         message:,
         timestamp:,
     }
- - user_joined
+ - user_joined (only for a user's first socket in the room, see presence.py)
     { 
         user_id:,
     }
 
- - user_left
+ - user_left (when a user's last socket leaves the room or disconnects)
     {
         user_id:,
     }
 
+ - presence (reply to get_presence)
+    {
+        room_code:,
+        users: [{user_id, username}],
+    }
+
+ - search_results (reply to search_messages, best match first)
+    {
+        room_code:,
+        q:,
+        messages: [...],
+        next_offset:,
+    }
+
+ - token_refreshed (reply to refresh_token)
+    {
+        token:,
+        expires_in:,
+        refresh_in:,
+    }
+
+ - agent_token (streamed @agent reply, followed by one new_message with the full text)
+    {
+        token:,
+        message_id:,
+    }
+
 '''
 
-def register_socket_events(socketio: SocketIO):
+def register_socket_events(socketio: SocketIO, store=None):
+    global session_store, broadcaster
+    if store is not None:
+        session_store = store
+    broadcaster = RoomBroadcaster(socketio)
 
     @socketio.on('connect')
+    @track_event('connect')
     def handle_connect(auth):
-        # #region agent log
-        import logging
-        import json
-        import os
-        from datetime import datetime
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
         socket_id = request.sid
-        log_data = {
-            "timestamp": datetime.now().isoformat(),
-            "event": "connect_attempt",
-            "socket_id": socket_id,
-            "auth_present": auth is not None,
-            "token_present": bool(auth.get('token') if auth else None)
-        }
-        logger.info(f"Socket connect attempt - socket_id: {socket_id}, auth present: {auth is not None}")
-        try:
-            log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.cursor', 'debug.log')
-            os.makedirs(os.path.dirname(log_path), exist_ok=True)
-            with open(log_path, 'a') as f:
-                f.write(json.dumps(log_data) + '\n')
-        except: pass
-        # #endregion
-        
+
         if not auth or not auth.get("token"):
-            logger.warning(f"Socket connection rejected: No auth token - socket_id: {socket_id}")
+            event_log.event("connect_rejected", logging.WARNING, socket_id=socket_id, reason="no_token")
             return False
         try:
             token = auth.get("token")
-            payload = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            user_id = payload.get('user_id')
-            logger.info(f"Socket connection authenticated - socket_id: {socket_id}, user_id: {user_id}")
-        
+            payload = verify_token(token, current_app.config['SECRET_KEY'])
+
         except jwt.ExpiredSignatureError:
-            logger.warning(f"Socket connection rejected: Token expired - socket_id: {socket_id}")
+            event_log.event("connect_rejected", logging.WARNING, socket_id=socket_id, reason="token_expired")
             return False
-        
+
         except jwt.InvalidTokenError as e:
-            logger.warning(f"Socket connection rejected: Invalid token - socket_id: {socket_id}, error: {str(e)}")
+            event_log.event("connect_rejected", logging.WARNING, socket_id=socket_id, reason="invalid_token", error=str(e))
             return False
-        
+
         except Exception as e:
-            logger.error(f"Socket connection error - socket_id: {socket_id}, error: {str(e)}")
+            event_log.event("connect_error", logging.ERROR, socket_id=socket_id, error=str(e))
             return False
-        
+
         user_id = payload['user_id']
         # Store user_id per socket connection (not in Flask session to avoid threading issues)
-        socket_user_map[socket_id] = user_id
+        session_store.set_user(socket_id, user_id)
+        presence.connect(socket_id, user_id)
         session['user_id'] = user_id  # Keep for backward compatibility
-        
-        # #region agent log
-        log_data = {
-            "timestamp": datetime.now().isoformat(),
-            "event": "connect_success",
-            "socket_id": socket_id,
-            "user_id": user_id,
-            "session_user_id": session.get('user_id'),
-            "socket_user_map_size": len(socket_user_map)
-        }
-        logger.info(f"Socket connected successfully - socket_id: {socket_id}, user_id: {user_id}, total_sockets: {len(socket_user_map)}")
-        try:
-            with open(log_path, 'a') as f:
-                f.write(json.dumps(log_data) + '\n')
-        except: pass
-        # #endregion
+
+        event_log.event("connect", socket_id=socket_id, user_id=user_id)
         return True
 
+    @socketio.on('refresh_token')
+    @track_event('refresh_token')
+    def handle_refresh_token(data=None):
+        # rotate credentials on a live socket so the client never has to
+        # reconnect or call /auth/login again when its token expires
+        socket_id = request.sid
+        user_id = session_store.get_user(socket_id)
+        if not user_id:
+            emit("error", {"message": "Authentication required"})
+            return
+        emit("token_refreshed", token_response(user_id, current_app.config['SECRET_KEY']))
+
     @socketio.on('join_room')
+    @track_event('join_room')
     def handle_join_room(data): #data is just payload of event. in this case, it looks like this: { room_code: 'some_code' }
-        # #region agent log
-        import logging
-        import json
-        import os
-        from datetime import datetime
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
         socket_id = request.sid
-        log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.cursor', 'debug.log')
-        # #endregion
-        
+
         with current_app.app_context():
             room_code = data.get('room_code')
             # Get user_id from socket-specific storage (more reliable than session in threading mode)
-            user_id = socket_user_map.get(socket_id)
+            user_id = session_store.get_user(socket_id)
             if not user_id:
-                logger.error(f"join_room failed - socket_id: {socket_id}, no user_id found")
+                event_log.event("join_room_failed", logging.WARNING, socket_id=socket_id, reason="unauthenticated")
                 emit("error", {"message": "Authentication required"})
                 return
-            
-            # #region agent log
-            current_rooms = rooms(socket_id)
-            log_data = {
-                "timestamp": datetime.now().isoformat(),
-                "event": "join_room_attempt",
-                "socket_id": socket_id,
-                "user_id": user_id,
-                "room_code": room_code,
-                "current_rooms_before": list(current_rooms),
-                "session_user_id": session.get('user_id')
-            }
-            logger.info(f"join_room attempt - socket_id: {socket_id}, user_id: {user_id}, room_code: {room_code}, current_rooms: {list(current_rooms)}")
-            try:
-                os.makedirs(os.path.dirname(log_path), exist_ok=True)
-                with open(log_path, 'a') as f:
-                    f.write(json.dumps(log_data) + '\n')
-            except: pass
-            # #endregion
-            
-            room = Room.query.filter_by(room_code=room_code).first()
-            if room:
-                # #region agent log
-                # Get all sockets currently in the room BEFORE joining
-                from flask_socketio import SocketIO as SIO
-                # Note: We can't easily get all sockets in a room, but we can log what we know
-                logger.info(f"BEFORE join_room - socket_id: {socket_id}, user_id: {user_id}, room_id: {room.room_id}, total_sockets_in_map: {len(socket_user_map)}")
-                # #endregion
-                
-                join_room(room.room_id)
-                #broadcast that new user has arrived
-                user = User.query.filter_by(user_id=user_id).first()
-                if not user:
-                    logger.error(f"join_room failed - socket_id: {socket_id}, user not found: {user_id}")
+
+            room_id = get_room_id(room_code)
+            if room_id is not None:
+                username = get_username(user_id)
+                if username is None:
+                    event_log.event("join_room_failed", logging.WARNING, socket_id=socket_id, user_id=user_id, reason="user_not_found")
                     emit("error", {"message": "User not found"})
                     return
-                
-                username = user.username
-                # #region agent log
-                rooms_after = rooms(socket_id)
-                # Get all user_ids currently in socket_user_map for debugging
-                all_socket_users = {sid: uid for sid, uid in socket_user_map.items()}
-                log_data = {
-                    "timestamp": datetime.now().isoformat(),
-                    "event": "join_room_success",
-                    "socket_id": socket_id,
-                    "user_id": user_id,
-                    "room_code": room_code,
-                    "room_id": room.room_id,
-                    "rooms_after": list(rooms_after),
-                    "total_sockets": len(socket_user_map),
-                    "all_socket_users": all_socket_users
-                }
-                logger.info(f"AFTER join_room - socket_id: {socket_id}, user_id: {user_id}, room_id: {room.room_id}, rooms_after: {list(rooms_after)}, total_sockets: {len(socket_user_map)}")
+
                 try:
-                    with open(log_path, 'a') as f:
-                        f.write(json.dumps(log_data) + '\n')
-                except: pass
-                # #endregion
-                
-                emit("user_joined", {"user_id": user_id, "username": username}, room=room.room_id)
-                
-                #create association in db if it doesn't exists
-                user_room_link = UserRoom.query.filter_by(user_id=user_id, room_id=room.room_id).first()
-                
-                if not user_room_link:
-                    new_link = UserRoom(user_id=user_id, room_id=room.room_id)
-                    db.session.add(new_link)
-                    db.session.commit()
+                    first_socket = presence.join(socket_id, room_id)
+                except ValueError as e:
+                    event_log.event("join_room_failed", logging.WARNING, socket_id=socket_id, user_id=user_id, reason=str(e))
+                    emit("error", {"message": "Could not join room"})
+                    return
+                join_room(room_id)
+                # clients that opt in get hot-room messages as new_messages batches.
+                # a socket re-joining may switch modes, so leave the other sub-room first
+                if data.get('batching'):
+                    leave_room(live_room(room_id))
+                    join_room(batched_room(room_id))
+                else:
+                    leave_room(batched_room(room_id))
+                    join_room(live_room(room_id))
+
+                event_log.event("join_room", socket_id=socket_id, user_id=user_id, room_id=room_id)
+                #broadcast that new user has arrived (other tabs of the same user don't count)
+                if first_socket:
+                    emit("user_joined", {"user_id": user_id, "username": username}, room=room_id)
+
+                # membership is upserted in batches by the background writer
+                enqueue_membership(user_id, room_id)
             else:
                 emit("error", {"message": "Room not found"})
 
 
     @socketio.on('send_message')
+    @track_event('send_message')
     def handle_send_message(data):
         with current_app.app_context():
             socket_id = request.sid
             room_code = data.get('room_code')
             message = data.get('message', '')
             object_key = data.get('object_key')
-            user_id = socket_user_map.get(socket_id)
+            user_id = session_store.get_user(socket_id)
 
             if not user_id:
                 emit("error", {"message": "Authentication required"})
                 return
-            room = Room.query.filter_by(room_code=room_code).first()
-            if room and room.room_id in rooms(socket_id):
-                user = User.query.filter_by(user_id=user_id).first()
-                if not user:
+            room_id = get_room_id(room_code)
+            if room_id is not None and presence.in_room(socket_id, room_id):
+                username = get_username(user_id)
+                if username is None:
                     emit("error", {"message": "User not found"})
                     return
-                
-                username = user.username
 
                 image_url = None
                 if object_key:
                     try:
-                        from s3_utils import get_s3_client
-                        s3 = get_s3_client()
-                        image_url = s3.generate_presigned_url(
-                            'get_object',
-                            Params={'Bucket': 'agent-messaging', 'Key': object_key},
-                            ExpiresIn=3600
-                        )
+                        image_url = presign_get_url(object_key)
                     except Exception as e:
-                        print(f"Error generating image URL: {e}")
+                        event_log.event("image_url_error", logging.ERROR, object_key=object_key, error=str(e))
 
-                emit("new_message", {
+                broadcaster.publish(room_id, {
                     "user_id": user_id,
                     "message": message,
                     "username": username,
                     "image_url": image_url
-                }, room=room.room_id)
-                
+                })
+
+                # persisted by the background writer, not on this handler
+                content = message if message else "[Image]"
+                sent_at = datetime.utcnow()
+                enqueue_message(user_id, room_id, content, image_url=object_key, timestamp=sent_at)
+                # same timestamp, so the agent context never loads this message from the db twice
+                room_context.append(room_id, user_id, username, content, object_key=object_key, timestamp=sent_at)
+                # long-term memories are extracted in per-room batches in the background
+                enqueue_for_memory(room_id, username, content)
+
                 if message and message.strip().startswith('@agent'):
                     agent_input = message.strip()[6:].strip()
                     if agent_input:
+                        pending_agent_jobs.inc()
+                        agent_started = time.perf_counter()
                         try:
-                            emit("agent_status", {"status": "thinking"}, room=room.room_id)
-                            agent_response = run_agent(agent_input, room_id=room.room_id)
-                            emit("agent_status", {"status": "responding"}, room=room.room_id)
-                            emit("new_message", {"user_id": "agent", "message": agent_response, "username": "Agent"}, room=room.room_id)
-                            emit("agent_status", {"status": "idle"}, room=room.room_id)
-                            
-                            agent_message = Message(
-                                user_id=user_id,
-                                room_id=room.room_id,
-                                content=f"[Agent] {agent_response}",
-                            )
-                            db.session.add(agent_message)
-                            db.session.commit()
+                            broadcaster.emit(room_id, "agent_status", {"status": "thinking"})
+                            ttft_ms = None
+                            if AGENT_STREAMING:
+                                streamed = []
+
+                                def on_token(token, message_id):
+                                    if not streamed:
+                                        broadcaster.emit(room_id, "agent_status", {"status": "responding"})
+                                    streamed.append(token)
+                                    broadcaster.emit(room_id, "agent_token", {"token": token, "message_id": message_id})
+
+                                agent_response, ttft_ms = run_agent_stream(agent_input, room_id=room_id, on_token=on_token, before=sent_at)
+                            else:
+                                agent_response = run_agent(agent_input, room_id=room_id, before=sent_at)
+                                broadcaster.emit(room_id, "agent_status", {"status": "responding"})
+                            # the full reply is still sent once so clients that ignore agent_token work
+                            broadcaster.publish(room_id, {"user_id": "agent", "message": agent_response, "username": "Agent"})
+                            broadcaster.emit(room_id, "agent_status", {"status": "idle", "ttft_ms": ttft_ms})
+
+                            enqueue_message(user_id, room_id, f"[Agent] {agent_response}")
                         except Exception as e:
-                            print(f"Agent error: {e}")
-                            emit("agent_status", {"status": "failed", "error": str(e)}, room=room.room_id)
-                            emit("error", {"message": "Agent error occurred"}, room=room.room_id)
-                    
-                new_message = Message(
-                    user_id=user_id,
-                    room_id=room.room_id,
-                    content=message if message else "[Image]",
-                    image_url=object_key,
-                )
-            
-                db.session.add(new_message)
-                db.session.commit()
+                            event_log.event("agent_error", logging.ERROR, room_id=room_id, error=str(e))
+                            broadcaster.emit(room_id, "agent_status", {"status": "failed", "error": str(e)})
+                            broadcaster.emit(room_id, "error", {"message": "Agent error occurred"})
+                        finally:
+                            pending_agent_jobs.dec()
+                            agent_seconds.observe(time.perf_counter() - agent_started, "stream" if AGENT_STREAMING else "invoke")
             else:
                 emit("error", {"message": "Room not found"})
 
     @socketio.on('disconnect')
-    def handle_disconnect():
-        # #region agent log
-        import logging
-        import json
-        import os
-        from datetime import datetime
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
+    @track_event('disconnect')
+    def handle_disconnect(reason=None):
         socket_id = request.sid
-        user_id = socket_user_map.get(socket_id)
-
-        current_rooms_list = list(rooms(socket_id))
-        log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.cursor', 'debug.log')
-        log_data = {
-            "timestamp": datetime.now().isoformat(),
-            "event": "disconnect",
-            "socket_id": socket_id,
-            "user_id": user_id,
-            "rooms": current_rooms_list,
-            "session_user_id": session.get('user_id'),
-            "socket_user_map_size_before": len(socket_user_map)
-        }
-        logger.warning(f"Socket disconnected - socket_id: {socket_id}, user_id: {user_id}, rooms: {current_rooms_list}")
         # Clean up socket from user map
-        socket_user_map.pop(socket_id, None)
-        log_data["socket_user_map_size_after"] = len(socket_user_map)
-        try:
-            os.makedirs(os.path.dirname(log_path), exist_ok=True)
-            with open(log_path, 'a') as f:
-                f.write(json.dumps(log_data) + '\n')
-        except: pass
-        # #endregion
+        user_id = session_store.remove(socket_id)
+        _, rooms_left, rooms_emptied = presence.disconnect(socket_id)
+        event_log.event("disconnect", socket_id=socket_id, user_id=user_id, rooms=rooms_left)
+        for room_id in rooms_left:
+            emit("user_left", {"user_id": user_id}, room=room_id)
+        for room_id in rooms_emptied:
+            broadcaster.forget(room_id)
 
     @socketio.on('leave_room')
+    @track_event('leave_room')
     def handle_leave_room(data): #data looks like {room_code:...}
         '''
         steps:
@@ -367,45 +345,64 @@ def register_socket_events(socketio: SocketIO):
         if the room exisits loop through and then delete
 
         '''
-        # #region agent log
-        import logging
-        import json
-        import os
-        from datetime import datetime
-        logging.basicConfig(level=logging.INFO)
-        logger = logging.getLogger(__name__)
         socket_id = request.sid
-        log_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), '.cursor', 'debug.log')
-        # #endregion
-        
+
         with current_app.app_context():
             room_code = data.get('room_code')
 
-            room = Room.query.filter_by(room_code=room_code).first()
-            if room:
-                user_id = socket_user_map.get(socket_id)
-
-                # #region agent log
-                rooms_before = list(rooms(socket_id))
-                log_data = {
-                    "timestamp": datetime.now().isoformat(),
-                    "event": "leave_room",
-                    "socket_id": socket_id,
-                    "user_id": user_id,
-                    "room_code": room_code,
-                    "room_id": room.room_id,
-                    "rooms_before": rooms_before
-                }
-                logger.info(f"leave_room - socket_id: {socket_id}, user_id: {user_id}, room_id: {room.room_id}")
-                try:
-                    os.makedirs(os.path.dirname(log_path), exist_ok=True)
-                    with open(log_path, 'a') as f:
-                        f.write(json.dumps(log_data) + '\n')
-                except: pass
-                # #endregion
-                
-                leave_room(room.room_id)
-                #broadcast that user has left
-                emit("user_left", {"user_id": user_id}, room=room.room_id)
+            room_id = get_room_id(room_code)
+            if room_id is not None:
+                user_id = session_store.get_user(socket_id)
+                event_log.event("leave_room", socket_id=socket_id, user_id=user_id, room_id=room_id)
+
+                user_gone, room_empty = presence.leave(socket_id, room_id)
+                leave_room(room_id)
+                leave_room(live_room(room_id))
+                leave_room(batched_room(room_id))
+                #broadcast that user has left, once their last tab is gone
+                if user_gone:
+                    emit("user_left", {"user_id": user_id}, room=room_id)
+                if room_empty:
+                    broadcaster.forget(room_id)
+
+    @socketio.on('get_presence')
+    @track_event('get_presence')
+    def handle_get_presence(data):
+        socket_id = request.sid
+        room_code = data.get('room_code')
+        room_id = get_room_id(room_code)
+        # only members can see who else is in a room
+        if room_id is None or not presence.in_room(socket_id, room_id):
+            emit("error", {"message": "Room not found"})
+            return
+        users = [
+            {"user_id": user_id, "username": get_username(user_id)}
+            for user_id in presence.users_in_room(room_id)
+        ]
+        emit("presence", {"room_code": room_code, "users": users})
+
+    @socketio.on('search_messages')
+    @track_event('search_messages')
+    def handle_search_messages(data):
+        socket_id = request.sid
+        room_code = data.get('room_code')
+        query = (data.get('q') or '').strip()
+        room_id = get_room_id(room_code)
+        # only members can search a room
+        if room_id is None or not presence.in_room(socket_id, room_id):
+            emit("error", {"message": "Room not found"})
+            return
+        if not query:
+            emit("error", {"message": "Search query required"})
+            return
+        try:
+            limit = int(data.get('limit', DEFAULT_SEARCH_LIMIT))
+            offset = int(data.get('offset', 0))
+        except (TypeError, ValueError):
+            emit("error", {"message": "limit and offset must be integers"})
+            return
 
+        with current_app.app_context():
+            messages, next_offset = search_messages(room_id, query, limit=limit, offset=offset)
+        emit("search_results", {"room_code": room_code, "q": query, "messages": messages, "next_offset": next_offset})
 
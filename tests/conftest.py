@@ -0,0 +1,36 @@
+import os
+import tempfile
+
+import eventlet
+import pytest
+
+# app.py monkey-patches on import; do it before anything else so every test runs on eventlet like the server
+eventlet.monkey_patch()
+
+# app.py reads its config at import time
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/chat_test.db")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+os.environ.setdefault("LOG_PROFILE", "production")
+
+
+@pytest.fixture
+def app():
+    from app import app as flask_app
+    from models import db
+    with flask_app.app_context():
+        db.drop_all()
+        db.create_all()
+    yield flask_app
+    with flask_app.app_context():
+        db.session.remove()
+
+
+@pytest.fixture
+def room_and_user(app):
+    from models import db, Room, User
+    with app.app_context():
+        room = Room(room_code="TESTROOM")
+        user = User(username="alice", email="alice@example.invalid", oauth_provider="test", oauth_id="alice")
+        db.session.add_all([room, user])
+        db.session.commit()
+        return room.room_id, user.user_id
@@ -0,0 +1,76 @@
+import pytest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+
+import agent
+import lookup_cache
+import socket_events
+from auth_tokens import issue_token
+from models import db, Message
+from persistence import message_writer
+
+
+class FakeChatModel(GenericFakeChatModel):
+    """Streams its canned replies word by word; tools are accepted and never called."""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+class BrokenChatModel(FakeChatModel):
+
+    def _stream(self, *args, **kwargs):
+        yield from super()._stream(*args, **kwargs)
+        raise RuntimeError("model went away")
+
+
+@pytest.fixture
+def agent_room(app, room_and_user, monkeypatch):
+    from app import socketio
+    room_id, user_id = room_and_user
+    monkeypatch.setattr(socket_events, "AGENT_STREAMING", True)
+    monkeypatch.setattr(agent, "_agent_registry", {})
+    lookup_cache.room_id_cache.clear()
+    lookup_cache.username_cache.clear()
+    client = socketio.test_client(app, auth={"token": issue_token(user_id, app.config["SECRET_KEY"])[0]})
+    client.emit("join_room", {"room_code": "TESTROOM"})
+    client.get_received()
+    yield client
+    client.disconnect()
+    monkeypatch.setattr(agent, "_llm", None)
+
+
+def _ask(client, monkeypatch, llm):
+    monkeypatch.setattr(agent, "_llm", llm)
+    client.emit("send_message", {"room_code": "TESTROOM", "message": "@agent say hello"})
+    return [(event["name"], event["args"][0]) for event in client.get_received()]
+
+
+def test_reply_is_streamed_in_order_and_persisted(app, agent_room, monkeypatch):
+    events = _ask(agent_room, monkeypatch, FakeChatModel(messages=iter([AIMessage(content="hello there friend")])))
+
+    names = [name for name, _ in events]
+    assert names == ["new_message", "agent_status", "agent_status"] + ["agent_token"] * 5 + ["new_message", "agent_status"]
+    assert [payload["status"] for name, payload in events if name == "agent_status"] == ["thinking", "responding", "idle"]
+    assert "".join(payload["token"] for name, payload in events if name == "agent_token") == "hello there friend"
+    assert events[-2][1]["message"] == "hello there friend"
+    assert events[-1][1]["ttft_ms"] is not None
+
+    message_writer.flush(force=True)
+    with app.app_context():
+        contents = [m.content for m in db.session.query(Message).order_by(Message.message_id)]
+    assert contents == ["@agent say hello", "[Agent] hello there friend"]
+
+
+def test_failure_midway_emits_the_failed_status(app, agent_room, monkeypatch):
+    events = _ask(agent_room, monkeypatch, BrokenChatModel(messages=iter([AIMessage(content="partial answer")])))
+
+    statuses = [payload for name, payload in events if name == "agent_status"]
+    assert statuses[0]["status"] == "thinking"
+    assert statuses[-1] == {"status": "failed", "error": "model went away"}
+    assert ("error", {"message": "Agent error occurred"}) in events
+    assert not any(name == "new_message" and payload["user_id"] == "agent" for name, payload in events)
+
+    message_writer.flush(force=True)
+    with app.app_context():
+        assert [m.content for m in db.session.query(Message)] == ["@agent say hello"]
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+import agent_tools
+from agent_tools import cached_search, set_search_client
+
+
+class FakeSearchClient:
+    """Counts upstream calls; optionally holds them until release is set, then answers or raises."""
+
+    def __init__(self, error=None, hold=False):
+        self.calls = []
+        self.error = error
+        self.release = threading.Event()
+        if not hold:
+            self.release.set()
+
+    def search(self, query):
+        self.calls.append(query)
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return {"results": [{"title": query, "content": f"about {query}", "url": "https://example.invalid"}]}
+
+
+@pytest.fixture
+def fake_search():
+    def install(**kwargs):
+        client = FakeSearchClient(**kwargs)
+        set_search_client(client)
+        return client
+    yield install
+    set_search_client(None)
+
+
+def _search_concurrently(queries):
+    """Run cached_search for every query in its own thread. Returns (threads, results, errors) by position."""
+    results = [None] * len(queries)
+    errors = [None] * len(queries)
+
+    def run(i, query):
+        try:
+            results[i] = cached_search(query)
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, query)) for i, query in enumerate(queries)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def _wait_for_waiters(coalesced_before, waiters):
+    deadline = time.monotonic() + 5
+    while agent_tools._upstream_stats["coalesced"] - coalesced_before < waiters:
+        assert time.monotonic() < deadline, "searches never coalesced"
+        time.sleep(0.01)
+
+
+def test_repeated_query_is_served_from_the_cache(fake_search):
+    client = fake_search()
+    first = cached_search("Who won the match?")
+    # normalized: case and whitespace don't matter
+    assert cached_search("  who WON the   match? ") == first
+    assert client.calls == ["Who won the match?"]
+
+
+def test_cached_result_expires_after_the_ttl(fake_search, monkeypatch):
+    client = fake_search()
+    monkeypatch.setattr(agent_tools._search_cache, "ttl", 0.05)
+    cached_search("weather in paris")
+    time.sleep(0.1)
+    cached_search("weather in paris")
+    assert len(client.calls) == 2
+
+
+def test_concurrent_identical_queries_make_one_upstream_call(fake_search):
+    client = fake_search(hold=True)
+    coalesced_before = agent_tools._upstream_stats["coalesced"]
+    threads, results, errors = _search_concurrently(["latest python release"] * 8)
+
+    _wait_for_waiters(coalesced_before, 7)
+    client.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert client.calls == ["latest python release"]
+    assert errors == [None] * 8
+    assert all(result is results[0] for result in results)
+
+
+def test_upstream_error_is_shared_by_all_waiters(fake_search):
+    client = fake_search(error=RuntimeError("search is down"), hold=True)
+    coalesced_before = agent_tools._upstream_stats["coalesced"]
+    threads, results, errors = _search_concurrently(["flaky query"] * 5)
+
+    _wait_for_waiters(coalesced_before, 4)
+    client.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(client.calls) == 1
+    assert results == [None] * 5
+    assert all(error is errors[0] for error in errors)
+    assert str(errors[0]) == "search is down"
+
+    # errors aren't cached, the next search goes upstream again
+    client.error = None
+    assert cached_search("flaky query")["results"]
+    assert len(client.calls) == 2
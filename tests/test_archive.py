@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import orjson
+from sqlalchemy import insert
+
+import archive
+from models import db, Message
+
+
+def test_archive_cli_reports_totals_and_reads_back(app, room_and_user, tmp_path, monkeypatch):
+    room_id, user_id = room_and_user
+    archive.set_segment_store(archive.LocalSegmentStore(str(tmp_path)))
+    start = datetime.utcnow() - timedelta(days=200)
+    with app.app_context():
+        db.session.execute(insert(Message), [
+            {"content": f"old {i}", "timestamp": start + timedelta(minutes=i), "user_id": user_id, "room_id": room_id}
+            for i in range(30)
+        ])
+        db.session.commit()
+
+    result = app.test_cli_runner().invoke(args=["archive-messages", "--segment-rows", "10"])
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == "archived 30 messages from 1 rooms"
+
+    # the decoded segment cache is sized in messages
+    monkeypatch.setattr(archive._segment_cache, "maxsize", 20)
+    with app.app_context():
+        page = archive.read_archived(room_id, 25)
+    assert [m["content"] for m in page] == [f"old {i}" for i in range(29, 4, -1)]
+    assert archive._segment_cache.stats()["weight"] <= 20
+    archive.set_segment_store(None)
+
+
+def test_export_with_an_offset_since_covers_both_tiers(app, room_and_user, tmp_path, monkeypatch):
+    room_id, user_id = room_and_user
+    monkeypatch.setenv("EXPORT_TOKEN", "export-secret")
+    archive.set_segment_store(archive.LocalSegmentStore(str(tmp_path)))
+    start = datetime(2024, 1, 1, 12, 0)
+    with app.app_context():
+        db.session.execute(insert(Message), [
+            {"content": f"old {i}", "timestamp": start + timedelta(hours=i), "user_id": user_id, "room_id": room_id}
+            for i in range(6)
+        ])
+        db.session.execute(insert(Message), [
+            {"content": "hot", "timestamp": datetime.utcnow(), "user_id": user_id, "room_id": room_id}
+        ])
+        db.session.commit()
+        archive.archive_cold_messages(older_than_days=30)
+
+    # 14:00 at +02:00 is 12:00 UTC; the segment straddles it
+    response = app.test_client().get(
+        "/export_room", query_string={"room_code": "TESTROOM", "since": "2024-01-01T14:30:00+02:00"},
+        headers={"Authorization": "Bearer export-secret"},
+    )
+    lines = [orjson.loads(line) for line in response.get_data().splitlines()]
+    assert response.status_code == 200
+    assert [line["content"] for line in lines] == ["old 1", "old 2", "old 3", "old 4", "old 5", "hot"]
+    archive.set_segment_store(None)
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+
+import auth_tokens
+from auth_tokens import issue_token, verify_token, token_cache_stats, TOKEN_TTL, EXPIRY_JITTER
+
+SECRET = "test-secret"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    auth_tokens._verified_tokens.clear()
+    yield
+    auth_tokens._verified_tokens.clear()
+
+
+def _expires_in_range(expires_in):
+    return TOKEN_TTL <= expires_in <= TOKEN_TTL * (1 + EXPIRY_JITTER)
+
+
+def test_second_verify_is_a_cache_hit(monkeypatch):
+    token, _ = issue_token(7, SECRET)
+    before = token_cache_stats()
+    assert verify_token(token, SECRET)["user_id"] == 7
+
+    # a hit never reaches jwt.decode
+    monkeypatch.setattr(jwt, "decode", lambda *args, **kwargs: pytest.fail("decoded a cached token"))
+    assert verify_token(token, SECRET)["user_id"] == 7
+    after = token_cache_stats()
+    assert after["misses"] == before["misses"] + 1
+    assert after["hits"] == before["hits"] + 1
+
+
+def test_expired_token_is_rejected_while_still_cached(monkeypatch):
+    token, expires_in = issue_token(7, SECRET)
+    verify_token(token, SECRET)
+
+    later = datetime.now(timezone.utc) + timedelta(seconds=expires_in + 1)
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return later
+
+    monkeypatch.setattr(auth_tokens, "datetime", Clock)
+    # well inside the cache ttl, but past exp
+    with pytest.raises(jwt.ExpiredSignatureError):
+        verify_token(token, SECRET)
+    assert len(auth_tokens._verified_tokens) == 0
+
+
+def test_expiry_is_jittered():
+    expiries = {issue_token(7, SECRET)[1] for _ in range(50)}
+    assert all(_expires_in_range(expires_in) for expires_in in expiries)
+    assert len(expiries) > 1
+
+
+def test_refresh_token_event_issues_a_new_token(app, room_and_user):
+    from app import socketio
+    _, user_id = room_and_user
+    client = socketio.test_client(app, auth={"token": issue_token(user_id, app.config["SECRET_KEY"])[0]})
+    client.emit("refresh_token", {})
+    events = client.get_received()
+    client.disconnect()
+
+    assert [event["name"] for event in events] == ["token_refreshed"]
+    reply = events[0]["args"][0]
+    assert verify_token(reply["token"], app.config["SECRET_KEY"])["user_id"] == user_id
+    assert _expires_in_range(reply["expires_in"])
+    assert reply["expires_in"] * 0.5 - 1 <= reply["refresh_in"] <= reply["expires_in"] * 0.8
+
@@ -0,0 +1,62 @@
+import lookup_cache
+from auth_tokens import issue_token
+from broadcast import RoomBroadcaster, live_room, batched_room
+
+
+class RecordingSocketIO:
+    """Stands in for SocketIO: records emits, never runs the background flush."""
+
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, payload, room=None):
+        self.emitted.append((event, room))
+
+    def start_background_task(self, target, *args):
+        pass
+
+
+def _hot_broadcaster():
+    socketio = RecordingSocketIO()
+    broadcaster = RoomBroadcaster(socketio, window_ms=100, rate_threshold=1)
+    broadcaster.publish(1, {"message": "warm up"})
+    broadcaster._rooms[1].hot = True
+    socketio.emitted.clear()
+    return broadcaster, socketio
+
+
+def test_agent_events_go_out_after_the_pending_batch():
+    broadcaster, socketio = _hot_broadcaster()
+    broadcaster.publish(1, {"message": "@agent what time is it?"})
+    broadcaster.emit(1, "agent_status", {"status": "thinking"})
+
+    assert socketio.emitted == [
+        ("new_message", live_room(1)),
+        ("new_messages", batched_room(1)),
+        ("agent_status", 1),
+    ]
+    # the scheduled flush has nothing left to send
+    broadcaster.emit(1, "agent_status", {"status": "idle"})
+    assert socketio.emitted[-1] == ("agent_status", 1)
+    assert broadcaster.messages_batched == 1
+
+
+def test_rejoin_switches_sub_rooms(app, room_and_user):
+    from app import socketio
+    room_id, user_id = room_and_user
+    lookup_cache.room_id_cache.clear()
+    client = socketio.test_client(app, auth={"token": issue_token(user_id, app.config["SECRET_KEY"])[0]})
+    sid = client.eio_sid
+    rooms = socketio.server.manager
+
+    def sub_rooms():
+        socket_sid = rooms.sid_from_eio_sid(sid, "/")
+        return {room for room in rooms.get_rooms(socket_sid, "/") if room in (live_room(room_id), batched_room(room_id))}
+
+    client.emit("join_room", {"room_code": "TESTROOM"})
+    assert sub_rooms() == {live_room(room_id)}
+    client.emit("join_room", {"room_code": "TESTROOM", "batching": True})
+    assert sub_rooms() == {batched_room(room_id)}
+    client.emit("join_room", {"room_code": "TESTROOM"})
+    assert sub_rooms() == {live_room(room_id)}
+    client.disconnect()
@@ -0,0 +1,49 @@
+import logging
+
+import orjson
+import pytest
+
+from event_log import EventLog
+
+
+def test_production_is_the_default_profile(monkeypatch):
+    monkeypatch.delenv("LOG_PROFILE", raising=False)
+    monkeypatch.delenv("RENDER", raising=False)
+    log = EventLog(flush_interval=60)
+    assert log.profile == "production"
+    assert not log.socketio_logger
+    assert log.path is None
+
+
+def test_debug_is_opt_in(monkeypatch):
+    monkeypatch.setenv("LOG_PROFILE", "debug")
+    log = EventLog(flush_interval=60)
+    assert log.profile == "debug"
+    assert log.socketio_logger
+
+
+def test_sample_rates_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("EVENT_LOG_SAMPLE_RATES", "send_message=0.001, join_room=0.1")
+    log = EventLog(flush_interval=60)
+    assert log.sample_rates == {"send_message": 0.001, "join_room": 0.1}
+    # explicit overrides win
+    assert EventLog(flush_interval=60, sample_rates={}).sample_rates == {}
+
+    monkeypatch.setenv("EVENT_LOG_SAMPLE_RATES", "send_message")
+    with pytest.raises(ValueError):
+        EventLog(flush_interval=60)
+
+
+def test_sampled_out_events_are_dropped(tmp_path, monkeypatch):
+    monkeypatch.setenv("EVENT_LOG_SAMPLE_RATES", "send_message=0")
+    path = tmp_path / "events.log"
+    log = EventLog(profile="debug", flush_interval=60, path=str(path))
+    for _ in range(100):
+        log.event("send_message", room_id=1)
+    log.event("send_message", logging.WARNING, room_id=1)
+    log.event("join_room", room_id=1)
+
+    assert log.sampled_out == 100
+    log.stop()
+    assert [orjson.loads(line)["event"] for line in path.read_bytes().splitlines()] == ["send_message", "join_room"]
+    assert orjson.loads(path.read_bytes().splitlines()[0])["level"] == "WARNING"
@@ -0,0 +1,53 @@
+import time
+
+import history_cache
+import lookup_cache
+from persistence import enqueue_message, message_writer
+
+
+def _get(client, **headers):
+    return client.get("/get_previous_messages?room_code=TESTROOM", headers=headers)
+
+
+def test_revalidation_with_etag(app, room_and_user):
+    room_id, user_id = room_and_user
+    lookup_cache.room_id_cache.clear()
+    client = app.test_client()
+
+    first = _get(client)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert _get(client, **{"If-None-Match": etag}).status_code == 304
+
+    # the writer flush bumps the room's version
+    with app.app_context():
+        enqueue_message(user_id, room_id, "hello")
+    message_writer.flush(force=True)
+
+    changed = _get(client, **{"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert [m["content"] for m in changed.get_json()["messages"]] == ["hello"]
+    assert _get(client, **{"If-None-Match": changed.headers["ETag"]}).status_code == 304
+
+
+def test_revalidation_with_if_modified_since(app, room_and_user, monkeypatch):
+    room_id, user_id = room_and_user
+    lookup_cache.room_id_cache.clear()
+    monkeypatch.setattr(history_cache, "room_versions", history_cache.MemoryRoomVersions())
+    client = app.test_client()
+
+    # no Last-Modified while the room changed within the current second
+    assert "Last-Modified" not in _get(client).headers
+
+    history_cache.room_versions._versions[room_id] = (1, time.time() - 10)
+    last_modified = _get(client).headers["Last-Modified"]
+    assert _get(client, **{"If-Modified-Since": last_modified}).status_code == 304
+    # If-None-Match takes precedence
+    assert _get(client, **{"If-Modified-Since": last_modified, "If-None-Match": '"stale"'}).status_code == 200
+
+    with app.app_context():
+        enqueue_message(user_id, room_id, "hello")
+    message_writer.flush(force=True)
+    time.sleep(1)
+    assert _get(client, **{"If-Modified-Since": last_modified}).status_code == 200
@@ -0,0 +1,23 @@
+from lookup_cache import TTLCache
+
+
+def test_weighted_cache_caps_total_weight():
+    cache = TTLCache(maxsize=10, ttl=60, weigh=len)
+    cache.set("a", "xxxx")
+    cache.set("b", "xxxx")
+    cache.set("c", "xxxx")
+    # 12 > 10: the least recently used entry goes
+    assert cache.get("a") is None
+    assert cache.stats()["weight"] == 8
+
+    cache.set("b", "x")
+    assert cache.stats()["weight"] == 5
+    cache.invalidate("c")
+    assert cache.stats()["weight"] == 1
+
+
+def test_value_heavier_than_the_cache_is_not_kept():
+    cache = TTLCache(maxsize=10, ttl=60, weigh=len)
+    cache.set("big", "x" * 11)
+    assert cache.get("big") is None
+    assert len(cache) == 0 and cache.stats()["weight"] == 0
@@ -0,0 +1,44 @@
+import numpy as np
+
+from message_index import HashEmbedder, RoomVectorIndex
+
+
+def _vectors(n, dim):
+    return np.ones((n, dim), dtype=np.float32)
+
+
+def _loaded(app, index, room_ids, embedder):
+    # nothing stored yet, so a search just marks the rooms loaded
+    with app.app_context():
+        for room_id in room_ids:
+            index.search(room_id, embedder.embed(["hi"]), 1, embedder=embedder)
+
+
+def test_rooms_are_evicted_to_stay_within_the_byte_budget(app):
+    embedder = HashEmbedder(dim=256)
+    room_bytes = 100 * (256 * 4 + 8)
+    index = RoomVectorIndex(max_bytes=int(room_bytes * 2.5), per_room=100)
+    _loaded(app, index, [1, 2, 3], embedder)
+    for room_id in (1, 2, 3):
+        index.add(room_id, np.arange(100), _vectors(100, 256))
+
+    stats = index.stats()
+    assert stats["bytes"] <= index.max_bytes
+    assert stats["rooms"] == 2
+    assert stats["evictions"] == 1
+
+
+def test_per_room_cap_shrinks_with_the_embedding_dim(app):
+    budget = 2**20
+    small, large = HashEmbedder(dim=32), HashEmbedder(dim=1536)
+    index = RoomVectorIndex(max_bytes=budget, per_room=10000)
+    _loaded(app, index, [1], small)
+    index.add(1, np.arange(5000), _vectors(5000, 32))
+    assert index.stats()["vectors"] == 5000
+
+    index = RoomVectorIndex(max_bytes=budget, per_room=10000)
+    _loaded(app, index, [1], large)
+    index.add(1, np.arange(5000), _vectors(5000, 1536))
+    # 1 MiB holds 170 vectors of 1536 float32s
+    assert index.stats()["vectors"] == budget // (1536 * 4 + 8)
+    assert index.stats()["bytes"] <= budget
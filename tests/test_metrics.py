@@ -0,0 +1,35 @@
+import metrics
+from auth_tokens import issue_token
+
+
+def _disconnect_counts():
+    errors = metrics.socket_event_errors._values.get(("disconnect",), 0)
+    series = metrics.socket_event_seconds._series.get(("disconnect",))
+    return errors, series[-1] if series else 0
+
+
+def test_disconnect_is_recorded_once_without_errors(app, room_and_user):
+    from app import socketio
+    _, user_id = room_and_user
+    errors_before, count_before = _disconnect_counts()
+    for _ in range(2):
+        client = socketio.test_client(app, auth={"token": issue_token(user_id, app.config["SECRET_KEY"])[0]})
+        assert client.is_connected()
+        client.disconnect()
+
+    errors, count = _disconnect_counts()
+    assert errors == errors_before
+    assert count == count_before + 2
+
+
+def test_metrics_needs_the_bearer_token(app, monkeypatch):
+    client = app.test_client()
+    monkeypatch.delenv("METRICS_TOKEN", raising=False)
+    assert client.get("/metrics", headers={"Authorization": "Bearer "}).status_code == 401
+
+    monkeypatch.setenv("METRICS_TOKEN", "scrape-me")
+    assert client.get("/metrics").status_code == 401
+    assert client.get("/metrics", headers={"Authorization": "Bearer wrong"}).status_code == 401
+    response = client.get("/metrics", headers={"Authorization": "Bearer scrape-me"})
+    assert response.status_code == 200
+    assert b"chat_socket_event_seconds" in response.data
@@ -0,0 +1,128 @@
+import time
+from datetime import datetime
+
+import pytest
+from sqlalchemy.exc import OperationalError
+
+import persistence
+from models import db, Message
+from persistence import BatchWriter
+
+
+def _message(room_id, user_id, i, content=None):
+    return {"user_id": user_id, "room_id": room_id, "content": content or f"message {i}",
+            "image_url": None, "timestamp": datetime.utcnow()}
+
+
+@pytest.fixture
+def make_writer(app):
+    """BatchWriter factory; every writer's background thread is stopped after the test, pass or fail."""
+    writers = []
+
+    def make(flush_rows, **kwargs):
+        writer = BatchWriter("test", flush_rows, batch_size=100, flush_interval=0.01,
+                             retry_delay=0.02, max_retry_delay=0.2, **kwargs)
+        writer.init_app(app)
+        writers.append(writer)
+        return writer
+
+    yield make
+    for writer in writers:
+        # whatever an outage test left queued would only fail again
+        writer._queue.clear()
+        writer.stop()
+
+
+def _drain(writer, timeout=5):
+    deadline = time.monotonic() + timeout
+    while writer.stats()["queue_depth"] and time.monotonic() < deadline:
+        writer.flush()
+        time.sleep(0.01)
+
+
+def test_outage_keeps_rows_queued_until_the_database_is_back(app, room_and_user, make_writer):
+    room_id, user_id = room_and_user
+    outage_ends = time.monotonic() + 1.0
+
+    def flaky_insert(rows):
+        if time.monotonic() < outage_ends:
+            raise OperationalError("INSERT", {}, Exception("connection refused"))
+        persistence._insert_messages(rows)
+
+    writer = make_writer(flaky_insert, max_queue=1000)
+    for i in range(500):
+        writer.enqueue(_message(room_id, user_id, i))
+    _drain(writer)
+
+    stats = writer.stats()
+    assert stats["failed"] == 0 and stats["dropped"] == 0
+    assert stats["written"] == 500
+    assert stats["retries"] > 1
+    with app.app_context():
+        assert db.session.query(Message).count() == 500
+
+
+def test_backoff_grows_between_attempts(app, make_writer):
+    attempts = []
+
+    def down(rows):
+        attempts.append(time.monotonic())
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    writer = make_writer(down)
+    writer.enqueue({"n": 1})
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        writer.flush()
+        time.sleep(0.005)
+
+    gaps = [b - a for a, b in zip(attempts, attempts[1:])]
+    assert len(attempts) >= 3
+    assert gaps[-1] > gaps[0]
+    assert writer.stats()["queue_depth"] == 1
+
+
+def test_bad_row_is_dropped_alone(app, room_and_user, make_writer):
+    room_id, user_id = room_and_user
+    writer = make_writer(persistence._insert_messages)
+    rows = [_message(room_id, user_id, i) for i in range(100)]
+    # content is NOT NULL
+    rows[37]["content"] = None
+    for row in rows:
+        writer.enqueue(row)
+    _drain(writer)
+
+    stats = writer.stats()
+    assert stats["failed"] == 1
+    assert stats["written"] == 99
+    with app.app_context():
+        assert db.session.query(Message).count() == 99
+
+
+def test_full_queue_during_outage_drops_oldest(app, make_writer):
+    def down(rows):
+        raise OperationalError("INSERT", {}, Exception("connection refused"))
+
+    writer = make_writer(down, max_queue=10, overflow="flush")
+    for i in range(15):
+        writer.enqueue({"n": i})
+
+    stats = writer.stats()
+    assert stats["queue_depth"] == 10
+    assert stats["dropped"] == 5
+    assert stats["failed"] == 0
+
+
+def test_written_hooks_get_ids_without_ordered_returning(app, room_and_user, monkeypatch):
+    room_id, user_id = room_and_user
+    written = []
+    monkeypatch.setattr(persistence, "_written_hooks", [written.extend])
+    rows = [_message(room_id, user_id, i) for i in range(5)]
+    with app.app_context():
+        # what MySQL reports: no ordered RETURNING for executemany
+        monkeypatch.setattr(db.engine.dialect, "insert_executemany_returning_sort_by_parameter_order", False)
+        persistence._insert_messages(rows)
+        stored = dict(db.session.query(Message.message_id, Message.content).all())
+
+    assert [row["content"] for row in written] == [f"message {i}" for i in range(5)]
+    assert all(stored[row["message_id"]] == row["content"] for row in written)
@@ -0,0 +1,77 @@
+import pytest
+
+from presence import PresenceIndex
+
+
+@pytest.fixture
+def index():
+    index = PresenceIndex(max_rooms_per_socket=2)
+    index.connect("tab1", "alice")
+    index.connect("tab2", "alice")
+    index.connect("bob1", "bob")
+    return index
+
+
+def test_join_is_deduped_per_user(index):
+    assert index.join("tab1", 1) is True
+    # alice's second tab and a repeated join don't make her join again
+    assert index.join("tab2", 1) is False
+    assert index.join("tab1", 1) is False
+    assert index.join("bob1", 1) is True
+
+    assert sorted(index.users_in_room(1)) == ["alice", "bob"]
+    assert index.in_room("tab2", 1) and index.user_in_room("alice", 1)
+    assert index.stats() == {"sockets": 3, "users": 2, "rooms": 1}
+
+
+def test_join_rejects_unknown_sockets_and_too_many_rooms(index):
+    with pytest.raises(ValueError):
+        index.join("nobody", 1)
+    index.join("tab1", 1)
+    index.join("tab1", 2)
+    with pytest.raises(ValueError):
+        index.join("tab1", 3)
+    assert not index.in_room("tab1", 3)
+
+
+def test_leave_reports_the_last_socket_and_empty_room(index):
+    index.join("tab1", 1)
+    index.join("tab2", 1)
+    index.join("bob1", 1)
+
+    assert index.leave("tab1", 1) == (False, False)
+    assert index.leave("tab2", 1) == (True, False)
+    assert index.users_in_room(1) == ["bob"]
+    assert index.leave("bob1", 1) == (True, True)
+    # leaving a room the socket isn't in is a no-op
+    assert index.leave("bob1", 1) == (False, False)
+    assert index.room_count() == 0
+
+
+def test_switching_rooms(index):
+    index.join("tab1", 1)
+    assert index.leave("tab1", 1) == (True, True)
+    assert index.join("tab1", 2) is True
+
+    assert not index.in_room("tab1", 1) and index.in_room("tab1", 2)
+    assert index.users_in_room(1) == [] and index.users_in_room(2) == ["alice"]
+    # the freed slot counts toward the room limit again
+    index.join("tab1", 3)
+    assert index.stats()["rooms"] == 2
+
+
+def test_disconnect_cleans_up_every_room(index):
+    index.join("tab1", 1)
+    index.join("tab1", 2)
+    index.join("tab2", 1)
+    index.join("bob1", 2)
+
+    assert index.disconnect("tab1") == ("alice", [2], [])
+    assert index.is_online("alice") and index.users_in_room(2) == ["bob"]
+    assert index.disconnect("tab2") == ("alice", [1], [1])
+    assert index.disconnect("bob1") == ("bob", [2], [2])
+    assert not index.is_online("alice")
+    assert index.disconnect("tab1") == (None, [], [])
+
+    assert index.stats() == {"sockets": 0, "users": 0, "rooms": 0}
+    assert index._socket_rooms == {} and index._room_users == {}
@@ -0,0 +1,69 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from agent import build_agent_messages
+from models import db, Message
+from room_context import RoomContextBuffer
+import room_context
+
+
+@pytest.fixture
+def buffer(monkeypatch):
+    # build_agent_messages reads the module singleton
+    fresh = RoomContextBuffer(max_rooms=10, per_room=20)
+    monkeypatch.setattr(room_context, "room_context", fresh)
+    monkeypatch.setattr("agent.room_context", fresh)
+    return fresh
+
+
+def _store(room_id, user_id, content, timestamp):
+    db.session.add(Message(room_id=room_id, user_id=user_id, content=content, timestamp=timestamp))
+    db.session.commit()
+
+
+def test_agent_question_is_not_in_its_own_history(app, room_and_user, buffer):
+    room_id, user_id = room_and_user
+    with app.app_context():
+        _store(room_id, user_id, "lunch at noon?", datetime.utcnow() - timedelta(minutes=1))
+        # send_message appends the question before calling the agent
+        sent_at = datetime.utcnow()
+        buffer.append(room_id, user_id, "alice", "@agent where should we eat?", timestamp=sent_at)
+
+        messages = build_agent_messages("where should we eat?", room_id, before=sent_at)
+
+    contents = [m.content for m in messages if isinstance(m, HumanMessage)]
+    assert contents == ["User: alice: lunch at noon?", "where should we eat?"]
+
+
+def test_stale_room_is_rehydrated_with_other_workers_messages(app, room_and_user):
+    room_id, user_id = room_and_user
+    buffer = RoomContextBuffer(max_rooms=10, per_room=20, ttl=0.05)
+    start = datetime.utcnow() - timedelta(minutes=5)
+    with app.app_context():
+        _store(room_id, user_id, "first", start)
+        assert [e["content"] for e in buffer.recent(room_id, 10)] == ["first"]
+
+        # another worker's message reaches the db; a local one is still in the write-behind queue
+        _store(room_id, user_id, "from another worker", start + timedelta(minutes=1))
+        buffer.append(room_id, user_id, "alice", "local, not flushed yet", timestamp=start + timedelta(minutes=2))
+        assert [e["content"] for e in buffer.recent(room_id, 10)] == ["first", "local, not flushed yet"]
+
+        time.sleep(0.1)
+        assert [e["content"] for e in buffer.recent(room_id, 10)] == \
+            ["first", "from another worker", "local, not flushed yet"]
+        assert buffer.hydrations == 2
+
+
+def test_rehydration_does_not_duplicate_flushed_messages(app, room_and_user):
+    room_id, user_id = room_and_user
+    buffer = RoomContextBuffer(max_rooms=10, per_room=20, ttl=0.05)
+    sent_at = datetime.utcnow()
+    with app.app_context():
+        buffer.append(room_id, user_id, "alice", "hello", timestamp=sent_at)
+        _store(room_id, user_id, "hello", sent_at)
+        buffer.recent(room_id, 10)
+        time.sleep(0.1)
+        assert [e["content"] for e in buffer.recent(room_id, 10)] == ["hello"]
@@ -0,0 +1,125 @@
+import json
+
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+from sqlalchemy.exc import OperationalError
+
+import room_memory
+from models import db, Room, RoomMemory
+from persistence import BatchWriter, RetryLater
+from room_memory import parse_memories
+
+
+def stub_llm(replies):
+    """An llm that answers from replies[first word of the last message] (a list of memories or an exception)."""
+    calls = []
+
+    def answer(prompt):
+        text = prompt.to_string()
+        calls.append(text)
+        last_line = text.strip().splitlines()[-1]
+        reply = replies[last_line.split(": ", 1)[1].split()[0]]
+        if isinstance(reply, Exception):
+            raise reply
+        return AIMessage(content=json.dumps(reply))
+
+    llm = RunnableLambda(answer)
+    llm.calls = calls
+    return llm
+
+
+@pytest.fixture
+def rooms(app, room_and_user):
+    room_id, _ = room_and_user
+    with app.app_context():
+        other = Room(room_code="OTHER001")
+        db.session.add(other)
+        db.session.commit()
+        other_id = other.room_id
+    yield room_id, other_id
+    room_memory.set_memory_llm(None)
+    room_memory._memory_cache.clear()
+
+
+def _row(room_id, content):
+    return {"room_id": room_id, "username": "alice", "content": content}
+
+
+def _memories(app, room_id):
+    with app.app_context():
+        return {m.key: m.value for m in RoomMemory.query.filter_by(room_id=room_id)}
+
+
+def test_parse_memories_skips_malformed_entries():
+    reply = '```json\n[{"type": "decision", "key": "  Launch  DATE ", "value": " May 1 "},' \
+            ' {"type": "joke", "key": "x", "value": "y"}, {"type": "fact", "key": "", "value": "z"}, "nope"]\n```'
+    assert parse_memories(reply) == [{"type": "decision", "key": "launch date", "value": "May 1"}]
+    assert parse_memories("not json") == []
+    assert parse_memories("null") == []
+
+
+def test_memories_are_upserted_by_key(app, rooms):
+    room_id, _ = rooms
+    room_memory.set_memory_llm(stub_llm({
+        "launch": [{"type": "decision", "key": "Launch date", "value": "May 1"}],
+        "moved": [{"type": "decision", "key": "launch date", "value": "June 3"}],
+    }))
+    with app.app_context():
+        room_memory._extract_batch([_row(room_id, "launch is on May 1")])
+        assert room_memory.get_room_memories(room_id)[0]["value"] == "May 1"
+        room_memory._extract_batch([_row(room_id, "moved the launch to June 3")])
+        # the write dropped the cached memory set
+        assert room_memory.get_room_memories(room_id)[0]["value"] == "June 3"
+    assert _memories(app, room_id) == {"launch date": "June 3"}
+
+
+def test_failing_room_does_not_sink_the_batch(app, rooms):
+    room_id, other_id = rooms
+    room_memory.set_memory_llm(stub_llm({
+        "broken": ValueError("model returned garbage"),
+        "budget": [{"type": "constraint", "key": "budget", "value": "$500"}],
+    }))
+    failed_before = room_memory.extraction_stats["failed"]
+    with app.app_context():
+        room_memory._extract_batch([_row(room_id, "broken message"), _row(other_id, "budget is $500")])
+
+    assert _memories(app, room_id) == {}
+    assert _memories(app, other_id) == {"budget": "$500"}
+    assert room_memory.extraction_stats["failed"] == failed_before + 1
+
+
+def test_transient_error_retries_only_the_rooms_not_done(app, rooms):
+    room_id, other_id = rooms
+    outage = OperationalError("SELECT", {}, Exception("connection refused"))
+    llm = stub_llm({
+        "goal": [{"type": "goal", "key": "ship v2", "value": "by Q3"}],
+        "later": outage,
+    })
+    room_memory.set_memory_llm(llm)
+    rows = [_row(room_id, "goal is to ship v2 by Q3"), _row(other_id, "later we decide")]
+    with app.app_context():
+        with pytest.raises(RetryLater) as raised:
+            room_memory._extract_batch(rows)
+    assert raised.value.rows == [rows[1]]
+    assert _memories(app, room_id) == {"ship v2": "by Q3"}
+
+    # through the writer: the retried batch only makes the second room's call again
+    writer = BatchWriter("memory-test", room_memory._extract_batch, flush_interval=60,
+                         retry_delay=0.01, transient_errors=room_memory.MEMORY_TRANSIENT_ERRORS,
+                         split_failed_batches=False)
+    writer.init_app(app)
+    try:
+        for row in rows:
+            writer.enqueue(row)
+        llm.calls.clear()
+        writer.flush()
+        assert len(llm.calls) == 2
+        assert writer.stats()["queue_depth"] == 1
+        assert writer.stats()["written"] == 1
+        writer.flush(force=True)
+        assert len(llm.calls) == 3
+        assert writer.stats()["queue_depth"] == 1
+    finally:
+        writer._queue.clear()
+        writer.stop()
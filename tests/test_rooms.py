@@ -0,0 +1,36 @@
+from sqlalchemy import event
+
+import rooms
+from models import db, Room
+
+
+def test_create_room_route_only_inserts(app):
+    client = app.test_client()
+    # the first request refills the code pool
+    assert client.post("/create_room").status_code == 200
+
+    statements = []
+
+    def record(conn, cursor, statement, *args):
+        statements.append(statement.split(None, 1)[0].upper())
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", record)
+    try:
+        response = client.post("/create_room")
+    finally:
+        event.remove(engine, "before_cursor_execute", record)
+
+    assert response.status_code == 200
+    assert statements == ["INSERT"]
+    with app.app_context():
+        assert db.session.query(Room).filter_by(room_code=response.get_json()["room_code"]).count() == 1
+
+
+def test_create_room_retries_a_taken_code(app, monkeypatch):
+    with app.app_context():
+        taken = rooms.create_room()
+        codes = iter([taken, "FRESH001"])
+        monkeypatch.setattr(rooms.code_pool, "take", lambda: next(codes))
+        assert rooms.create_room() == "FRESH001"
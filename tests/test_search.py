@@ -0,0 +1,38 @@
+from sqlalchemy import text
+
+from auth_tokens import issue_token
+from models import db, Message, User, UserRoom
+from search import ensure_search_index
+
+
+def _search(client, app, user_id=None):
+    headers = {}
+    if user_id is not None:
+        headers["Authorization"] = f"Bearer {issue_token(user_id, app.config['SECRET_KEY'])[0]}"
+    return client.get("/search_messages?room_code=TESTROOM&q=hello", headers=headers)
+
+
+def test_search_requires_a_token(app, room_and_user):
+    response = app.test_client().get("/search_messages?room_code=TESTROOM&q=hello",
+                                     headers={"Authorization": "Bearer not-a-jwt"})
+    assert response.status_code == 401
+    assert _search(app.test_client(), app).status_code == 401
+
+
+def test_only_members_can_search_a_room(app, room_and_user):
+    room_id, user_id = room_and_user
+    with app.app_context():
+        outsider = User(username="mallory", email="mallory@example.invalid", oauth_provider="test", oauth_id="mallory")
+        # drop_all leaves the fts table behind
+        db.session.execute(text("DROP TABLE IF EXISTS messages_fts"))
+        ensure_search_index()
+        db.session.add_all([outsider, UserRoom(user_id=user_id, room_id=room_id),
+                            Message(room_id=room_id, user_id=user_id, content="hello there")])
+        db.session.commit()
+        outsider_id = outsider.user_id
+
+    client = app.test_client()
+    assert _search(client, app, outsider_id).status_code == 404
+    response = _search(client, app, user_id)
+    assert response.status_code == 200
+    assert [m["content"] for m in response.get_json()["messages"]] == ["hello there"]
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import eventlet
+import fakeredis
+import pytest
+import redis
+import socketio as socketio_client
+from flask import Flask
+from flask_socketio import SocketIO, join_room
+
+from session_store import RedisSessionStore
+
+QUEUE_URL = "redis://message-queue.test:6379/0"
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    # every client built from a url in this test talks to the same in-memory server
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis, "Redis", lambda *args, **kwargs: fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(redis.Redis, "from_url", lambda url, **kwargs: fakeredis.FakeRedis(server=server),
+                        raising=False)
+    return fakeredis.FakeRedis(server=server)
+
+
+def _worker(name):
+    """
+    One server process: its own Flask app and SocketIO on its own port, sharing the redis message queue.
+    (the Flask-SocketIO test client refuses to run with a message queue, so this serves real http.)
+    """
+    app = Flask(name)
+    app.config["SECRET_KEY"] = "test-secret"
+    socketio = SocketIO(app, message_queue=QUEUE_URL, async_mode="eventlet")
+
+    @socketio.on("join_room")
+    def handle_join(data):
+        join_room(data["room_id"])
+        return "joined"
+
+    listener = eventlet.listen(("127.0.0.1", 0))
+    server = eventlet.spawn(eventlet.wsgi.server, listener, app, log_output=False)
+    return app, socketio, server, f"http://127.0.0.1:{listener.getsockname()[1]}"
+
+
+def test_emit_from_one_worker_reaches_a_client_of_another(fake_redis):
+    app_a, socketio_a, server_a, _ = _worker("worker_a")
+    _, _, server_b, url_b = _worker("worker_b")
+    received = threading.Event()
+    messages = []
+
+    client = socketio_client.Client()
+
+    @client.on("new_message")
+    def on_new_message(data):
+        messages.append(data)
+        received.set()
+
+    try:
+        client.connect(url_b, transports=["polling"])
+        assert client.call("join_room", {"room_id": 7}, timeout=5) == "joined"
+
+        with app_a.app_context():
+            socketio_a.emit("new_message", {"message": "hello from a"}, to=7)
+
+        assert received.wait(5)
+        assert messages == [{"message": "hello from a"}]
+    finally:
+        client.disconnect()
+        server_a.kill()
+        server_b.kill()
+
+
+def test_sessions_are_shared_and_counted_across_workers(fake_redis):
+    store_a = RedisSessionStore(client=fake_redis, worker_id="a", heartbeat=False)
+    store_b = RedisSessionStore(client=fake_redis, worker_id="b", heartbeat=False)
+    store_a.set_user("sid-1", 1)
+    store_b.set_user("sid-2", 2)
+    store_b.set_user("sid-3", 2)
+
+    assert store_a.get_user("sid-1") == 1
+    assert store_a.count() == store_b.count() == 3
+    assert store_b.remove("sid-3") == 2
+    assert store_a.count() == 2
+
+
+def test_crashed_worker_sockets_are_pruned(fake_redis):
+    crashed = RedisSessionStore(client=fake_redis, worker_id="crashed", worker_ttl=1, heartbeat=False)
+    crashed.set_user("sid-1", 1)
+    crashed.set_user("sid-2", 2)
+    alive = RedisSessionStore(client=fake_redis, worker_id="alive", worker_ttl=1, heartbeat=False)
+    alive.set_user("sid-3", 3)
+    assert alive.count() == 3
+
+    # the crashed worker stops heartbeating; the live one keeps going
+    for _ in range(3):
+        time.sleep(0.4)
+        alive.heartbeat()
+    assert alive.count() == 1
+    assert not fake_redis.exists("chat:socket_users:crashed")
+
+    # a worker starting up cleans up too
+    crashed.set_user("sid-4", 4)
+    fake_redis.zadd("chat:session_workers", {"crashed": time.time() - 5})
+    RedisSessionStore(client=fake_redis, worker_id="restarted", worker_ttl=1, heartbeat=False)
+    assert not fake_redis.exists("chat:socket_users:crashed")
@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, insert
+
+import lookup_cache
+import room_context
+from auth_tokens import issue_token
+from models import db, Message, Room, User
+
+
+class StatementCounter:
+    """Counts SQL statements issued from the test's own thread (not the background writers)."""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+        self._thread = threading.get_ident()
+
+    def _on_execute(self, *args):
+        if threading.get_ident() == self._thread:
+            self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def _seed_history(app, room_id, user_id, count):
+    start = datetime.utcnow() - timedelta(days=1)
+    with app.app_context():
+        db.session.execute(insert(Message), [
+            {"content": f"old message {i}", "timestamp": start + timedelta(seconds=i), "user_id": user_id, "room_id": room_id}
+            for i in range(count)
+        ])
+        db.session.commit()
+
+
+def _statements_per_event(app, room_id, user_id):
+    from app import socketio
+    lookup_cache.room_id_cache.clear()
+    lookup_cache.username_cache.clear()
+    room_context.room_context.invalidate(room_id)
+
+    client = socketio.test_client(app, auth={"token": issue_token(user_id, app.config["SECRET_KEY"])[0]})
+    assert client.is_connected()
+    counts = {}
+    with app.app_context():
+        engine = db.engine
+    with StatementCounter(engine) as counter:
+        client.emit("join_room", {"room_code": "TESTROOM"})
+    counts["join_room"] = counter.count
+    with StatementCounter(engine) as counter:
+        client.emit("send_message", {"room_code": "TESTROOM", "message": "hello"})
+    counts["send_message"] = counter.count
+    with StatementCounter(engine) as counter:
+        client.emit("send_message", {"room_code": "TESTROOM", "message": "hello again"})
+    counts["send_message_warm"] = counter.count
+    client.disconnect()
+    return counts
+
+
+@pytest.mark.parametrize("history", [10, 2000])
+def test_loading_room_and_user_is_one_statement(app, room_and_user, history):
+    room_id, user_id = room_and_user
+    _seed_history(app, room_id, user_id, history)
+    with app.app_context():
+        engine = db.engine
+        with StatementCounter(engine) as counter:
+            db.session.get(Room, room_id)
+            db.session.get(User, user_id)
+        assert counter.count == 2
+
+
+def test_socket_event_statements_do_not_grow_with_history(app, room_and_user):
+    room_id, user_id = room_and_user
+    _seed_history(app, room_id, user_id, 10)
+    small = _statements_per_event(app, room_id, user_id)
+    _seed_history(app, room_id, user_id, 5000)
+    large = _statements_per_event(app, room_id, user_id)
+
+    assert small == large
+    # room and username lookups, then served from the lookup cache
+    assert large["join_room"] <= 2
+    # the agent context buffer hydrates once per room, then sending is db-free
+    assert large["send_message"] <= 1
+    assert large["send_message_warm"] == 0